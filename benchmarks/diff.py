@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+"""
+Benchmark generating the diff of a code review upload: a diff of the deletions plus a diff with copy detection,
+against a single diff with copy detection that the deletions are taken from.
+
+Builds a throwaway repository shaped like mongo with git fast-import: many files in nested directories and a long
+history, then a ticket commit that modifies, deletes and renames files, as `m review` uploads it (`--rev HEAD~1`,
+compared with the working tree). Both ways must produce the same bytes.
+
+Usage: python3 benchmarks/diff.py [--runs N] [--files N] [--commits N] [--changes N]
+"""
+import argparse
+import os
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+
+def _git(*args):
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com', *args],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _content(path, version):
+    return ''.join(f'// {path} line {i} version {version}\n' for i in range(100)).encode()
+
+
+def _make_repo(files, commits, changes):
+    rnd = random.Random(0)
+    paths = [f'src/mongo/dir{i % 300:03}/sub{i % 7}/file{i:05}.cpp' for i in range(files)]
+
+    stream = []
+    for commit in range(commits):
+        touched = paths if commit == 0 else rnd.sample(paths, 20)
+        message = f'Commit {commit}'
+        stream.append(f'commit refs/heads/master\ncommitter bench <bench@example.com> {1500000000 + commit} +0000\n'
+                      f'data {len(message)}\n{message}\n'.encode())
+        for path in touched:
+            data = _content(path, commit)
+            stream.append(f'M 100644 inline {path}\ndata {len(data)}\n'.encode() + data + b'\n')
+    _git('init', '-q')
+    subprocess.run(['git', 'fast-import', '--quiet'], input=b''.join(stream), check=True)
+    _git('checkout', '-q', '-f', 'master')
+
+    # The ticket: modified, deleted and renamed files, of which some renamed with changes.
+    sample = rnd.sample(paths, changes)
+    third = changes // 3
+    for path in sample[:third]:
+        with open(path, 'a') as source_file:
+            source_file.write('// changed\n')
+    _git('rm', '-q', *sample[third:2 * third])
+    for path in sample[2 * third:]:
+        _git('mv', path, path.replace('.cpp', '_renamed.cpp'))
+    for path in sample[2 * third::2]:
+        with open(path.replace('.cpp', '_renamed.cpp'), 'a') as source_file:
+            source_file.write('// changed\n')
+    _git('commit', '-q', '-a', '-m', 'SERVER-1 Change some files')
+
+
+def _two_passes(upload, rev, similarity):
+    """
+    The diff as upload.py generated it before, with two diffs over the whole range.
+    """
+    cmd = ['diff', '--no-color', '--no-ext-diff', '--full-index', '--ignore-submodules', '--src-prefix=a/',
+           '--dst-prefix=b/']
+    diff = upload._git(*cmd, '--no-renames', '--diff-filter=D', rev)
+    diff += upload._git(*cmd, '--diff-filter=AMCRT', '-l100000', f'-C{similarity}%', '--find-copies-harder', rev)
+    return diff
+
+
+def _time(fns, runs):
+    """
+    Time the functions in turn, so that they see the same load on the machine.
+
+    :return: list of (median duration in ms, last result) for each function.
+    """
+    durations = [[] for _ in fns]
+    results = [None] * len(fns)
+    for _ in range(runs):
+        for i, fn in enumerate(fns):
+            start = time.perf_counter()
+            results[i] = fn()
+            durations[i].append((time.perf_counter() - start) * 1000)
+    return [(statistics.median(fn_durations), result) for fn_durations, result in zip(durations, results)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark generating the diff of a code review upload.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--files', type=int, default=30000)
+    parser.add_argument('--commits', type=int, default=2000)
+    parser.add_argument('--changes', type=int, default=300)
+    parser.add_argument('--similarity', type=int, default=90)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home, tempfile.TemporaryDirectory() as repo:
+        os.environ['HOME'] = home
+        from mongodb_cmdline_tool import upload
+
+        os.chdir(repo)
+        _make_repo(args.files, args.commits, args.changes)
+
+        (before_ms, before), (after_ms, after) = _time([
+            lambda: _two_passes(upload, 'HEAD~1', args.similarity),
+            lambda: upload.generate_diff('HEAD~1', args.similarity),
+        ], args.runs)
+        if before != after:
+            print('[ERROR] The diffs differ')
+            return 1
+
+        print(f'{args.files} files, {args.commits} commits, {args.changes} changed by the ticket, '
+              f'{len(upload._encode(after))} byte diff, identical')
+        print(f'two diffs        {before_ms:8.1f}ms')
+        print(f'single pass      {after_ms:8.1f}ms   {before_ms / after_ms:.2f}x faster')
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
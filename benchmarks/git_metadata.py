@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+"""
+Benchmark reading git metadata directly against spawning git.
+
+Builds a throwaway repository with a ticket branch, packs half of its history so both loose and
+packed refs and objects are read, and times each question `m` asks per command.
+
+Usage: python3 benchmarks/git_metadata.py [--runs N] [--commits N]
+"""
+import argparse
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mongodb_cmdline_tool import git_metadata  # noqa: E402
+
+
+class _Context(object):
+    """
+    Stand-in for the invoke context, which git_metadata only uses to fall back to git.
+    """
+
+    def run(self, cmd, warn=False, hide=None):
+        raise AssertionError(f'unexpected fallback to `{cmd}`')
+
+
+def _git(*args):
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com', *args],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _make_repo(commits):
+    _git('init', '-q')
+    _git('checkout', '-q', '-b', 'master')
+    for i in range(commits):
+        pathlib.Path('file.txt').write_text(f'{i}\n' * (i + 1))
+        _git('add', 'file.txt')
+        _git('commit', '-q', '-m', f'SERVER-{i} Commit {i}')
+        if i == commits // 2:
+            _git('gc', '-q')
+    _git('checkout', '-q', '-b', f'server{commits}')
+
+
+def _time(fn, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) * 1000 / runs
+
+
+def _spawn(*args):
+    return lambda: subprocess.run(['git', *args], check=False, capture_output=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark git metadata reads.')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--commits', type=int, default=50)
+    args = parser.parse_args()
+
+    c = _Context()
+    with tempfile.TemporaryDirectory() as repo:
+        os.chdir(repo)
+        _make_repo(args.commits)
+
+        cases = [
+            ('current branch', _spawn('rev-parse', '--abbrev-ref', 'HEAD'),
+             lambda: git_metadata.current_branch(c)),
+            ('HEAD subject', _spawn('log', '--oneline', '-1', '--pretty=%s'),
+             lambda: git_metadata.head_subject(c)),
+            ('branch exists', _spawn('rev-parse', '--verify', 'master'),
+             lambda: git_metadata.branch_exists(c, 'master')),
+        ]
+
+        total_spawn = total_direct = 0
+        for name, spawn, direct in cases:
+            spawn_ms = _time(spawn, args.runs)
+            direct_ms = _time(direct, args.runs)
+            total_spawn += spawn_ms
+            total_direct += direct_ms
+            print(f'{name:<15} git {spawn_ms:7.2f}ms   direct {direct_ms:7.3f}ms')
+
+        # `m c`, `m r` and `m p` each ask for the branch and subject at least once.
+        print(f'{"per command":<15} git {total_spawn:7.2f}ms   direct {total_direct:7.3f}ms   '
+              f'saved {total_spawn - total_direct:.2f}ms')
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
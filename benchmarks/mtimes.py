@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+"""
+Benchmark the targets ninja rebuilds after the rebase round trip of `m p`, with and without keeping mtimes.
+
+Builds a throwaway repository where a base branch and a ticket branch each changed some files, with a build.ninja
+that compiles every file into an object. After a full build, it rebases the ticket onto the base on a temporary
+branch and checks the ticket out again, as `m p` does, and counts the targets `ninja -n` would rebuild.
+
+Usage: python3 benchmarks/mtimes.py [--files N] [--base-changes N] [--ticket-changes N]
+"""
+import argparse
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from invoke import Context  # noqa: E402
+
+from mongodb_cmdline_tool import mtimes  # noqa: E402
+
+
+def _git(*args):
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com', *args],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _change(paths, text):
+    for path in paths:
+        with open(path, 'a') as source_file:
+            source_file.write(text)
+
+
+def _make_repo(files, base_changes, ticket_changes):
+    sources = [f'src/file{i:05}.cpp' for i in range(files)]
+    os.mkdir('src')
+    for source in sources:
+        pathlib.Path(source).write_text(f'// {source}\n')
+    pathlib.Path('.gitignore').write_text('build.ninja\nbuild.m.lock\nout/\n.ninja_*\n')
+    with open('build.ninja', 'w') as manifest:
+        manifest.write('rule CXX\n  command = cp $in $out\n')
+        for source in sources:
+            manifest.write(f'build out/{source[4:-4]}.o: CXX {source}\n')
+
+    _git('init', '-q')
+    _git('checkout', '-q', '-b', 'master')
+    _git('add', '.')
+    _git('commit', '-q', '-m', 'Initial commit')
+
+    _git('checkout', '-q', '-b', 'base')
+    _change(sources[:base_changes], '// base\n')
+    _git('commit', '-q', '-a', '-m', 'Base change')
+
+    _git('checkout', '-q', '-b', 'server1', 'master')
+    _change(sources[-ticket_changes:], '// ticket\n')
+    _git('commit', '-q', '-a', '-m', 'SERVER-1 Ticket change')
+
+
+def _round_trip():
+    _git('checkout', '-q', '-B', 'patch-build-branch')
+    _git('rebase', 'base')
+    _git('checkout', '-q', 'server1')
+
+
+def _rebuilt_targets():
+    res = subprocess.run(['ninja', '-n'], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return sum(1 for line in res.stdout.splitlines() if line.startswith('['))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rebuilds after the rebase round trip of `m p`.')
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--base-changes', type=int, default=500)
+    parser.add_argument('--ticket-changes', type=int, default=20)
+    args = parser.parse_args()
+
+    if not shutil.which('ninja'):
+        print('[ERROR] ninja is not installed')
+        return 1
+
+    c = Context()
+    with tempfile.TemporaryDirectory() as repo:
+        os.chdir(repo)
+        _make_repo(args.files, args.base_changes, args.ticket_changes)
+
+        subprocess.run(['ninja'], check=True, stdout=subprocess.DEVNULL)
+        _round_trip()
+        plain = _rebuilt_targets()
+
+        subprocess.run(['ninja'], check=True, stdout=subprocess.DEVNULL)
+        start = time.perf_counter()
+        with mtimes.preserved(c, 'base') as snap:
+            snapshot_ms = (time.perf_counter() - start) * 1000
+            _round_trip()
+            start = time.perf_counter()
+        restore_ms = (time.perf_counter() - start) * 1000
+        preserved = _rebuilt_targets()
+
+        print(f'{args.files} files, {args.base_changes} changed on the base branch, {args.ticket_changes} on the '
+              f'ticket')
+        print(f'plain round trip     rebuilds {plain:6} targets')
+        print(f'keeping mtimes       rebuilds {preserved:6} targets   avoided {plain - preserved}, '
+              f'{snap.restored} mtimes restored, snapshot {snapshot_ms:.0f}ms, restore {restore_ms:.0f}ms')
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+"""
+Startup-time benchmark for the `m` entry point.
+
+Times `m --help` and `m j` in a subprocess, both cold (empty bytecode cache, so every module is
+compiled from source) and warm (bytecode cache populated). `m j` runs against a throwaway git
+repository with a ticket branch and a throwaway $HOME, with $BROWSER set to `true` so nothing is
+opened.
+
+Usage: python3 benchmarks/startup.py [--runs N] [--help-budget-ms MS] [--jira-budget-ms MS]
+
+Exits with a non-zero status if the warm median of a command exceeds its budget.
+"""
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+kRepoRoot = pathlib.Path(__file__).resolve().parent.parent
+kEntryPoint = 'import sys; from mongodb_cmdline_tool.__main__ import main; sys.exit(main())'
+
+
+def _make_ticket_repo(parent):
+    repo = parent / 'mongo'
+    repo.mkdir()
+
+    def git(*args):
+        subprocess.run(['git', *args], cwd=repo, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+    git('init', '-q')
+    git('checkout', '-q', '-b', 'server12345')
+    (repo / 'README').write_text('benchmark\n')
+    git('add', 'README')
+    git('-c', 'user.name=bench', '-c', 'user.email=bench@example.com', 'commit', '-q', '-m',
+        'SERVER-12345 Benchmark commit')
+    return repo
+
+
+def _time_command(args, cwd, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', kEntryPoint, *args], cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def _bench(name, args, cwd, env, runs):
+    cold = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as pycache:
+            cold.append(_time_command(args, cwd, dict(env, PYTHONPYCACHEPREFIX=pycache)))
+
+    warm_env = dict(env, PYTHONPYCACHEPREFIX=str(pathlib.Path(env['HOME']) / 'pycache'))
+    _time_command(args, cwd, warm_env)  # Populate the bytecode cache.
+    warm = [_time_command(args, cwd, warm_env) for _ in range(runs)]
+
+    print(f'{name:<10} cold median {statistics.median(cold):7.1f}ms   '
+          f'warm median {statistics.median(warm):7.1f}ms   warm min {min(warm):7.1f}ms')
+    return statistics.median(warm)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark `m` startup time.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--help-budget-ms', type=float, default=None)
+    parser.add_argument('--jira-budget-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        home = pathlib.Path(tmp)
+        repo = _make_ticket_repo(home)
+        env = dict(os.environ,
+                   HOME=str(home),
+                   BROWSER='true',
+                   PYTHONPATH=os.pathsep.join(filter(None, [str(kRepoRoot), os.environ.get('PYTHONPATH')])))
+
+        # Both runs rely on writing bytecode, cold runs just write it somewhere that's thrown away.
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+        results = [
+            ('m --help', _bench('m --help', ['--help'], repo, env, args.runs), args.help_budget_ms),
+            ('m j', _bench('m j', ['j'], repo, env, args.runs), args.jira_budget_ms),
+        ]
+
+    failed = False
+    for name, warm, budget in results:
+        if budget is not None and warm > budget:
+            print(f'[ERROR] {name} took {warm:.1f}ms, over the budget of {budget:.1f}ms')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+"""
+Benchmark the working tree scans of `m c`, `m r` and upload.py against the status module.
+
+Builds a throwaway repository shaped like mongo: tracked sources under src/ and jstests/, an ignored build
+directory inside the tree, and a handful of changed and new files. Each scan is timed the way it ran before
+(`git add -u` plus `git add src/ jstests/`, `git status --porcelain`, `git ls-files --others`) and through the status
+module, which turns on the untracked cache and, where available, fsmonitor.
+
+Usage: python3 benchmarks/status.py [--runs N] [--files N] [--build-files N]
+"""
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+
+def _git(*args):
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com', *args],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _make_repo(files, build_files):
+    for i in range(files):
+        directory = pathlib.Path('src' if i % 10 else 'jstests') / f'dir{i % 200:03}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f'file{i}.cpp').write_text(f'// {i}\n')
+    for i in range(build_files):
+        directory = pathlib.Path('build') / f'dir{i % 500:03}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f'file{i}.o').write_text('')
+    pathlib.Path('.gitignore').write_text('build/\n')
+
+    _git('init', '-q')
+    _git('add', '.')
+    _git('commit', '-q', '-m', 'Initial commit')
+
+    for i in range(1, 51, 10):
+        with open(f'src/dir{i % 200:03}/file{i}.cpp', 'a') as source_file:
+            source_file.write('// changed\n')
+    pathlib.Path('src/dir001/new.cpp').write_text('// new\n')
+
+
+def _time(fn, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def _spawn(*cmds):
+    def run():
+        for cmd in cmds:
+            subprocess.run(['git', *cmd], check=True, stdout=subprocess.DEVNULL)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark working tree status scans.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--build-files', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home, tempfile.TemporaryDirectory() as repo:
+        # Keep the state the status module records out of the real one.
+        os.environ['HOME'] = home
+        from mongodb_cmdline_tool import status
+
+        os.chdir(repo)
+        _make_repo(args.files, args.build_files)
+
+        before = [
+            ('m c (stage)', _spawn(['add', '-u'], ['add', 'src/'], ['add', 'jstests/'])),
+            ('m r (dirty check)', _spawn(['status', '--porcelain'])),
+            ('upload.py unknown', _spawn(['ls-files', '--exclude-standard', '--others'])),
+        ]
+        before_ms = [_time(fn, args.runs) for _, fn in before]
+
+        # Staging isn't undone between runs, so both sides see the same already-staged index after the first one.
+        status.raw()  # Turns on the caches and fills them.
+        after = [
+            lambda: status.stage([entry.path for entry in status.status()
+                                  if entry.kind != '?' or entry.path.startswith(('src/', 'jstests/'))]),
+            lambda: status.status(untracked=False),
+            lambda: [entry.path for entry in status.status() if entry.kind == '?'],
+        ]
+        after_ms = [_time(fn, args.runs) for fn in after]
+
+        fsmonitor = subprocess.run(['git', 'config', '--get', 'core.fsmonitor'], stdout=subprocess.PIPE,
+                                   universal_newlines=True).stdout.strip() or 'off'
+        print(f'{args.files} tracked files, {args.build_files} ignored build files, untracked cache on, '
+              f'fsmonitor {fsmonitor}')
+        for (name, _), old, new in zip(before, before_ms, after_ms):
+            print(f'{name:<18} before {old:8.1f}ms   after {new:8.1f}ms')
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
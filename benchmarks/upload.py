@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+"""
+Benchmark reading the base files of a code review upload: one `git show` per file against one `git cat-file --batch`.
+
+Builds a throwaway repository with a commit that changes many files, renames some of them and changes a few files
+that are too large to upload, then reads the base version of every file the way upload.py used to and through
+upload.base_files(), and checks both read the same contents.
+
+Usage: python3 benchmarks/upload.py [--runs N] [--files N] [--large-files N]
+"""
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+
+def _git(*args):
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com', *args],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _make_repo(files, large_files):
+    os.mkdir('src')
+    for i in range(files):
+        pathlib.Path(f'src/file{i:04}.cpp').write_text(''.join(f'// line {j} of file {i}\n' for j in range(200)))
+    for i in range(large_files):
+        pathlib.Path(f'src/large{i}.bin').write_bytes(os.urandom(2 * 1024 * 1024))
+
+    _git('init', '-q')
+    _git('add', '.')
+    _git('commit', '-q', '-m', 'Initial commit')
+
+    for i in range(files):
+        with open(f'src/file{i:04}.cpp', 'a') as source_file:
+            source_file.write('// changed\n')
+    for i in range(large_files):
+        with open(f'src/large{i}.bin', 'ab') as large_file:
+            large_file.write(b'changed')
+    for i in range(0, files, 50):
+        _git('mv', f'src/file{i:04}.cpp', f'src/renamed{i:04}.cpp')
+    _git('commit', '-q', '-a', '-m', 'SERVER-1 Change every file')
+
+
+def _spawn_per_file(hashes, renames):
+    """
+    Base files read the way upload.py read them before, with one git process per file.
+    """
+    contents = {}
+    for filename in set(hashes) | set(renames):
+        hash_before = hashes.get(filename, (None, None))[0]
+        if filename in renames and filename not in hashes:
+            name = f'HEAD:{filename}'
+        else:
+            name = hash_before
+        if name:
+            contents[filename] = subprocess.run(['git', 'show', name], stdout=subprocess.PIPE, check=True).stdout
+    return contents
+
+
+def _time(fn, runs):
+    durations = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reading the base files of a code review upload.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--large-files', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home, tempfile.TemporaryDirectory() as repo:
+        os.environ['HOME'] = home
+        from mongodb_cmdline_tool import upload
+
+        os.chdir(repo)
+        _make_repo(args.files, args.large_files)
+        diff, hashes, renames = upload.post_process_diff(upload.generate_diff('HEAD~1', 90))
+
+        before_ms, before = _time(lambda: _spawn_per_file(hashes, renames), args.runs)
+        after_ms, after = _time(lambda: upload.base_files(diff, hashes, renames), args.runs)
+
+        for filename, base_file in after.items():
+            if base_file.too_large:
+                assert len(before[filename]) > upload.kMaxUploadSize, filename
+            elif base_file.content is not None:
+                assert base_file.content == before[filename], filename
+        too_large = sum(1 for base_file in after.values() if base_file.too_large)
+
+        print(f'{len(after)} changed files ({len(renames)} renamed, {too_large} over {upload.kMaxUploadSize} bytes)')
+        print(f'git show per file      {before_ms:8.1f}ms')
+        print(f'git cat-file --batch   {after_ms:8.1f}ms   {before_ms / after_ms:.1f}x faster')
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
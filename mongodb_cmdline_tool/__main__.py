@@ -1,12 +1,34 @@
 #! /usr/bin/env python3
 
-from invoke import Program, Collection
+import sys
 
-from mongodb_cmdline_tool import setupenv
-from mongodb_cmdline_tool import tasks
+from mongodb_cmdline_tool import daemon
+from mongodb_cmdline_tool.utils import report_self_update
 
+kSetupEnvCollection = 'setup-dev-env'
+
+# Core invoke flags that need to see every task, including the ones in setup-dev-env.
+kListAllFlags = ('-l', '--list', '--complete', '--print-completion-script')
+
+
+def _needs_setupenv(argv):
+    """
+    Whether the command line refers to the setup-dev-env collection.
+
+    setupenv is only used for one-off machine setup, so it is only imported when it is asked for
+    or when all tasks are listed.
+    """
+    for arg in argv[1:]:
+        if arg.startswith(kSetupEnvCollection) or arg.split('=')[0] in kListAllFlags:
+            return True
+    return False
+
+
+def make_program(argv):
+    from invoke import Program, Collection
+
+    from mongodb_cmdline_tool import tasks
 
-def main():
     config = {
         'run': {
             'echo': True
@@ -15,12 +37,27 @@ def main():
     }
 
     ns = Collection.from_module(tasks, config=config)
-    ns.add_collection(Collection.from_module(setupenv, name='setup-dev-env', config=config))
+    if _needs_setupenv(argv):
+        from mongodb_cmdline_tool import setupenv
+        ns.add_collection(Collection.from_module(setupenv, name=kSetupEnvCollection, config=config))
 
-    p = Program(
+    return Program(
         binary='m(mongodb command line tool)',
         name='MongoDB Command Line Tool',
         namespace=ns,
         version='1.0.0-alpha2')
 
-    p.run()
+
+def main():
+    report_self_update()
+
+    # Hand the command over to the daemon if it's running, it already has everything loaded.
+    exit_code = daemon.forward(sys.argv)
+    if exit_code is not None:
+        return exit_code
+
+    make_program(sys.argv).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""
+Run ninja with parallelism that fits the memory and load of the machine.
+
+The number of jobs comes from the available memory, the load average and how much memory compiles and links
+needed in earlier builds. Links get their own ninja pool, since a handful of them can use more memory than all
+compiles together. While the build runs, a monitor pauses compile jobs when memory runs low and resumes them when
+it recovers. A paused job doesn't free its memory, but it stops growing, and ninja doesn't start new jobs in its
+place because it still counts against -j.
+
+To get the link pool, ninja builds a copy of build.ninja that puts the link rules in the pool. ninja regenerates
+the copy itself whenever build.ninja changes.
+"""
+import contextlib
+import fcntl
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from mongodb_cmdline_tool import build_history, ccache, git_metadata, progress, store
+from mongodb_cmdline_tool.utils import print_bold
+
+kManifest = 'build.ninja'
+kDerivedManifest = 'build.m.ninja'
+kPoolsManifest = 'build.m-pools.ninja'
+kLinkPool = 'm_link'
+kBuildLog = 'build.m.log'
+kBuildLock = 'build.m.lock'
+
+# The scons module that generates build.ninja, cloned into each checkout by setup-dev-env.macos-extra.
+kNinjaModuleDir = os.path.join('src', 'mongo', 'db', 'modules', 'ninja')
+kGenerateManifestCmd = 'python buildscripts/scons.py CC=clang CXX=clang++ CCACHE=ccache ' \
+                       'CCFLAGS=-Wa,--compress-debug-sections MONGO_VERSION=\'0.0.0\' MONGO_GIT_HASH=\'unknown\' ' \
+                       'VARIANT_DIR=ninja --modules=ninja build.ninja'
+
+# Priority of builds that run in the background, e.g. from `m watch`.
+kBackgroundNiceness = 10
+
+kGiB = 1024 ** 3
+
+# Memory used by a single job when we haven't seen one yet.
+kDefaultCompileRss = 1 * kGiB
+kDefaultLinkRss = 4 * kGiB
+
+kMonitorSecs = 2
+
+# Compiles are paused when less than this fraction of the memory is available, and resumed above twice as much.
+kPauseBelowFraction = 0.05
+
+
+def memory():
+    """
+    :return: (total, available) memory in bytes.
+    """
+    if sys.platform == 'darwin':
+        total = int(subprocess.check_output(['sysctl', '-n', 'hw.memsize']))
+        vm_stat = subprocess.check_output(['vm_stat'], universal_newlines=True)
+        page_size = int(re.search(r'page size of ([0-9]+) bytes', vm_stat).group(1))
+        pages = re.findall(r'Pages (?:free|inactive|speculative):\s+([0-9]+)', vm_stat)
+        return total, sum(int(count) for count in pages) * page_size
+
+    meminfo = {}
+    with open('/proc/meminfo') as meminfo_file:
+        for line in meminfo_file:
+            key, _, value = line.partition(':')
+            meminfo[key] = int(value.split()[0]) * 1024
+    return meminfo['MemTotal'], meminfo['MemAvailable']
+
+
+def format_bytes(size):
+    return f'{size / kGiB:.1f} GiB'
+
+
+def _processes():
+    """
+    :return: dict of pid to (parent pid, rss in bytes, command line) of every process.
+    """
+    ps = subprocess.run(['ps', '-A', '-o', 'pid=,ppid=,rss=,args='], stdout=subprocess.PIPE,
+                        universal_newlines=True)
+    processes = {}
+    for line in ps.stdout.splitlines():
+        fields = line.split(None, 3)
+        if len(fields) == 4:
+            processes[int(fields[0])] = (int(fields[1]), int(fields[2]) * 1024, fields[3])
+    return processes
+
+
+def _classify(cmd):
+    """
+    :return: ('compile' or 'link', output file) of a job, or (None, None) for anything else.
+    """
+    if cmd.startswith(('/bin/sh -c ', 'sh -c ')):
+        cmd = cmd.split(' -c ', 1)[1]
+    output = re.search(r'\s-o\s*(\S+)', cmd)
+    if not output:
+        return None, None
+    kind = 'compile' if re.search(r'\s-c(\s|$)', cmd) else 'link'
+    return kind, output.group(1)
+
+
+class _Job(object):
+
+    def __init__(self, pid, kind, target):
+        self.pid = pid
+        self.kind = kind
+        self.target = target
+        self.pids = [pid]
+        self.rss = 0
+        self.peak_rss = 0
+
+
+class _Monitor(threading.Thread):
+    """
+    Sample the memory of ninja's jobs and pause or resume compiles as the available memory changes.
+    """
+
+    def __init__(self, ninja_pid, total_memory):
+        super().__init__(daemon=True)
+        self.ninja_pid = ninja_pid
+        self.pause_below = total_memory * kPauseBelowFraction
+        self.resume_above = 2 * self.pause_below
+        self.jobs = {}
+        self.paused = []
+        self.pauses = 0
+        self.peak_rss = 0
+        self.min_available = total_memory
+        self.link_peaks = {}
+        self.compile_peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(kMonitorSecs):
+            self.sample()
+
+    def _update_jobs(self):
+        processes = _processes()
+        children = {}
+        for pid, (parent, _, _) in processes.items():
+            children.setdefault(parent, []).append(pid)
+
+        jobs = {}
+        for pid in children.get(self.ninja_pid, []):
+            job = self.jobs.get(pid)
+            if not job:
+                job = _Job(pid, *_classify(processes[pid][2]))
+            job.pids = [pid]
+            for p in job.pids:
+                job.pids.extend(children.get(p, []))
+            job.rss = sum(processes[p][1] for p in job.pids)
+            job.peak_rss = max(job.peak_rss, job.rss)
+            jobs[pid] = job
+
+        for pid, job in self.jobs.items():
+            if pid not in jobs:
+                self._finished(job)
+        self.jobs = jobs
+
+    def _finished(self, job):
+        if job.kind == 'link':
+            self.link_peaks[job.target] = max(self.link_peaks.get(job.target, 0), job.peak_rss)
+        elif job.kind == 'compile':
+            self.compile_peak = max(self.compile_peak, job.peak_rss)
+
+    def _signal(self, job, sig):
+        for pid in job.pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def sample(self):
+        self._update_jobs()
+        self.paused = [job for job in self.paused if job.pid in self.jobs]
+        self.peak_rss = max(self.peak_rss, sum(job.rss for job in self.jobs.values()))
+
+        _, available = memory()
+        self.min_available = min(self.min_available, available)
+
+        running = [job for job in self.jobs.values() if job not in self.paused]
+        compiles = [job for job in running if job.kind == 'compile']
+        if available < self.pause_below and compiles and len(running) > 1:
+            # Pause the newest compile, the older ones are closer to finishing and giving their memory back.
+            job = max(compiles, key=lambda j: j.pid)
+            self._signal(job, signal.SIGSTOP)
+            self.paused.append(job)
+            self.pauses += 1
+        elif self.paused and (available > self.resume_above or not running):
+            # Always keep one job running, otherwise the build never finishes.
+            self._signal(self.paused.pop(0), signal.SIGCONT)
+
+    def stop(self):
+        if self._done.is_set():
+            return
+        self._done.set()
+        self.join()
+        for job in self.paused:
+            self._signal(job, signal.SIGCONT)
+        self.paused = []
+        for job in self.jobs.values():
+            self._finished(job)
+
+
+def derive_manifest():
+    """
+    Write a copy of build.ninja that runs link rules in the link pool, and rebuilds itself when build.ninja changes.
+    """
+    with open(kManifest) as manifest_file:
+        lines = manifest_file.read().split('\n')
+
+    link_rules = {line.split()[1] for line in lines
+                  if line.startswith('rule ') and 'link' in line.split()[1].lower()}
+
+    derived = [f'include {kPoolsManifest}']
+    in_link_block = False
+    for line in lines:
+        if line.startswith('rule '):
+            in_link_block = line.split()[1] in link_rules
+            derived.append(line)
+            if in_link_block:
+                derived.append(f'  pool = {kLinkPool}')
+            continue
+        if line.startswith('build '):
+            rule = re.match(r'build\s.*?(?<!\$):\s*(\S+)', line)
+            in_link_block = bool(rule) and rule.group(1) in link_rules
+        elif line and not line[0].isspace():
+            in_link_block = False
+        if in_link_block and re.match(r'\s+pool\s*=', line):
+            continue
+        derived.append(line)
+
+    derived += [
+        'rule m_derive_manifest',
+        f'  command = {sys.executable} -m mongodb_cmdline_tool.build',
+        f'  description = Adding the {kLinkPool} pool to {kManifest}',
+        '  generator = 1',
+        f'build {kDerivedManifest}: m_derive_manifest {kManifest}',
+        '',
+    ]
+    with open(f'{kDerivedManifest}.tmp', 'w') as derived_file:
+        derived_file.write('\n'.join(derived))
+    os.replace(f'{kDerivedManifest}.tmp', kDerivedManifest)
+
+
+def _write_pools(link_depth):
+    with open(kPoolsManifest, 'w') as pools_file:
+        pools_file.write(f'pool {kLinkPool}\n  depth = {link_depth}\n')
+
+
+def _history():
+    """
+    :return: memory needed by a compile and by a link, based on earlier builds.
+    """
+    conn = store.connect()
+    link_rss = conn.execute('SELECT MAX(peak_rss) FROM link_memory').fetchone()[0]
+    compile_rss = store.get_meta('compile_peak_rss')
+    return float(compile_rss or kDefaultCompileRss), link_rss or kDefaultLinkRss
+
+
+def _record(monitor):
+    now = time.time()
+    with store.transaction() as conn:
+        conn.executemany('INSERT OR REPLACE INTO link_memory VALUES (?, ?, ?)',
+                         [(target, peak, now) for target, peak in monitor.link_peaks.items()])
+    if monitor.compile_peak:
+        store.set_meta('compile_peak_rss', str(monitor.compile_peak))
+
+
+def choose_settings(available, load, compile_rss, link_rss, cpus=None):
+    """
+    :return: (jobs, link pool depth).
+    """
+    cpus = cpus or os.cpu_count()
+    # The load average counts whatever else is running, such as tests, so leave their cores to them.
+    cpu_jobs = max(1, cpus - int(load))
+    memory_jobs = max(1, int(available / compile_rss))
+    jobs = min(cpu_jobs, memory_jobs)
+    link_depth = max(1, min(jobs, int(available / link_rss)))
+    return jobs, link_depth
+
+
+def generate_manifest(c):
+    """
+    Generate build.ninja in the current directory with scons.
+    """
+    c.run(kGenerateManifestCmd)
+
+
+def prepare_manifest():
+    if not os.path.isfile(kManifest):
+        print(f'[ERROR] No {kManifest} in the current directory, run "m setup-dev-env.macos-extra" to generate it')
+        sys.exit(1)
+
+    if not os.path.isfile(kDerivedManifest) or os.stat(kDerivedManifest).st_mtime < os.stat(kManifest).st_mtime:
+        derive_manifest()
+
+
+@contextlib.contextmanager
+def build_lock(directory='.'):
+    """
+    Hold the lock of a build directory, so two builds never run at the same time, e.g. `m scons` and `m watch`.
+    """
+    with open(os.path.join(directory, kBuildLock), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print_bold('Waiting for the other build in this directory to finish...')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def run_ninja(c, targets=(), jobs=None, verbose=False, background=False):
+    """
+    Build with ninja in the current directory and report the settings and the memory used.
+
+    :param jobs: number of jobs to run instead of picking one.
+    :param verbose: print every step as ninja does, instead of a single progress line.
+    :param background: run the build at a low priority, so it doesn't get in the way of other work.
+    :return: ninja's exit code.
+    """
+    prepare_manifest()
+    with build_lock():
+        return _run_ninja(c, targets, jobs, verbose, background)
+
+
+def _run_ninja(c, targets, jobs, verbose, background):
+    total, available = memory()
+    load = os.getloadavg()[0]
+    compile_rss, link_rss = _history()
+    chosen_jobs, link_depth = choose_settings(available, load, compile_rss, link_rss)
+    jobs = int(jobs or chosen_jobs)
+    _write_pools(link_depth)
+
+    print_bold(f'Building with -j{jobs} and up to {link_depth} links at a time: {format_bytes(available)} of '
+               f'{format_bytes(total)} memory available, load average {load:.1f}, compiles need about '
+               f'{format_bytes(compile_rss)} and links {format_bytes(link_rss)}')
+
+    env = dict(os.environ)
+    if verbose:
+        if c.config.get('NINJA_STATUS'):
+            env['NINJA_STATUS'] = c.config.NINJA_STATUS
+    else:
+        env['NINJA_STATUS'] = progress.kStatusFormat
+    cmd = ['ninja', '-f', kDerivedManifest, f'-j{jobs}', *targets]
+    if c.config.run.echo:
+        print_bold(' '.join(cmd))
+
+    ccache_stats = None
+    if ccache.available():
+        ccache.apply_max_size()
+        ccache_stats = ccache.stats()
+
+    preexec_fn = (lambda: os.nice(kBackgroundNiceness)) if background else None
+    if verbose:
+        proc = subprocess.Popen(cmd, env=env, preexec_fn=preexec_fn)
+    else:
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, errors='replace', preexec_fn=preexec_fn)
+    monitor = _Monitor(proc.pid, total)
+    monitor.start()
+    try:
+        if verbose:
+            proc.wait()
+        else:
+            with open(kBuildLog, 'w') as log_file:
+                renderer = progress.Renderer(log_file)
+                for line in proc.stdout:
+                    renderer.feed(line)
+                proc.wait()
+                renderer.close()
+    except KeyboardInterrupt:
+        # ninja got the interrupt as well. Resume the paused jobs so they can stop, and let ninja clean up.
+        monitor.stop()
+        if proc.stdout:
+            proc.stdout.close()
+        proc.wait()
+        raise
+    finally:
+        monitor.stop()
+        _record(monitor)
+
+    build_history.ingest(build_history.find_log(kManifest), git_metadata.current_branch(c),
+                         git_metadata.resolve(c, 'HEAD'))
+
+    msg = f'Build jobs used up to {format_bytes(monitor.peak_rss)} together, the least available memory was ' \
+          f'{format_bytes(monitor.min_available)}'
+    if monitor.pauses:
+        msg += f'. Paused compiles {monitor.pauses} time(s) to let memory recover'
+    print_bold(msg)
+
+    if ccache_stats is not None:
+        summary = ccache.summarize(ccache_stats, ccache.stats() or ccache_stats)
+        if summary:
+            print_bold(summary)
+        elif monitor.compile_peak:
+            print('[INFO] No compiles went through ccache, regenerate build.ninja with CCACHE=ccache to cache them, '
+                  'e.g. with "m setup-dev-env.macos-extra"')
+    return proc.returncode
+
+
+if __name__ == '__main__':
+    derive_manifest()
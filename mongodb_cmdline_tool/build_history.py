@@ -0,0 +1,226 @@
+"""
+History of build steps, read from ninja's .ninja_log after every `m scons`.
+
+ninja appends a line per finished step to .ninja_log: its start and end time in milliseconds since the start of
+the run, the mtime and name of the output, and a hash of the command. Only the part of the log that was added
+since the last build is read, one line at a time, so the size of the log doesn't matter. ninja occasionally
+rewrites the log to drop old entries; that's noticed by the log being a different file or shorter than what was
+read, and it's read again from the start, skipping the steps we have already.
+"""
+import bisect
+import json
+import os
+import statistics
+import time
+
+from mongodb_cmdline_tool import store
+
+kLogName = '.ninja_log'
+kBatchSize = 5000
+
+# Runs kept per log, older ones are dropped.
+kMaxRuns = 200
+
+# Steps only count as regressed if they got slower by at least this much.
+kMinRegressionMs = 1000
+kMinRegressionRatio = 1.25
+
+
+def find_log(manifest='build.ninja'):
+    """
+    :return: the path of .ninja_log, which is in the builddir of the manifest or else in the current directory.
+    """
+    build_dir = '.'
+    with open(manifest) as manifest_file:
+        for line in manifest_file:
+            if line.startswith('builddir'):
+                build_dir = line.partition('=')[2].strip()
+                break
+            if line.startswith('build '):
+                break  # builddir is declared before the build edges.
+    return os.path.abspath(os.path.join(build_dir, kLogName))
+
+
+class _RunWriter(object):
+    """
+    Insert the steps of the runs in a log in batches, as they are read.
+    """
+
+    def __init__(self, conn, log_path):
+        self.conn = conn
+        self.log_path = log_path
+        self.run_id = None
+        self.run_ids = []
+        self.batch = []
+
+    def add(self, step):
+        if self.run_id is None:
+            self.run_id = self.conn.execute('INSERT INTO build_runs (log_path, recorded_at) VALUES (?, ?)',
+                                            (self.log_path, time.time())).lastrowid
+        self.batch.append((self.run_id, self.log_path, *step))
+        if len(self.batch) >= kBatchSize:
+            self.flush()
+
+    def flush(self):
+        # Steps we have already, e.g. when reading a rewritten log again, are skipped.
+        self.conn.executemany('INSERT OR IGNORE INTO build_steps VALUES (?, ?, ?, ?, ?, ?, ?)', self.batch)
+        self.batch = []
+
+    def end_run(self):
+        if self.run_id is None:
+            return
+        self.flush()
+        steps, duration_ms, cpu_ms = self.conn.execute(
+            'SELECT COUNT(*), MAX(end_ms) - MIN(start_ms), SUM(end_ms - start_ms) FROM build_steps WHERE run_id = ?',
+            (self.run_id,)).fetchone()
+        if steps:
+            self.conn.execute('UPDATE build_runs SET steps = ?, duration_ms = ?, cpu_ms = ? WHERE id = ?',
+                              (steps, duration_ms, cpu_ms, self.run_id))
+            self.run_ids.append(self.run_id)
+        else:
+            self.conn.execute('DELETE FROM build_runs WHERE id = ?', (self.run_id,))
+        self.run_id = None
+
+
+def ingest(log_path, branch=None, head=None):
+    """
+    Read the steps that were added to a .ninja_log since the last call.
+
+    :param branch: the branch that was built by the last run in the new part of the log. Earlier runs were
+        ninja invocations outside of m, for a branch we don't know.
+    :param head: the commit that was built by the last run.
+    :return: the number of runs that were recorded.
+    """
+    try:
+        stat = os.stat(log_path)
+    except FileNotFoundError:
+        return 0
+
+    meta_key = f'ninja_log:{log_path}'
+    position = json.loads(store.get_meta(meta_key, '{}'))
+    offset = position.get('offset', 0)
+    if position.get('inode') != stat.st_ino or stat.st_size < offset:
+        offset = 0  # ninja rewrote the log.
+
+    with store.transaction() as conn, open(log_path, 'rb') as log_file:
+        writer = _RunWriter(conn, log_path)
+        # Runs are told apart by the end times, which only go up within a run since ninja logs steps as they finish.
+        last_end = -1
+        log_file.seek(offset)
+        for line in log_file:
+            if not line.endswith(b'\n'):
+                break  # ninja is still writing it.
+            offset += len(line)
+            fields = line.decode('utf-8', errors='replace').rstrip('\n').split('\t')
+            if line.startswith(b'#') or len(fields) != 5:
+                continue
+            start_ms, end_ms, mtime = int(fields[0]), int(fields[1]), int(fields[2])
+            if end_ms < last_end:
+                writer.end_run()
+            last_end = end_ms
+            writer.add((fields[3], start_ms, end_ms, mtime, fields[4]))
+        writer.end_run()
+
+        if writer.run_ids:
+            conn.execute('UPDATE build_runs SET branch = ?, head = ? WHERE id = ?', (branch, head, writer.run_ids[-1]))
+            _prune(conn, log_path)
+        conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                     (meta_key, json.dumps({'inode': stat.st_ino, 'offset': offset})))
+    return len(writer.run_ids)
+
+
+def _prune(conn, log_path):
+    old_runs = [row[0] for row in conn.execute('SELECT id FROM build_runs WHERE log_path = ? ORDER BY id DESC '
+                                               'LIMIT -1 OFFSET ?', (log_path, kMaxRuns))]
+    for run_id in old_runs:
+        conn.execute('DELETE FROM build_steps WHERE run_id = ?', (run_id,))
+        conn.execute('DELETE FROM build_runs WHERE id = ?', (run_id,))
+
+
+def latest_run(log_path):
+    """
+    :return: the id of the last recorded run of a log, or None.
+    """
+    row = store.connect().execute('SELECT MAX(id) FROM build_runs WHERE log_path = ?', (log_path,)).fetchone()
+    return row[0]
+
+
+def slowest(log_path, limit):
+    """
+    :return: list of (output, last duration, average duration, times built, total time) of the steps that took the
+        most time altogether, in milliseconds.
+    """
+    rows = store.connect().execute(
+        'SELECT output, (SELECT end_ms - start_ms FROM build_steps last WHERE last.log_path = s.log_path AND '
+        'last.output = s.output ORDER BY run_id DESC LIMIT 1), AVG(end_ms - start_ms), COUNT(*), '
+        'SUM(end_ms - start_ms) AS total FROM build_steps s WHERE log_path = ? GROUP BY output '
+        'ORDER BY total DESC LIMIT ?', (log_path, limit))
+    return rows.fetchall()
+
+
+def regressions(log_path, run_id, limit):
+    """
+    Compare the steps of a run with the median of their earlier durations.
+
+    :return: list of (output, duration, earlier median) of the steps that got the most slower, in milliseconds.
+    """
+    rows = store.connect().execute(
+        'SELECT s.output, s.end_ms - s.start_ms, earlier.end_ms - earlier.start_ms FROM build_steps s '
+        'JOIN build_steps earlier ON earlier.log_path = s.log_path AND earlier.output = s.output '
+        'WHERE s.run_id = ? AND earlier.run_id < s.run_id', (run_id,))
+    durations = {}
+    earlier = {}
+    for output, duration, earlier_duration in rows:
+        durations[output] = duration
+        earlier.setdefault(output, []).append(earlier_duration)
+
+    regressed = []
+    for output, duration in durations.items():
+        median = statistics.median(earlier[output])
+        if duration - median >= kMinRegressionMs and duration >= median * kMinRegressionRatio:
+            regressed.append((output, duration, median))
+    regressed.sort(key=lambda r: r[1] - r[2], reverse=True)
+    return regressed[:limit]
+
+
+def critical_path(run_id):
+    """
+    Estimate the chain of steps that determined how long a run took.
+
+    The log doesn't say which steps depend on each other, so starting from the step that finished last, each
+    step is assumed to have waited for the step that finished last before it started.
+
+    :return: list of (output, start, end) from the first step of the chain to the last, in milliseconds.
+    """
+    steps = store.connect().execute('SELECT output, start_ms, end_ms FROM build_steps WHERE run_id = ? '
+                                    'ORDER BY end_ms', (run_id,)).fetchall()
+    if not steps:
+        return []
+
+    ends = [end for _, _, end in steps]
+    i = len(steps) - 1
+    path = [steps[i]]
+    while True:
+        i = bisect.bisect_right(ends, steps[i][1], 0, i) - 1
+        if i < 0:
+            break
+        path.append(steps[i])
+    return path[::-1]
+
+
+def branch_switches(log_path, limit):
+    """
+    :return: list of (from branch, to branch, steps, cpu time, duration) of the first builds after switching branches,
+        most recent first.
+    """
+    rows = store.connect().execute('SELECT branch, steps, cpu_ms, duration_ms FROM build_runs WHERE log_path = ? '
+                                   'ORDER BY id', (log_path,))
+    switches = []
+    previous = None
+    for branch, steps, cpu_ms, duration_ms in rows:
+        if not branch:
+            continue  # Built outside of m.
+        if previous and branch != previous:
+            switches.append((previous, branch, steps, cpu_ms, duration_ms))
+        previous = branch
+    return switches[::-1][:limit]
@@ -0,0 +1,78 @@
+"""
+Helpers for ccache, which lets switching between branches reuse the objects compiled on the other branch.
+
+build.ninja runs the compiler through ccache when it was generated with CCACHE=ccache, see
+setup-dev-env.macos-extra. The size limit of the cache and how long unused entries are kept can be set with
+ccache_max_size and ccache_evict_days in the config file.
+"""
+import shutil
+import subprocess
+
+from mongodb_cmdline_tool import store
+from mongodb_cmdline_tool.utils import get_config
+
+kDefaultMaxSize = '20G'
+kDefaultEvictDays = 30
+
+
+def available():
+    return shutil.which('ccache') is not None
+
+
+def _ccache(*args):
+    return subprocess.run(['ccache', *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          universal_newlines=True)
+
+
+def apply_max_size():
+    """
+    Set the size limit of the cache from the config, if it changed. ccache evicts the least recently used
+    entries once the cache grows past it.
+    """
+    max_size = str(get_config('ccache_max_size', kDefaultMaxSize))
+    if store.get_meta('ccache_max_size') == max_size:
+        return
+    if _ccache('--max-size', max_size).returncode == 0:
+        store.set_meta('ccache_max_size', max_size)
+
+
+def evict_unused():
+    """
+    Drop entries that weren't used for ccache_evict_days, so the cache doesn't keep objects of long-gone branches
+    until it's full.
+    """
+    days = int(get_config('ccache_evict_days', kDefaultEvictDays))
+    return _ccache('--evict-older-than', f'{days}d').returncode == 0
+
+
+def stats():
+    """
+    :return: dict of ccache's statistics counters, or None if this version of ccache can't print them.
+    """
+    res = _ccache('--print-stats')
+    if res.returncode != 0:
+        return None
+    counters = {}
+    for line in res.stdout.splitlines():
+        key, _, value = line.partition('\t')
+        if value.isdigit():
+            counters[key] = int(value)
+    return counters
+
+
+def summarize(before, after):
+    """
+    :return: a line describing the hits and misses between two calls of stats(), or None if nothing was compiled
+        through ccache.
+    """
+    def delta(*keys):
+        return sum(after.get(key, 0) - before.get(key, 0) for key in keys)
+
+    hits = delta('direct_cache_hit', 'preprocessed_cache_hit')
+    misses = delta('cache_miss')
+    if not hits and not misses:
+        return None
+
+    size = after.get('cache_size_kibibyte', 0) / 1024 / 1024
+    return f'ccache: {hits} hits, {misses} misses ({100 * hits / (hits + misses):.0f}% hit rate), ' \
+           f'cache size {size:.1f} GiB'
@@ -0,0 +1,270 @@
+"""
+Optional per-user daemon that keeps Jira, config and module state warm between `m` invocations.
+
+The daemon listens on a unix socket. `m` connects to it, hands over its stdin/stdout/stderr along with
+its arguments, working directory and environment, and waits for an exit code. The daemon forks a
+child per request, so every command starts from the warm state (imported modules, parsed configs and
+an authenticated Jira session) without being able to modify it.
+
+This module is imported on every `m` invocation, so the client side must only use the standard library.
+"""
+import json
+import os
+import pathlib
+import signal
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+from mongodb_cmdline_tool.utils import config_path, state_dir
+
+kSocketPath = state_dir / 'daemon.sock'
+kPidPath = state_dir / 'daemon.pid'
+kLogPath = state_dir / 'daemon.log'
+
+# Set this environment variable to always run commands in-process.
+kNoDaemonEnv = 'M_NO_DAEMON'
+
+# Commands that must not be forwarded: managing the daemon itself and interactive machine setup.
+kInProcessCommands = ('daemon', 'setup-dev-env')
+
+kHeader = struct.Struct('!I')
+kInterrupt = b'\x03'
+
+# Sent instead of an exit code when the daemon runs another version of the tool than the client, e.g. after a
+# self-update; the daemon then exits and the client runs the command in-process.
+kStale = 0xffffffff
+
+# The version of the tool the daemon was started with, see _code_version().
+_served_version = None
+
+
+def _first_command(argv):
+    for arg in argv[1:]:
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+
+def _code_version():
+    """
+    :return: a stamp of the installed package, which changes when it's reinstalled, since that replaces its files.
+    """
+    package_dir = pathlib.Path(__file__).resolve().parent
+    module = os.stat(__file__)
+    return f'{os.stat(package_dir).st_mtime_ns}:{module.st_ino}:{module.st_mtime_ns}'
+
+
+def forward(argv):
+    """
+    Run the command in the daemon if one is running.
+
+    :return: the exit code of the command, or None if it should be run in-process.
+    """
+    if os.environ.get(kNoDaemonEnv):
+        return None
+
+    command = _first_command(argv)
+    if not command or command.split('.')[0] in kInProcessCommands:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(kSocketPath))
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        payload = json.dumps({'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ),
+                              'version': _code_version()}).encode()
+        socket.send_fds(sock, [kHeader.pack(len(payload))], [0, 1, 2])
+        sock.sendall(payload)
+
+        reply = b''
+        while len(reply) < kHeader.size:
+            try:
+                chunk = sock.recv(kHeader.size - len(reply))
+            except KeyboardInterrupt:
+                sock.sendall(kInterrupt)
+                continue
+            if not chunk:
+                print('[ERROR] Lost connection to the m daemon', file=sys.stderr)
+                return 1
+            reply += chunk
+
+    exit_code = kHeader.unpack(reply)[0]
+    if exit_code == kStale:
+        print('[INFO] Stopped the m daemon, which was running an older version of the tool. Run "m daemon" to start '
+              'it again', file=sys.stderr)
+        return None
+    return exit_code
+
+
+def is_running():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        try:
+            sock.connect(str(kSocketPath))
+        except OSError:
+            return False
+    return True
+
+
+def read_pid():
+    try:
+        return int(kPidPath.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _recv_exactly(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('client disconnected')
+        data += chunk
+    return data
+
+
+def _config_mtimes():
+    mtimes = []
+    for path in (pathlib.Path.home() / '.evergreen.yml', config_path):
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def _warm():
+    """
+    Import everything a command may need and build the state that is expensive to recreate.
+    """
+    import webbrowser  # noqa: F401
+    import yaml  # noqa: F401
+
+    from mongodb_cmdline_tool import tasks
+
+    tasks.jira_username = None
+    tasks.jira_cli = None
+    try:
+        tasks.init(None)
+        tasks.get_jira()
+    except Exception:
+        # Missing or invalid configs; commands will report the problem when they run.
+        traceback.print_exc()
+
+
+def _handle(conn):
+    """
+    Run a single forwarded command. Only ever called in a forked child.
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    header, fds, _, _ = socket.recv_fds(conn, kHeader.size, 3)
+    request = json.loads(_recv_exactly(conn, kHeader.unpack(header)[0]))
+    if request.get('version') != _served_version:
+        # The tool was reinstalled since the daemon started, so it would run old code.
+        os.kill(os.getppid(), signal.SIGTERM)
+        conn.sendall(kHeader.pack(kStale))
+        return 0
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = open(0, 'r', closefd=False)
+    sys.stdout = open(1, 'w', buffering=1, closefd=False)
+    sys.stderr = open(2, 'w', buffering=1, closefd=False)
+
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+
+    def relay_interrupts():
+        while conn.recv(1) == kInterrupt:
+            os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=relay_interrupts, daemon=True).start()
+
+    from mongodb_cmdline_tool import tasks
+    from mongodb_cmdline_tool.__main__ import make_program
+
+    if tasks.jira_cli:
+        # Don't share pooled connections with other children, the session itself stays authenticated.
+        tasks.jira_cli._session.close()
+
+    exit_code = 0
+    try:
+        make_program(request['argv']).run(request['argv'])
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    conn.sendall(kHeader.pack(exit_code))
+    return exit_code
+
+
+def _shutdown(*_):
+    try:
+        kSocketPath.unlink()
+        kPidPath.unlink()
+    except OSError:
+        pass
+    os._exit(0)
+
+
+def serve():
+    global _served_version
+
+    if is_running():
+        print('[ERROR] The m daemon is already running', file=sys.stderr)
+        return 1
+
+    state_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        kSocketPath.unlink()
+    except FileNotFoundError:
+        pass
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(kSocketPath))
+    os.chmod(kSocketPath, 0o600)
+    server.listen(16)
+    kPidPath.write_text(str(os.getpid()))
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Children are reaped automatically.
+
+    _served_version = _code_version()
+    _warm()
+    config_mtimes = _config_mtimes()
+
+    while True:
+        conn, _ = server.accept()
+        if _config_mtimes() != config_mtimes:
+            _warm()
+            config_mtimes = _config_mtimes()
+
+        if os.fork() == 0:
+            server.close()
+            try:
+                code = _handle(conn)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(serve())
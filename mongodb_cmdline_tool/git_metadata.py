@@ -0,0 +1,470 @@
+"""
+Answer simple questions about the current git repository by reading the .git directory directly.
+
+Spawning git costs tens of milliseconds on macOS, which adds up when every command asks for the
+current branch and the subject of the HEAD commit a few times. Linked worktrees share the refs and
+objects of the main repository and only have their own HEAD. Layouts this module doesn't read itself
+(GIT_DIR overrides, SHA-256 repositories, reftable ref storage, objects in alternates) fall back to running git.
+"""
+import bisect
+import mmap
+import os
+import pathlib
+import struct
+import zlib
+
+# Environment variables that change where git looks for the repository.
+kGitEnvOverrides = ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_COMMON_DIR', 'GIT_OBJECT_DIRECTORY',
+                    'GIT_ALTERNATE_OBJECT_DIRECTORIES', 'GIT_NAMESPACE')
+
+kObjectTypes = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+kOfsDelta = 6
+kRefDelta = 7
+
+# Refs that each worktree has its own copy of, besides pseudo-refs such as HEAD.
+kPerWorktreeRefs = ('refs/worktree/', 'refs/bisect/', 'refs/rewritten/')
+
+# Cache of packed-refs contents, keyed by path and invalidated by mtime.
+_packed_refs = {}
+
+# Cache of the mapped packs of each pack directory, invalidated by the mtime of the directory, which changes when
+# packs are added or removed.
+_packs = {}
+
+
+class Unsupported(Exception):
+    """
+    The repository uses a layout that is left to git itself.
+    """
+    pass
+
+
+def find_git_dir(path=None):
+    if any(var in os.environ for var in kGitEnvOverrides):
+        raise Unsupported('git environment overrides')
+
+    path = pathlib.Path(path or os.getcwd()).resolve()
+    for directory in (path, *path.parents):
+        dot_git = directory / '.git'
+        if dot_git.is_dir():
+            return _check_ref_storage(dot_git)
+        if dot_git.exists():
+            # A linked worktree or a submodule, whose .git file points to its git directory.
+            with open(dot_git) as dot_git_file:
+                content = dot_git_file.read().strip()
+            if not content.startswith('gitdir: '):
+                raise Unsupported(f'unknown .git file in {directory}')
+            return _check_ref_storage((directory / content[len('gitdir: '):]).resolve())
+    raise Unsupported('not a git repository')
+
+
+def _check_ref_storage(git_dir):
+    """
+    :return: git_dir, if its refs are stored as files.
+    """
+    # With reftable, HEAD is a stub that reads `ref: refs/heads/.invalid` and the refs are in reftable/.
+    if (_common_dir(git_dir) / 'reftable').is_dir():
+        raise Unsupported('reftable ref storage')
+    return git_dir
+
+
+def _common_dir(git_dir):
+    """
+    :return: the directory with the refs and objects shared by all the worktrees of a repository.
+    """
+    try:
+        with open(git_dir / 'commondir') as commondir_file:
+            return (git_dir / commondir_file.read().strip()).resolve()
+    except FileNotFoundError:
+        return git_dir
+
+
+def _read_packed_refs(git_dir):
+    path = git_dir / 'packed-refs'
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+
+    cached = _packed_refs.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    refs = {}
+    with open(path) as packed_refs_file:
+        for line in packed_refs_file:
+            if line.startswith(('#', '^')):
+                continue
+            sha, _, name = line.rstrip('\n').partition(' ')
+            refs[name] = sha
+    _packed_refs[path] = (mtime, refs)
+    return refs
+
+
+def _read_ref(git_dir, name):
+    """
+    :return: the contents of a ref, either a sha or 'ref: <target>', or None if it doesn't exist.
+    """
+    if name.startswith('refs/') and not name.startswith(kPerWorktreeRefs):
+        git_dir = _common_dir(git_dir)
+    try:
+        with open(git_dir / name) as ref_file:
+            return ref_file.read().strip()
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return _read_packed_refs(git_dir).get(name)
+
+
+def resolve_ref(git_dir, name):
+    """
+    Follow symbolic refs until reaching a sha.
+
+    :return: the sha, or None if the ref doesn't exist.
+    """
+    for _ in range(10):
+        value = _read_ref(git_dir, name)
+        if value is None or not value.startswith('ref: '):
+            break
+        name = value[len('ref: '):]
+    else:
+        raise Unsupported(f'symbolic ref loop at {name}')
+
+    if value is not None and len(value) != 40:
+        raise Unsupported('non-SHA-1 object names')
+    return value
+
+
+def _read_loose_object(git_dir, sha):
+    try:
+        with open(git_dir / 'objects' / sha[:2] / sha[2:], 'rb') as object_file:
+            raw = zlib.decompress(object_file.read())
+    except FileNotFoundError:
+        return None
+    header, _, data = raw.partition(b'\0')
+    return header.split(b' ')[0].decode(), data
+
+
+class _Pack(object):
+    """
+    A pack file and its version 2 index, mapped into memory.
+    """
+
+    def __init__(self, idx_path):
+        with open(idx_path, 'rb') as idx_file:
+            self.idx = mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(idx_path.with_suffix('.pack'), 'rb') as pack_file:
+            self.pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.idx[:8] != b'\377tOc\0\0\0\2':
+            raise Unsupported(f'unsupported pack index version in {idx_path}')
+        self.fanout = struct.unpack('>256I', self.idx[8:8 + 256 * 4])
+        self.count = self.fanout[-1]
+        self.shas_start = 8 + 256 * 4
+        self.offsets_start = self.shas_start + self.count * (20 + 4)
+        self.large_offsets_start = self.offsets_start + self.count * 4
+
+    def close(self):
+        self.idx.close()
+        self.pack.close()
+
+    def __getitem__(self, i):
+        """
+        The i-th sha in the index, which makes the pack usable with bisect.
+        """
+        start = self.shas_start + i * 20
+        return self.idx[start:start + 20]
+
+    def find(self, sha):
+        """
+        :return: the offset of an object in the pack, or None if it's not in this pack.
+        """
+        binary_sha = bytes.fromhex(sha)
+        lo = self.fanout[binary_sha[0] - 1] if binary_sha[0] else 0
+        hi = self.fanout[binary_sha[0]]
+        i = bisect.bisect_left(self, binary_sha, lo, hi)
+        if i == hi or self[i] != binary_sha:
+            return None
+
+        start = self.offsets_start + i * 4
+        offset = struct.unpack('>I', self.idx[start:start + 4])[0]
+        if offset & 0x80000000:
+            start = self.large_offsets_start + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', self.idx[start:start + 8])[0]
+        return offset
+
+    def _inflate(self, start, size):
+        decompressor = zlib.decompressobj()
+        data = b''
+        # Compressed data is rarely much larger than the original, so this is almost always one step.
+        chunk = size + 1024
+        while len(data) < size and not decompressor.eof and start < len(self.pack):
+            data += decompressor.decompress(self.pack[start:start + chunk])
+            start += chunk
+            chunk = 64 * 1024
+        return data
+
+    def read(self, offset, packs):
+        byte = self.pack[offset]
+        object_type = (byte >> 4) & 7
+        size = byte & 0x0f
+        shift = 4
+        pos = offset + 1
+        while byte & 0x80:
+            byte = self.pack[pos]
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            pos += 1
+
+        if object_type in kObjectTypes:
+            return kObjectTypes[object_type], self._inflate(pos, size)
+
+        if object_type == kOfsDelta:
+            byte = self.pack[pos]
+            base_offset = byte & 0x7f
+            pos += 1
+            while byte & 0x80:
+                byte = self.pack[pos]
+                base_offset = ((base_offset + 1) << 7) | (byte & 0x7f)
+                pos += 1
+            base_type, base = self.read(offset - base_offset, packs)
+        elif object_type == kRefDelta:
+            base_type, base = _read_object_from(packs, self.pack[pos:pos + 20].hex(), None)
+            pos += 20
+        else:
+            raise Unsupported(f'unknown pack object type {object_type}')
+
+        return base_type, _apply_delta(base, self._inflate(pos, size))
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _apply_delta(base, delta):
+    _, pos = _read_varint(delta, 0)  # Size of the base.
+    _, pos = _read_varint(delta, pos)  # Size of the result.
+    result = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            copy_offset = copy_size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    copy_offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (1 << (4 + i)):
+                    copy_size |= delta[pos] << (8 * i)
+                    pos += 1
+            result += base[copy_offset:copy_offset + (copy_size or 0x10000)]
+        elif op:
+            result += delta[pos:pos + op]
+            pos += op
+        else:
+            raise Unsupported('invalid delta opcode')
+    return bytes(result)
+
+
+def _load_packs(git_dir):
+    pack_dir = git_dir / 'objects' / 'pack'
+    try:
+        mtime = os.stat(pack_dir).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    cached = _packs.get(pack_dir)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    packs = [_Pack(idx_path) for idx_path in sorted(pack_dir.glob('*.idx'))]
+    if cached:
+        for pack in cached[1]:
+            pack.close()
+    _packs[pack_dir] = (mtime, packs)
+    return packs
+
+
+def _read_object_from(packs, sha, git_dir):
+    if git_dir:
+        loose = _read_loose_object(git_dir, sha)
+        if loose:
+            return loose
+    for pack in packs:
+        offset = pack.find(sha)
+        if offset is not None:
+            return pack.read(offset, packs)
+    raise Unsupported(f'object {sha} not found, it may be in an alternate object store')
+
+
+def read_object(git_dir, sha):
+    """
+    :return: (type, data) of an object.
+    """
+    git_dir = _common_dir(git_dir)
+    loose = _read_loose_object(git_dir, sha)
+    if loose:
+        return loose
+    return _read_object_from(_load_packs(git_dir), sha, None)
+
+
+def read_commit(git_dir, sha):
+    """
+    :return: (headers, message) of a commit, where headers maps each header to a list of values.
+    """
+    object_type, data = read_object(git_dir, sha)
+    if object_type != 'commit':
+        raise Unsupported(f'{sha} is a {object_type}, not a commit')
+
+    raw_headers, _, message = data.decode('utf-8', errors='replace').partition('\n\n')
+    headers = {}
+    for line in raw_headers.split('\n'):
+        if line.startswith(' '):
+            continue  # Continuation of a multi-line header such as gpgsig.
+        key, _, value = line.partition(' ')
+        headers.setdefault(key, []).append(value)
+    return headers, message
+
+
+def _subject(message):
+    """
+    The first paragraph of a commit message joined into one line, as `git log --pretty=%s` prints it.
+    """
+    paragraph = message.lstrip('\n').split('\n\n')[0]
+    return ' '.join(line.rstrip() for line in paragraph.rstrip().split('\n'))
+
+
+def current_branch(c, path=None):
+    """
+    :param path: a directory in the repository. (Default: the current directory)
+    :return: the checked out branch, or 'HEAD' if it's detached. Same as `git rev-parse --abbrev-ref HEAD`.
+    """
+    try:
+        head = _read_ref(find_git_dir(path), 'HEAD') or ''
+        if head.startswith('ref: refs/heads/') and head != 'ref: refs/heads/.invalid':
+            return head[len('ref: refs/heads/'):]
+        if len(head) == 40:
+            return 'HEAD'
+    except Unsupported:
+        pass
+    return c.run('git rev-parse --abbrev-ref HEAD', hide=True).stdout.strip()
+
+
+def head_subject(c):
+    """
+    :return: the subject of the HEAD commit. Same as `git log -1 --pretty=%s`.
+    """
+    try:
+        git_dir = find_git_dir()
+        sha = resolve_ref(git_dir, 'HEAD')
+        if sha:
+            return _subject(read_commit(git_dir, sha)[1])
+    except Unsupported:
+        pass
+    return c.run('git log --oneline -1 --pretty=%s', hide=True).stdout.strip()
+
+
+def head_trees(c):
+    """
+    :return: (tree of HEAD~1, tree of HEAD), i.e. the two sides of the diff `upload.py --rev HEAD~1` uploads.
+    """
+    try:
+        git_dir = find_git_dir()
+        sha = resolve_ref(git_dir, 'HEAD')
+        if sha:
+            headers = read_commit(git_dir, sha)[0]
+            if headers.get('parent'):
+                return read_commit(git_dir, headers['parent'][0])[0]['tree'][0], headers['tree'][0]
+    except Unsupported:
+        pass
+    res = c.run('git rev-parse HEAD~1^{tree} HEAD^{tree}', hide=True)
+    base_tree, head_tree = res.stdout.split()
+    return base_tree, head_tree
+
+
+def branch_exists(c, branch):
+    try:
+        return resolve_ref(find_git_dir(), f'refs/heads/{branch}') is not None
+    except Unsupported:
+        pass
+    return c.run(f'git rev-parse --verify --quiet refs/heads/{branch}', warn=True, hide=True).ok
+
+
+def resolve(c, ref, path=None):
+    """
+    :param ref: full name of a ref, e.g. refs/heads/master.
+    :param path: a directory in the repository. (Default: the current directory)
+    :return: the sha the ref points to, or None if it doesn't exist.
+    """
+    try:
+        return resolve_ref(find_git_dir(path), ref)
+    except Unsupported:
+        pass
+    res = c.run(f'git rev-parse --verify --quiet {ref}', warn=True, hide=True)
+    return res.stdout.strip() if res.ok else None
+
+
+def _has_core_worktree(git_dir):
+    section = None
+    try:
+        with open(git_dir / 'config') as config_file:
+            for line in config_file:
+                line = line.strip()
+                if line.startswith('['):
+                    section = line[1:line.index(']')].strip().lower() if ']' in line else None
+                elif section == 'core' and line.split('=')[0].strip().lower() == 'worktree':
+                    return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def checked_out_branches(c):
+    """
+    :return: dict of the branches that are checked out in any worktree of the repository to the directory of the
+        worktree. Same as the branches in `git worktree list`.
+    """
+    try:
+        common_dir = _common_dir(find_git_dir())
+        # The main worktree is only the parent of the common directory when that's a plain .git directory, not e.g.
+        # the git directory of a submodule in .git/modules/, one from --separate-git-dir, or one with core.worktree.
+        if common_dir.name != '.git' or _has_core_worktree(common_dir):
+            raise Unsupported('main worktree is not the parent of the git directory')
+        heads = {common_dir.parent: common_dir / 'HEAD'}
+        worktrees_dir = common_dir / 'worktrees'
+        if worktrees_dir.is_dir():
+            for worktree_git_dir in worktrees_dir.iterdir():
+                try:
+                    with open(worktree_git_dir / 'gitdir') as gitdir_file:
+                        # The path of the .git file in the worktree.
+                        heads[pathlib.Path(gitdir_file.read().strip()).parent] = worktree_git_dir / 'HEAD'
+                except FileNotFoundError:
+                    continue
+
+        branches = {}
+        for worktree, head_path in heads.items():
+            try:
+                with open(head_path) as head_file:
+                    head = head_file.read().strip()
+            except FileNotFoundError:
+                continue
+            if head.startswith('ref: refs/heads/'):
+                branches[head[len('ref: refs/heads/'):]] = worktree
+        return branches
+    except Unsupported:
+        pass
+
+    branches = {}
+    worktree = None
+    for line in c.run('git worktree list --porcelain', hide=True).stdout.splitlines():
+        if line.startswith('worktree '):
+            worktree = pathlib.Path(line[len('worktree '):])
+        elif line.startswith('branch refs/heads/'):
+            branches[line[len('branch refs/heads/'):]] = worktree
+    return branches
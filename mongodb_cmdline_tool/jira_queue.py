@@ -0,0 +1,247 @@
+"""
+Durable outbox for Jira updates.
+
+Commands queue their Jira updates and return right away. A background worker sends them, resolving transitions by
+the name of the status they lead to and retrying with backoff when Jira is unreachable.
+`m jira-queue` shows what's pending or has failed.
+"""
+import fcntl
+import json
+import subprocess
+import sys
+import time
+import traceback
+
+from mongodb_cmdline_tool import store
+from mongodb_cmdline_tool.utils import state_dir
+
+kLockPath = state_dir / 'jira-queue.lock'
+kLogPath = state_dir / 'jira-queue.log'
+
+kPending = 'pending'
+kFailed = 'failed'
+
+kMaxAttempts = 8
+kMaxBackoffSecs = 60 * 60
+
+# How often the worker looks for new updates while it's waiting to retry.
+kPollSecs = 5
+
+# The worker exits rather than waiting longer than this for the next retry; the next command restarts it.
+kMaxIdleSecs = 10 * 60
+
+# Jira responses that won't change by retrying, e.g. an invalid transition or a missing issue.
+kPermanentErrorCodes = (400, 404)
+
+kCommentVisibility = {'type': 'role', 'value': 'Developers'}
+
+
+class RetryableError(Exception):
+    pass
+
+
+def enqueue_transition(issue, from_status, to_status, comment=None):
+    """
+    Queue a transition of an issue. It only happens if the issue is still in from_status when the update is sent.
+
+    :param from_status: name of the status the issue must be in.
+    :param to_status: name of the status to move the issue to.
+    :param comment: Developer-visible comment to add if the issue was transitioned.
+    """
+    args = json.dumps({'from_status': from_status, 'to_status': to_status, 'comment': comment}, sort_keys=True)
+    now = time.time()
+    with store.transaction() as conn:
+        # Coalesce with an identical update that hasn't been sent yet, e.g. from running a command twice offline.
+        duplicate = conn.execute('SELECT 1 FROM jira_outbox WHERE issue = ? AND op = ? AND args = ? AND status = ?',
+                                 (issue, 'transition', args, kPending)).fetchone()
+        if not duplicate:
+            conn.execute('INSERT INTO jira_outbox (issue, op, args, status, next_attempt_at, created_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (issue, 'transition', args, kPending, now, now))
+    start_worker()
+
+
+def list_updates():
+    """
+    :return: list of (id, issue, args, status, attempts, next_attempt_at, last_error) of queued updates.
+    """
+    rows = store.connect().execute('SELECT id, issue, args, status, attempts, next_attempt_at, last_error '
+                                   'FROM jira_outbox ORDER BY id')
+    return [(row[0], row[1], json.loads(row[2]), *row[3:]) for row in rows]
+
+
+def count_failed():
+    return store.connect().execute('SELECT COUNT(*) FROM jira_outbox WHERE status = ?', (kFailed,)).fetchone()[0]
+
+
+def retry_failed():
+    with store.transaction() as conn:
+        conn.execute('UPDATE jira_outbox SET status = ?, attempts = 0, next_attempt_at = ? WHERE status = ?',
+                     (kPending, time.time(), kFailed))
+    start_worker()
+
+
+def clear_failed():
+    with store.transaction() as conn:
+        return conn.execute('DELETE FROM jira_outbox WHERE status = ?', (kFailed,)).rowcount
+
+
+def describe(issue, args):
+    desc = f'transition {issue} to "{args["to_status"]}"' if args['to_status'] else f'comment on {issue}'
+    if args['to_status'] and args['comment']:
+        desc += ' and comment'
+    return desc
+
+
+def _done(update_id):
+    with store.transaction() as conn:
+        conn.execute('DELETE FROM jira_outbox WHERE id = ?', (update_id,))
+
+
+def _failed(update_id, attempts, error, permanent):
+    attempts += 1
+    status = kFailed if permanent or attempts >= kMaxAttempts else kPending
+    next_attempt_at = time.time() + min(30 * 2 ** attempts, kMaxBackoffSecs)
+    with store.transaction() as conn:
+        conn.execute('UPDATE jira_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? '
+                     'WHERE id = ?', (status, attempts, next_attempt_at, error, update_id))
+
+
+def _transition(jirac, issue_key, from_status, to_status, comment=None):
+    """
+    Move an issue to to_status if it's in from_status, adding the comment in the same request.
+
+    Transition ids depend on the workflow, so they're looked up by the name of the status they lead to, in the same
+    request that checks the issue's status. That's two requests in all, where upload.py's UpdateJiraCases sends four
+    (comment, status, transitions and transition).
+
+    :return: whether the issue was transitioned.
+    """
+    import jira
+
+    issue = jirac.issue(issue_key, fields='status', expand='transitions')
+    if issue.raw['fields']['status']['name'].lower() != from_status.lower():
+        return False
+
+    transition_id = next((transition['id'] for transition in issue.raw['transitions']
+                          if transition['to']['name'].lower() == to_status.lower()), None)
+    if not transition_id:
+        raise jira.exceptions.JIRAError(status_code=400,
+                                        text=f'No transition from "{from_status}" to "{to_status}"')
+
+    data = {'transition': {'id': transition_id}}
+    if comment:
+        # JIRA.transition_issue() can't set the visibility of the comment.
+        data['update'] = {'comment': [{'add': {'body': comment, 'visibility': kCommentVisibility}}]}
+    jirac._session.post(jirac._get_url(f'issue/{issue_key}/transitions'), data=json.dumps(data))
+    return True
+
+
+def _send_issue_updates(jirac, issue_key, updates):
+    """
+    Send all due updates of one issue, in the order they were queued.
+    """
+    for update_id, args, _ in updates:
+        if args['to_status']:
+            if not _transition(jirac, issue_key, args['from_status'], args['to_status'], args['comment']):
+                print(f'{issue_key} is no longer in "{args["from_status"]}", not transitioning it to '
+                      f'"{args["to_status"]}"')
+                _done(update_id)
+                continue
+            print(f'Transitioned {issue_key} to "{args["to_status"]}"')
+            if args['comment']:
+                print(f'Commented on {issue_key}: {args["comment"]}')
+            store.forget_issue(issue_key)  # `m status` shouldn't show the old status.
+        elif args['comment']:
+            jirac.add_comment(issue_key, args['comment'], visibility=kCommentVisibility)
+            print(f'Commented on {issue_key}: {args["comment"]}')
+        _done(update_id)
+
+
+def flush():
+    """
+    Send every update that is due.
+    """
+    import jira
+
+    from mongodb_cmdline_tool import tasks
+
+    rows = store.connect().execute('SELECT id, issue, args, attempts FROM jira_outbox '
+                                   'WHERE status = ? AND next_attempt_at <= ? ORDER BY id', (kPending, time.time()))
+    by_issue = {}
+    for update_id, issue, args, attempts in rows.fetchall():
+        by_issue.setdefault(issue, []).append((update_id, json.loads(args), attempts))
+    if not by_issue:
+        return
+
+    try:
+        tasks.init(None)
+        jirac = tasks.get_jira()
+    except Exception as e:
+        # E.g. a missing ~/.evergreen.yml; retry later, so the updates end up failed and reported if it persists.
+        traceback.print_exc()
+        for updates in by_issue.values():
+            for update_id, _, attempts in updates:
+                _failed(update_id, attempts, f'Could not connect to Jira: {e}', permanent=False)
+        return
+
+    for issue, updates in by_issue.items():
+        try:
+            if not jirac:
+                raise RetryableError('Could not connect to Jira')
+            _send_issue_updates(jirac, issue, updates)
+        except Exception as e:
+            permanent = isinstance(e, jira.exceptions.JIRAError) and e.status_code in kPermanentErrorCodes
+            traceback.print_exc()
+            # Updates that were sent were removed from the queue already.
+            pending = {row[0] for row in store.connect().execute('SELECT id FROM jira_outbox')}
+            for update_id, _, attempts in updates:
+                if update_id in pending:
+                    _failed(update_id, attempts, str(e), permanent)
+
+
+def _next_attempt_at():
+    return store.connect().execute('SELECT MIN(next_attempt_at) FROM jira_outbox WHERE status = ?',
+                                   (kPending,)).fetchone()[0]
+
+
+def _lock():
+    """
+    :return: the open lock file if this process is now the only worker, otherwise None.
+    """
+    state_dir.mkdir(parents=True, exist_ok=True)
+    lock_file = open(kLockPath, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_worker():
+    lock_file = _lock()
+    if not lock_file:
+        return  # A worker is running and will pick up new updates.
+    lock_file.close()
+
+    with open(kLogPath, 'a') as log_file:
+        subprocess.Popen([sys.executable, '-m', 'mongodb_cmdline_tool.jira_queue'], stdin=subprocess.DEVNULL,
+                         stdout=log_file, stderr=log_file, start_new_session=True)
+
+
+def work():
+    lock_file = _lock()
+    if not lock_file:
+        return
+
+    with lock_file:
+        while True:
+            flush()
+            next_attempt_at = _next_attempt_at()
+            if next_attempt_at is None or next_attempt_at - time.time() > kMaxIdleSecs:
+                return
+            time.sleep(kPollSecs)
+
+
+if __name__ == '__main__':
+    work()
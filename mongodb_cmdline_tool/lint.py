@@ -0,0 +1,227 @@
+"""
+Format and lint only the files a ticket changed, skipping the ones that passed before.
+
+The files are the ones that differ from the merge base with the base branch, committed or not, and new files that
+haven't been added yet. A file that passed a tool is remembered by the hash of its content (its git blob), the
+identity of the tool and the hashes of the tool's config files (.clang-format, .eslintrc.*), so it's skipped until any
+of them changes, whichever branch or worktree it's in. The remaining files are split into a shard per core. Each
+shard runs clang-format and then ESLint on its own files, so no file is changed by two tools at once while the shards
+run concurrently.
+
+clang-format and ESLint are run directly, so they have to be the versions the repository pins in
+buildscripts/clang_format.py and buildscripts/eslint.py. They're taken from clang_format_path and eslint_path in the
+config file, or else from the PATH, and only used if `--version` reports the pinned version. `m lint --all` runs the
+repository's own scripts over the whole tree instead, which fetch the pinned versions themselves.
+"""
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import time
+
+from mongodb_cmdline_tool import parallel, store
+from mongodb_cmdline_tool.utils import get_config, print_bold
+
+kLintDirs = ('src/mongo/', 'jstests/')
+
+kClangFormatSuffixes = ('.c', '.cpp', '.h', '.js')
+kEslintSuffixes = ('.js',)
+
+# Results are forgotten this long after they were recorded.
+kResultTtlSecs = 90 * 24 * 60 * 60
+
+# sqlite limits the number of parameters of a statement.
+kQueryBatchSize = 500
+
+
+class Tool(object):
+
+    def __init__(self, name, path, args, suffixes, config_files):
+        """
+        :param config_files: dict of each config file of the tool in the repository to the blob hash of its content.
+        """
+        self.name = name
+        self.cmd = ' '.join([shlex.quote(path), *args])
+        self.suffixes = suffixes
+        # A different build of the tool, e.g. after an upgrade, or a different style may not agree with earlier
+        # results.
+        stat = os.stat(path)
+        config = hashlib.sha1(''.join(f'{config_file}\0{blob}\0' for config_file, blob in sorted(config_files.items()))
+                              .encode()).hexdigest()
+        self.key = f'{name}:{path}:{stat.st_size}:{stat.st_mtime_ns}:{config}'
+
+
+def _pinned_version(script, variable):
+    """
+    :return: the version of a tool the repository's script for it requires, e.g. CLANG_FORMAT_VERSION in
+        buildscripts/clang_format.py, or None if the script doesn't say.
+    """
+    try:
+        with open(script) as script_file:
+            match = re.search(rf'^{variable}\s*=\s*["\']([^"\']+)["\']', script_file.read(), re.MULTILINE)
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+
+def _version_matches(path, version):
+    res = subprocess.run([path, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                         universal_newlines=True)
+    return res.returncode == 0 and re.search(rf'\bv?{re.escape(version)}\b', res.stdout) is not None
+
+
+def _find(config_key, names, version):
+    """
+    :param names: the names to look for on the PATH, most specific first.
+    :param version: the version the repository requires, if it pins one.
+    :return: the path of the tool, or None if it wasn't found in the required version.
+    """
+    path = get_config(config_key, None)
+    if path:
+        candidates = [os.path.expanduser(path)]
+    else:
+        candidates = [os.path.realpath(path) for path in map(shutil.which, names) if path]
+
+    for path in candidates:
+        if not os.path.isfile(path):
+            continue
+        if version and not _version_matches(path, version):
+            print(f'[WARNING] Not using {path}, the repository requires version {version}')
+            continue
+        return path
+    return None
+
+
+def _config_files(patterns):
+    """
+    :return: dict of the files in the repository that match the patterns to the blob hashes of their content.
+    """
+    pathspecs = [f':(glob)**/{pattern}' for pattern in patterns]
+    res = subprocess.run(['git', 'ls-files', '-z', '--', *pathspecs], stdout=subprocess.PIPE,
+                         universal_newlines=True, check=True)
+    return _hash([path for path in res.stdout.split('\0') if path and os.path.isfile(path)])
+
+
+def find_tools(eslint=False):
+    """
+    Find the tools in the versions the repository requires. The current directory has to be the top of the repository.
+
+    :return: list of the tools that were found, and list of the names of the ones that weren't.
+    """
+    wanted = [('clang-format', 'clang_format_path', ['-i', '-style=file'], kClangFormatSuffixes,
+               ('buildscripts/clang_format.py', 'CLANG_FORMAT_VERSION'), ('.clang-format', '_clang-format'))]
+    if eslint:
+        wanted.append(('eslint', 'eslint_path', ['--fix'], kEslintSuffixes,
+                       ('buildscripts/eslint.py', 'ESLINT_VERSION'), ('.eslintrc*', '.eslintignore')))
+
+    tools, missing = [], []
+    for name, config_key, args, suffixes, (script, variable), config_patterns in wanted:
+        version = _pinned_version(script, variable)
+        # The repository's script looks for e.g. clang-format-3.8 before clang-format.
+        names = [f'{name}-{".".join(version.split(".")[:2])}', name] if version else [name]
+        path = _find(config_key, names, version)
+        if path:
+            tools.append(Tool(name, path, args, suffixes, _config_files(config_patterns)))
+        else:
+            missing.append(name)
+    return tools, missing
+
+
+def changed_files(c, base, suffixes):
+    """
+    :return: the files under kLintDirs that differ from the merge base of HEAD and the base branch, relative to the
+        top of the repository, which has to be the current directory.
+    """
+    merge_base = c.run(f'git merge-base HEAD {base}', hide=True).stdout.strip()
+    changed = c.run(f'git diff --name-only --diff-filter=d -z {merge_base}', hide=True).stdout
+    untracked = c.run(f'git ls-files --others --exclude-standard -z -- {" ".join(kLintDirs)}', hide=True).stdout
+    paths = {path for path in (changed + untracked).split('\0') if path}
+    return sorted(path for path in paths
+                  if path.startswith(kLintDirs) and path.endswith(suffixes) and os.path.isfile(path))
+
+
+def _hash(paths):
+    """
+    :return: dict of each file to the blob hash of its current content.
+    """
+    res = subprocess.run(['git', 'hash-object', '--stdin-paths'], input=''.join(f'{path}\n' for path in paths),
+                         stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return dict(zip(paths, res.stdout.split()))
+
+
+def _passed(tools, blobs):
+    """
+    :return: set of (tool key, blob) that passed before.
+    """
+    conn = store.connect()
+    blobs = sorted(set(blobs))
+    passed = set()
+    for tool in tools:
+        for i in range(0, len(blobs), kQueryBatchSize):
+            batch = blobs[i:i + kQueryBatchSize]
+            placeholders = ', '.join('?' * len(batch))
+            rows = conn.execute(f'SELECT blob FROM lint_passed WHERE tool = ? AND blob IN ({placeholders})',
+                                (tool.key, *batch))
+            passed.update((tool.key, blob) for blob, in rows)
+    return passed
+
+
+def _record(passed):
+    now = time.time()
+    with store.transaction() as conn:
+        conn.executemany('INSERT OR REPLACE INTO lint_passed VALUES (?, ?, ?)',
+                         [(tool_key, blob, now) for tool_key, blob in passed])
+        conn.execute('DELETE FROM lint_passed WHERE checked_at < ?', (now - kResultTtlSecs,))
+
+
+def _shard_step(tools, todo, shard):
+    def step(s):
+        failed = set()
+        for tool in tools:
+            paths = [path for path in shard if path in todo[tool.key]]
+            if not paths:
+                continue
+            res = s.run(f'{tool.cmd} {" ".join(shlex.quote(path) for path in paths)}', warn=True)
+            if not res.ok:
+                failed.update((tool.key, path) for path in paths)
+        return failed
+    return step
+
+
+def run(c, base, tools):
+    """
+    Run the tools on the files changed since the merge base with the base branch.
+
+    :return: whether all the files passed.
+    """
+    files = changed_files(c, base, tuple(suffix for tool in tools for suffix in tool.suffixes))
+    if not files:
+        print_bold(f'No files to lint, nothing under {" or ".join(kLintDirs)} changed since {base}')
+        return True
+
+    blobs = _hash(files)
+    passed = _passed(tools, blobs.values())
+    todo = {tool.key: {path for path in files
+                       if path.endswith(tool.suffixes) and (tool.key, blobs[path]) not in passed}
+            for tool in tools}
+    pending = sorted(set().union(*todo.values()))
+    if not pending:
+        print_bold(f'All {len(files)} changed file(s) passed before')
+        return True
+
+    num_shards = min(os.cpu_count() or 1, len(pending))
+    steps = [(f'lint {i + 1}/{num_shards}', _shard_step(tools, todo, pending[i::num_shards]))
+             for i in range(num_shards)]
+    failed = set().union(*parallel.run_steps(c, steps).values())
+
+    # The tools fix what they can, so what passed is the content the files have now.
+    blobs = _hash(pending)
+    _record((tool.key, blobs[path]) for tool in tools for path in todo[tool.key] if (tool.key, path) not in failed)
+
+    print_bold(f'Linted {len(pending)} of {len(files)} changed file(s), the rest passed before')
+    if failed:
+        # A tool checks a shard at once, so which of its files failed is only in its output.
+        print('[ERROR] Some files did not pass lint, see the output above')
+    return not failed
@@ -0,0 +1,108 @@
+"""
+Keep the modification times of files that git rewrites without changing them, so ninja doesn't rebuild them.
+
+When git is too old to rebase in memory (see rebase.py), rebasing a ticket for a patch build and checking it out
+again afterwards rewrites every file that differs between the ticket and its base, even though they end up as they
+were, and so does finalize's rebase and merge. Around such a round trip, preserved() notes the mtime of each file git
+may rewrite, and afterwards puts the old mtime back on the files whose content is the same as before. Files that
+really changed, or that have uncommitted changes, keep their new mtime.
+
+The round trip holds the build lock, so a build running at the same time, e.g. from `m watch`, can't compile the
+content in between and then have its outputs look up to date.
+"""
+import contextlib
+import os
+
+from mongodb_cmdline_tool import build, git_metadata
+from mongodb_cmdline_tool.utils import print_bold
+
+
+class Snapshot(object):
+
+    def __init__(self, root, head, mtimes):
+        self.root = root
+        self.head = head
+        self.mtimes = mtimes
+        self.restored = 0
+
+
+def _changed_paths(c, *revs):
+    """
+    :return: the paths, relative to the top of the repository, that differ between two commits, or between a commit
+        and the working tree.
+    """
+    res = c.run(f'git diff --no-renames --name-only -z {" ".join(revs)}', hide=True)
+    return set(filter(None, res.stdout.split('\0')))
+
+
+def snapshot(c, *revs):
+    """
+    :param revs: commits the working tree is about to pass through.
+    :return: the mtimes of the files that differ between HEAD and any of the commits, or their merge base with HEAD.
+    """
+    root = c.run('git rev-parse --show-toplevel', hide=True).stdout.strip()
+    head = git_metadata.resolve(c, 'HEAD')
+
+    candidates = set()
+    for rev in revs:
+        merge_base = c.run(f'git merge-base HEAD {rev}', warn=True, hide=True).stdout.strip()
+        candidates |= _changed_paths(c, 'HEAD', rev)
+        if merge_base:
+            candidates |= _changed_paths(c, 'HEAD', merge_base)
+    candidates -= _changed_paths(c, 'HEAD')
+
+    mtimes = {}
+    for path in candidates:
+        try:
+            mtimes[path] = os.stat(os.path.join(root, path)).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return Snapshot(root, head, mtimes)
+
+
+def restore(c, snap):
+    """
+    Put back the mtimes of the files that have the same content as when the snapshot was taken.
+
+    :return: the number of files whose mtime was put back.
+    """
+    head = git_metadata.resolve(c, 'HEAD')
+    changed = _changed_paths(c, 'HEAD')
+    if head != snap.head:
+        changed |= _changed_paths(c, snap.head, head)
+
+    for path, mtime in snap.mtimes.items():
+        if path in changed:
+            continue
+        full_path = os.path.join(snap.root, path)
+        try:
+            stat = os.stat(full_path)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime_ns != mtime:
+            os.utime(full_path, ns=(stat.st_atime_ns, mtime))
+            snap.restored += 1
+
+    if snap.restored:
+        # Let git notice the files are unchanged without reading them again.
+        c.run('git update-index -q --refresh', warn=True, hide=True)
+    return snap.restored
+
+
+@contextlib.contextmanager
+def preserved(c, *revs):
+    """
+    Keep the mtimes of the files that are the same after the block as before it.
+
+    :param revs: commits the working tree passes through in the block, e.g. the base branch of a rebase.
+    """
+    snap = snapshot(c, *revs)
+    with contextlib.ExitStack() as stack:
+        if os.path.isfile(os.path.join(snap.root, build.kManifest)):
+            stack.enter_context(build.build_lock(snap.root))
+        try:
+            yield snap
+        finally:
+            if restore(c, snap):
+                print_bold(f'Kept the modification times of {snap.restored} file(s) that git rewrote as they were, '
+                           f'so they are not rebuilt')
@@ -0,0 +1,140 @@
+"""
+Run independent steps of a task at the same time.
+
+Each step gets a Step object that stands in for the invoke context: its run() streams the output of the
+command with the name of the step as prefix, so the interleaved output of several steps stays readable.
+When a step fails, the commands of the other steps are terminated and the failure is re-raised.
+"""
+import os
+import signal
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result
+
+
+class Cancelled(Exception):
+    """
+    Raised in a step when another step has failed.
+    """
+    pass
+
+
+def _terminate_tree(pid):
+    """
+    Terminate a process and all of its descendants, so commands run through a shell are stopped too.
+    """
+    children = {}
+    ps = subprocess.run(['ps', '-A', '-o', 'pid=,ppid='], stdout=subprocess.PIPE, universal_newlines=True)
+    for line in ps.stdout.splitlines():
+        child, parent = (int(field) for field in line.split())
+        children.setdefault(parent, []).append(child)
+
+    pids = [pid]
+    for p in pids:
+        pids.extend(children.get(p, []))
+    for p in pids:
+        try:
+            os.kill(p, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+class Step(object):
+
+    def __init__(self, name, c, cancelled, output_lock):
+        self.name = name
+        self.c = c
+        self.cwd = c.cwd or None
+        self._cancelled = cancelled
+        self._output_lock = output_lock
+        self._procs = []
+
+    def print(self, msg):
+        with self._output_lock:
+            for line in str(msg).splitlines() or ['']:
+                print(f'[{self.name}] {line}')
+            sys.stdout.flush()
+
+    def _stream(self, pipe, hidden, chunks):
+        for line in pipe:
+            chunks.append(line)
+            if not hidden:
+                self.print(line.rstrip('\n'))
+        pipe.close()
+
+    def run(self, cmd, warn=False, hide=None):
+        """
+        Run a command like invoke's Context.run(). Output is prefixed with the step name unless hidden.
+        """
+        if self._cancelled.is_set():
+            raise Cancelled(self.name)
+
+        if self.c.config.run.echo and hide not in (True, 'both'):
+            self.print(f'$ {cmd}')
+
+        proc = subprocess.Popen(cmd, shell=True, cwd=self.cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        self._procs.append(proc)
+
+        stdout, stderr = [], []
+        readers = [
+            threading.Thread(target=self._stream, args=(proc.stdout, hide in (True, 'both', 'stdout', 'out'), stdout)),
+            threading.Thread(target=self._stream, args=(proc.stderr, hide in (True, 'both', 'stderr', 'err'), stderr)),
+        ]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        proc.wait()
+
+        self._procs.remove(proc)
+
+        result = Result(stdout=''.join(stdout), stderr=''.join(stderr), command=cmd, exited=proc.returncode)
+        if self._cancelled.is_set() and proc.returncode != 0:
+            raise Cancelled(self.name)
+        if not warn and proc.returncode != 0:
+            raise UnexpectedExit(result)
+        return result
+
+    def terminate(self):
+        for proc in list(self._procs):
+            _terminate_tree(proc.pid)
+
+
+def run_steps(c, steps):
+    """
+    Run steps concurrently and wait for all of them.
+
+    :param steps: list of (name, function) pairs. Each function is called with its Step.
+    :return: dict of step name to the return value of its function.
+    """
+    cancelled = threading.Event()
+    output_lock = threading.Lock()
+    step_objs = {name: Step(name, c, cancelled, output_lock) for name, _ in steps}
+
+    def cancel_all():
+        cancelled.set()
+        for step in step_objs.values():
+            step.terminate()
+
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        futures = {executor.submit(fn, step_objs[name]): name for name, fn in steps}
+        try:
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            if any(future.exception() for future in done):
+                cancel_all()
+        except KeyboardInterrupt:
+            cancel_all()
+            raise
+
+    for future, name in futures.items():
+        exception = future.exception()
+        if exception and not isinstance(exception, Cancelled):
+            if not isinstance(exception, SystemExit):
+                step_objs[name].print(f'[ERROR] {exception!r}, stopped the other steps')
+            raise exception
+    return {name: future.result() for future, name in futures.items()}
@@ -0,0 +1,120 @@
+"""
+Show ninja's progress on a single line instead of printing every step.
+
+ninja is run with a NINJA_STATUS we can parse, so each line it prints is either the status of a step or output of
+a command, which is only there for warnings and errors. Status lines update the progress line in place, everything
+else is printed right away above it. The full output goes to a log file. Lines are handled as they arrive, so
+nothing is kept in memory.
+"""
+import collections
+import re
+import shutil
+import sys
+import time
+
+from mongodb_cmdline_tool.utils import print_bold
+
+kStatusFormat = '[m %f/%t %es] '
+kStatusPattern = re.compile(r'^\[m ([0-9]+)/([0-9]+) ([0-9.]+)s\] (.*)$')
+
+# Throughput is measured over this window, so the ETA follows the current phase of the build.
+kRateWindowSecs = 30
+
+# How often the progress line is redrawn on a terminal, or printed when the output isn't one.
+kRedrawSecs = 0.1
+kPlainProgressSecs = 30
+
+
+def _format_duration(secs):
+    secs = int(secs)
+    if secs >= 3600:
+        return f'{secs // 3600}h{secs // 60 % 60:02}m'
+    if secs >= 60:
+        return f'{secs // 60}m{secs % 60:02}s'
+    return f'{secs}s'
+
+
+class Renderer(object):
+
+    def __init__(self, log_file, out=None):
+        self.log_file = log_file
+        self.out = out or sys.stdout
+        self.is_tty = self.out.isatty()
+        self.finished = 0
+        self.total = 0
+        self.elapsed = 0.0
+        self.description = ''
+        self.warnings = 0
+        self.failed = 0
+        self._samples = collections.deque()
+        self._last_draw = 0
+        self._line_shown = False
+
+    def _rate(self):
+        """
+        :return: finished steps per second over the last kRateWindowSecs.
+        """
+        while len(self._samples) > 2 and self._samples[0][0] < self.elapsed - kRateWindowSecs:
+            self._samples.popleft()
+        if len(self._samples) < 2:
+            return self.finished / self.elapsed if self.elapsed else 0
+        (start, start_finished), (end, end_finished) = self._samples[0], self._samples[-1]
+        return (end_finished - start_finished) / (end - start) if end > start else 0
+
+    def progress_line(self):
+        rate = self._rate()
+        line = f'[{self.finished}/{self.total}] {_format_duration(self.elapsed)}, {rate:.1f} steps/s'
+        if rate and self.total > self.finished:
+            line += f', ETA {_format_duration((self.total - self.finished) / rate)}'
+        if self.warnings or self.failed:
+            line += f', {self.failed} failed, {self.warnings} warning(s)'
+        return line
+
+    def _clear(self):
+        if self._line_shown:
+            self.out.write('\r\033[K')
+            self._line_shown = False
+
+    def _draw(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_draw < (kRedrawSecs if self.is_tty else kPlainProgressSecs):
+            return
+        self._last_draw = now
+
+        line = self.progress_line()
+        if self.is_tty:
+            width = shutil.get_terminal_size().columns
+            line = f'{line} {self.description}'[:width - 1]
+            self.out.write(f'\r\033[K{line}')
+            self._line_shown = True
+        else:
+            self.out.write(f'{line}\n')
+        self.out.flush()
+
+    def feed(self, line):
+        self.log_file.write(line)
+        line = line.rstrip('\n')
+
+        match = kStatusPattern.match(line)
+        if match:
+            self.finished, self.total = int(match.group(1)), int(match.group(2))
+            self.elapsed = float(match.group(3))
+            self.description = match.group(4)
+            self._samples.append((self.elapsed, self.finished))
+            self._draw()
+            return
+
+        # Anything that isn't a status line is output of a command or of ninja itself.
+        if line.startswith('FAILED:'):
+            self.failed += 1
+        elif ' warning:' in line:
+            self.warnings += 1
+        self._clear()
+        self.out.write(f'{line}\n')
+        if self.is_tty:
+            self._draw(force=True)
+
+    def close(self):
+        self._clear()
+        self.out.flush()
+        print_bold(f'{self.progress_line()}. The full output is in {self.log_file.name}')
@@ -0,0 +1,118 @@
+"""
+Rebase a ticket onto its base branch without touching the working tree.
+
+`git merge-tree --write-tree` merges two commits entirely in the object database and writes the resulting tree, or
+reports the conflicting files, in milliseconds. The patch build only needs that tree, since Evergreen takes a diff
+against the base. finalize needs the commits themselves, which are replayed one by one onto the base with
+`git commit-tree`, keeping their authors and messages like `git rebase` does.
+
+`git merge-tree --write-tree` needs git 2.38, and replaying more than one commit needs --merge-base from git 2.40.
+With an older git, the callers fall back to rebasing in the working tree.
+"""
+import functools
+import os
+import re
+import subprocess
+
+
+class Conflict(Exception):
+
+    def __init__(self, paths):
+        super().__init__(f'conflicts in {", ".join(paths)}')
+        self.paths = paths
+
+
+def _git(*args, stdin=None, env=None):
+    return subprocess.run(['git', *args], input=stdin, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def _rev_parse(rev):
+    return _git('rev-parse', '--verify', '--quiet', rev).stdout.strip()
+
+
+@functools.lru_cache()
+def git_version():
+    match = re.search(r'([0-9]+)\.([0-9]+)', _git('--version').stdout)
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+def _merge_tree(ours, theirs, merge_base=None):
+    """
+    :return: the tree of the merge of two commits.
+    """
+    args = ['merge-tree', '--write-tree', '--name-only', '--no-messages']
+    if merge_base:
+        args.append(f'--merge-base={merge_base}')
+    res = _git(*args, ours, theirs)
+    if res.returncode == 1:
+        # The tree comes first, then the conflicting files up to an empty line.
+        paths = []
+        for line in res.stdout.splitlines()[1:]:
+            if not line:
+                break
+            if line not in paths:
+                paths.append(line)
+        raise Conflict(paths)
+    if res.returncode != 0:
+        raise subprocess.CalledProcessError(res.returncode, res.args, res.stdout, res.stderr)
+    return res.stdout.split('\n', 1)[0]
+
+
+def merged_tree(onto, head='HEAD'):
+    """
+    :return: the tree of head rebased onto onto, with all its commits squashed together, or None if this version of
+        git can't merge in memory.
+    :raises Conflict: if the commits don't apply cleanly.
+    """
+    if git_version() < (2, 38):
+        return None
+    return _merge_tree(onto, head)
+
+
+def _commit_env_and_message(commit):
+    """
+    :return: the environment that makes `git commit-tree` keep the author of a commit, and its message.
+    """
+    raw = _git('cat-file', 'commit', commit).stdout
+    headers, _, message = raw.partition('\n\n')
+    env = dict(os.environ)
+    for line in headers.split('\n'):
+        if line.startswith('author '):
+            match = re.fullmatch(r'author (.*) <(.*)> (.*)', line)
+            env.update(GIT_AUTHOR_NAME=match.group(1), GIT_AUTHOR_EMAIL=match.group(2),
+                       GIT_AUTHOR_DATE=match.group(3))
+    return env, message
+
+
+def replay(onto, head='HEAD'):
+    """
+    Create the commits of head that aren't in onto again on top of it, without touching the working tree or refs.
+
+    :return: the new head, which is head itself if it's on top of onto already, or None if the commits have to be
+        rebased in the working tree: git is too old, or there are merge commits.
+    :raises Conflict: if a commit doesn't apply cleanly.
+    """
+    if _git('merge-base', '--is-ancestor', onto, head).returncode == 0:
+        # Like `git rebase`, leave the commits as they are rather than give them new committer dates.
+        return _rev_parse(head)
+    if git_version() < (2, 38):
+        return None
+
+    commits = _git('rev-list', '--reverse', '--parents', f'{onto}..{head}').stdout.split('\n')
+    commits = [line.split() for line in commits if line]
+    if any(len(parents) != 1 for _, *parents in commits):
+        return None
+    if len(commits) > 1 and git_version() < (2, 40):
+        return None
+
+    tip = _rev_parse(onto)
+    for commit, parent in commits:
+        # With a single commit, its parent is the merge base that git picks by itself.
+        tree = _merge_tree(tip, commit, merge_base=parent if len(commits) > 1 else None)
+        env, message = _commit_env_and_message(commit)
+        res = _git('commit-tree', tree, '-p', tip, stdin=message, env=env)
+        if res.returncode != 0:
+            raise subprocess.CalledProcessError(res.returncode, res.args, res.stdout, res.stderr)
+        tip = res.stdout.strip()
+    return tip
@@ -9,12 +9,11 @@ import yaml
 from invoke import task
 from invoke.exceptions import Exit, UnexpectedExit
 
-from mongodb_cmdline_tool.utils import print_bold, format_bold, clear_screen, get_jira_pwd, save_jira_pwd
+from mongodb_cmdline_tool.utils import print_bold, format_bold, clear_screen, get_config, get_jira_pwd, save_jira_pwd
 
 # Global Constants.
 kHome = pathlib.Path.home()
 kOptDir = pathlib.Path('/opt')
-kDownloadsCache = pathlib.Path(tempfile.mkdtemp())
 kPackageDir = pathlib.Path(os.path.dirname(os.path.realpath(__file__)))
 kConfigDir = kHome / '.config'
 
@@ -46,6 +45,18 @@ kRepositoryURLs = {
 jira_username = None
 jira_password = None
 sudo_password = None
+downloads_cache = None
+
+
+def _get_downloads_cache():
+    """
+    Create the temporary download directory on first use rather than every time this module is imported.
+    """
+    global downloads_cache
+    if not downloads_cache:
+        downloads_cache = pathlib.Path(tempfile.mkdtemp())
+    return downloads_cache
+
 
 @task
 def get_passwords(c):
@@ -255,7 +266,8 @@ def _install_editor(c):
 
 @task
 def _install_binary(c, url, download_name, binary_name, parent_dir, untar=False):
-    with c.cd(str(kDownloadsCache)):
+    downloads_cache = _get_downloads_cache()
+    with c.cd(str(downloads_cache)):
         # Don't warn, error out immediately.
         c.run(f'curl -fsSL {url} -o {download_name}', warn=False)
         if untar:
@@ -263,7 +275,7 @@ def _install_binary(c, url, download_name, binary_name, parent_dir, untar=False)
 
     c.sudo(f'mkdir -p {parent_dir}', warn=False, password=sudo_password)
     c.sudo(f'rm -rf {parent_dir / binary_name}', warn=False, password=sudo_password)
-    c.sudo(f'mv -f {kDownloadsCache / binary_name} {parent_dir / binary_name}', warn=False, password=sudo_password)
+    c.sudo(f'mv -f {downloads_cache / binary_name} {parent_dir / binary_name}', warn=False, password=sudo_password)
     c.sudo(f'chown -R {getpass.getuser()} {parent_dir / binary_name}', warn=False, password=sudo_password)
     print(f'Installed {binary_name} to {parent_dir}')
 
@@ -284,21 +296,24 @@ def macos_extra(c):
     :param c:
     :return:
     """
-    print_bold('Installing ninja')
-    c.run('brew install --upgrade ninja')
+    print_bold('Installing ninja and ccache')
+    c.run('brew install --upgrade ninja ccache')
+
+    # Let checkouts in different directories, e.g. worktrees, share cached objects.
+    c.run(f'ccache --set-config=base_dir={kHome}')
+    c.run('ccache --set-config=hash_dir=false')
+    c.run(f'ccache --max-size={get_config("ccache_max_size", "20G")}')
+
+    from mongodb_cmdline_tool import build
 
-    modules_dir = str(kHome / 'mongo' / 'src' / 'mongo' / 'db' / 'modules')
+    modules_dir = str(kHome / 'mongo' / os.path.dirname(build.kNinjaModuleDir))
     c.run(f'mkdir -p {modules_dir}')
 
     with c.cd(modules_dir):
         # Ignore errors since ninja may already exist.
         c.run('git clone https://github.com/RedBeard0531/mongo_module_ninja ninja', warn=True)
     with c.cd(str(kHome / 'mongo')):
-        ninja_cmd = 'python buildscripts/scons.py CC=clang CXX=clang++ '
-        ninja_cmd += 'CCFLAGS=-Wa,--compress-debug-sections '
-        ninja_cmd += 'MONGO_VERSION=\'0.0.0\' MONGO_GIT_HASH=\'unknown\' '
-        ninja_cmd += 'VARIANT_DIR=ninja --modules=ninja build.ninja'
-        c.run(ninja_cmd)
+        build.generate_manifest(c)
 
     print_bold('Installing CLion')
 
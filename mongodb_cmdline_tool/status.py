@@ -0,0 +1,125 @@
+"""
+Working tree status for commit and review, without scanning the whole tree.
+
+`git status` only has to look at the directories that changed when git's untracked cache is on, and only at the
+files that changed when fsmonitor is on as well, which matters with build directories inside the tree. Both are
+turned on the first time a repository is asked about and checked again once a day. fsmonitor needs git's built-in
+daemon (macOS and Windows) or watchman.
+
+Results are `git status --porcelain=v2 -z`, either parsed or as they are.
+"""
+import collections
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from mongodb_cmdline_tool import store
+
+kCheckIntervalSecs = 24 * 60 * 60
+
+# One line of `git status --porcelain=v2`. kind is '1' (changed), '2' (renamed or copied), 'u' (unmerged), '?'
+# (untracked) or '!' (ignored); xy is the staged and unstaged status, e.g. '.M'; orig_path is only set for '2'.
+Entry = collections.namedtuple('Entry', ['kind', 'xy', 'path', 'orig_path'])
+
+
+def _git(*args, stdin=None, cwd=None, env=None):
+    return subprocess.run(['git', *args], input=stdin, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def _git_version():
+    version = _git('--version').stdout.split()[2]
+    return tuple(int(part) for part in version.split('.')[:2] if part.isdigit())
+
+
+def _fsmonitor_setting():
+    """
+    :return: the value of core.fsmonitor to use, or None if there's no way to watch the file system.
+    """
+    if sys.platform in ('darwin', 'win32') and _git_version() >= (2, 36):
+        return 'true'
+    hook = _git('rev-parse', '--git-path', 'hooks/fsmonitor-watchman').stdout.strip()
+    if shutil.which('watchman') and (os.path.isfile(hook) or os.path.isfile(f'{hook}.sample')):
+        if not os.path.isfile(hook):
+            shutil.copy(f'{hook}.sample', hook)
+        return os.path.abspath(hook)
+    return None
+
+
+def enable():
+    """
+    Turn on the untracked cache and fsmonitor for the repository in the current directory, unless that was checked
+    recently.
+    """
+    common_dir = _git('rev-parse', '--git-common-dir').stdout.strip()
+    meta_key = f'fast_status:{os.path.abspath(common_dir)}'
+    if time.time() - float(store.get_meta(meta_key, 0)) < kCheckIntervalSecs:
+        return
+
+    settings = {'core.untrackedCache': 'true'}
+    fsmonitor = _fsmonitor_setting()
+    if fsmonitor:
+        settings['core.fsmonitor'] = fsmonitor
+    for key, value in settings.items():
+        if _git('config', '--get', key).stdout.strip() != value:
+            _git('config', key, value)
+    store.set_meta(meta_key, str(time.time()))
+
+
+def raw(untracked=True):
+    """
+    :param untracked: whether to list untracked files. (Default: True)
+    :return: the output of `git status --porcelain=v2 -z`, with every untracked file listed on its own.
+    """
+    enable()
+    res = _git('status', '--porcelain=v2', '-z', f'--untracked-files={"all" if untracked else "no"}')
+    if res.returncode != 0:
+        raise subprocess.CalledProcessError(res.returncode, res.args, res.stdout, res.stderr)
+    return res.stdout
+
+
+def parse(output):
+    """
+    :return: list of Entry in the output of `git status --porcelain=v2 -z`.
+    """
+    entries = []
+    fields = iter(output.split('\0'))
+    for line in fields:
+        if not line or line.startswith('#'):
+            continue
+        kind = line[0]
+        if kind in '?!':
+            entries.append(Entry(kind, kind * 2, line[2:], None))
+        elif kind == '1':
+            entries.append(Entry(kind, line[2:4], line.split(' ', 8)[8], None))
+        elif kind == '2':
+            # The original path is the next NUL-delimited field.
+            entries.append(Entry(kind, line[2:4], line.split(' ', 9)[9], next(fields)))
+        elif kind == 'u':
+            entries.append(Entry(kind, line[2:4], line.split(' ', 10)[10], None))
+    return entries
+
+
+def status(untracked=True):
+    """
+    :return: list of Entry for the changes in the working tree and the index.
+    """
+    return parse(raw(untracked))
+
+
+def stage(paths):
+    """
+    Stage the changes of the given paths, including deletions, without looking at any other path.
+
+    :param paths: paths relative to the top of the repository, as status() reports them.
+    """
+    if not paths:
+        return
+    top = _git('rev-parse', '--show-toplevel').stdout.strip()
+    res = _git('add', '--all', '--pathspec-from-file=-', '--pathspec-file-nul', stdin='\0'.join(paths), cwd=top,
+               env=dict(os.environ, GIT_LITERAL_PATHSPECS='1'))
+    if res.returncode != 0:
+        raise subprocess.CalledProcessError(res.returncode, res.args, res.stdout, res.stderr)
+
@@ -0,0 +1,269 @@
+"""
+Local state of the tool, kept in a sqlite database next to the config file.
+
+sqlite gives us atomic updates, locking between concurrent `m` processes and indexed point lookups,
+so commands only read the rows they need no matter how much has accumulated.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+from mongodb_cmdline_tool.utils import state_dir
+
+kDatabasePath = state_dir / 'state.db'
+
+# The YAML ticket cache used by older versions of the tool, imported into the database on first use.
+kLegacyCachePath = state_dir / 'cache'
+
+kSchema = [
+    """
+    CREATE TABLE IF NOT EXISTS tickets (
+        ticket TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS jira_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        issue TEXT NOT NULL,
+        op TEXT NOT NULL,
+        args TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS jira_outbox_status ON jira_outbox (status, next_attempt_at)',
+    """
+    CREATE TABLE IF NOT EXISTS link_memory (
+        target TEXT PRIMARY KEY,
+        peak_rss INTEGER NOT NULL,
+        recorded_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS build_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        log_path TEXT NOT NULL,
+        branch TEXT,
+        head TEXT,
+        recorded_at REAL NOT NULL,
+        steps INTEGER,
+        duration_ms INTEGER,
+        cpu_ms INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS build_steps (
+        run_id INTEGER NOT NULL,
+        log_path TEXT NOT NULL,
+        output TEXT NOT NULL,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        command_hash TEXT NOT NULL,
+        UNIQUE (log_path, output, mtime, start_ms, end_ms)
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS build_steps_run ON build_steps (run_id)',
+    'CREATE INDEX IF NOT EXISTS build_steps_output ON build_steps (log_path, output, run_id)',
+    """
+    CREATE TABLE IF NOT EXISTS jira_issues (
+        issue TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lint_passed (
+        tool TEXT NOT NULL,
+        blob TEXT NOT NULL,
+        checked_at REAL NOT NULL,
+        PRIMARY KEY (tool, blob)
+    )
+    """,
+]
+
+# Connections can't be shared with forked children (e.g. the daemon's), so remember who opened it.
+_conn = None
+_conn_pid = None
+
+
+def _migrate_legacy_cache(conn):
+    import yaml
+
+    with transaction(conn):
+        # Another process may have finished the migration while we were waiting for the lock.
+        if not os.path.isfile(kLegacyCachePath):
+            return
+        with open(kLegacyCachePath) as cache_file:
+            cache = yaml.safe_load(cache_file) or {}
+        now = time.time()
+        for ticket, data in cache.items():
+            conn.execute('INSERT OR IGNORE INTO tickets VALUES (?, ?, ?)',
+                         (str(ticket), json.dumps(data or {}), now))
+
+    try:
+        os.replace(kLegacyCachePath, f'{kLegacyCachePath}.migrated')
+    except FileNotFoundError:
+        pass  # Renamed by a concurrent migration.
+
+
+def connect():
+    global _conn
+    global _conn_pid
+
+    if _conn is None or _conn_pid != os.getpid():
+        state_dir.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(kDatabasePath), timeout=30, isolation_level=None)
+        _conn_pid = os.getpid()
+        _conn.execute('PRAGMA journal_mode=WAL')
+        for statement in kSchema:
+            _conn.execute(statement)
+
+        if os.path.isfile(kLegacyCachePath):
+            _migrate_legacy_cache(_conn)
+    return _conn
+
+
+@contextlib.contextmanager
+def transaction(conn=None):
+    """
+    Run the block as one transaction that holds the write lock from the start, so read-modify-write
+    updates from concurrent processes can't clobber each other.
+    """
+    conn = conn or connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def get_ticket(ticket):
+    """
+    :return: the cached data of a ticket, or an empty dict for a ticket we haven't seen.
+    """
+    row = connect().execute('SELECT data FROM tickets WHERE ticket = ?', (ticket,)).fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def update_ticket(ticket, **fields):
+    """
+    Atomically merge fields into the cached data of a ticket.
+
+    :return: the updated data.
+    """
+    with transaction() as conn:
+        row = conn.execute('SELECT data FROM tickets WHERE ticket = ?', (ticket,)).fetchone()
+        data = json.loads(row[0]) if row else {}
+        data.update(fields)
+        conn.execute('INSERT OR REPLACE INTO tickets VALUES (?, ?, ?)', (ticket, json.dumps(data), time.time()))
+    return data
+
+
+def delete_ticket(ticket):
+    with transaction() as conn:
+        conn.execute('DELETE FROM tickets WHERE ticket = ?', (ticket,))
+
+
+def list_tickets():
+    """
+    :return: dict of ticket number to (data, last update time) for every cached ticket.
+    """
+    rows = connect().execute('SELECT ticket, data, updated_at FROM tickets ORDER BY ticket')
+    return {ticket: (json.loads(data), updated_at) for ticket, data, updated_at in rows}
+
+
+def delete_tickets(tickets):
+    """
+    Delete several tickets in one transaction, skipping any that were updated since they were read.
+
+    :param tickets: dict of ticket number to the last update time returned by list_tickets().
+    :return: the tickets that were deleted and the number of bytes of ticket data they held.
+    """
+    deleted = []
+    reclaimed = 0
+    with transaction() as conn:
+        for ticket, updated_at in tickets.items():
+            row = conn.execute('SELECT data FROM tickets WHERE ticket = ? AND updated_at = ?',
+                               (ticket, updated_at)).fetchone()
+            if row:
+                conn.execute('DELETE FROM tickets WHERE ticket = ?', (ticket,))
+                deleted.append(ticket)
+                reclaimed += len(ticket) + len(row[0])
+    return deleted, reclaimed
+
+
+def compact():
+    """
+    Give the space of deleted rows back to the file system.
+
+    :return: the number of bytes the database shrank by.
+    """
+    conn = connect()
+    size_before = _database_size()
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return size_before - _database_size()
+
+
+def _database_size():
+    size = 0
+    for suffix in ('', '-wal'):
+        try:
+            size += os.path.getsize(f'{kDatabasePath}{suffix}')
+        except OSError:
+            pass
+    return size
+
+
+def get_issues(issues, max_age):
+    """
+    :return: dict of issue key to the cached Jira fields of the issues that were fetched less than max_age seconds ago.
+    """
+    issues = list(issues)
+    if not issues:
+        return {}
+    placeholders = ', '.join('?' * len(issues))
+    rows = connect().execute(f'SELECT issue, data FROM jira_issues WHERE issue IN ({placeholders}) AND fetched_at > ?',
+                             (*issues, time.time() - max_age))
+    return {issue: json.loads(data) for issue, data in rows}
+
+
+def save_issues(issues):
+    """
+    :param issues: dict of issue key to the Jira fields to cache.
+    """
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany('INSERT OR REPLACE INTO jira_issues VALUES (?, ?, ?)',
+                         [(issue, json.dumps(data), now) for issue, data in issues.items()])
+
+
+def forget_issue(issue):
+    with transaction() as conn:
+        conn.execute('DELETE FROM jira_issues WHERE issue = ?', (issue,))
+
+
+def get_meta(key, default=None):
+    row = connect().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(key, value):
+    with transaction() as conn:
+        conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
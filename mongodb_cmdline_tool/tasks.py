@@ -1,14 +1,16 @@
 import os
 import pathlib
 import re
+import subprocess
 import sys
-import webbrowser
+import tempfile
+import time
 
-import jira
-import yaml
 from invoke import task
+from invoke.exceptions import UnexpectedExit
 
-from mongodb_cmdline_tool.utils import get_jira_pwd, print_bold
+from mongodb_cmdline_tool import git_metadata, jira_queue, store
+from mongodb_cmdline_tool.utils import config_path, get_config, get_jira_pwd, print_bold, self_update_result_path
 
 jira_username = None
 jira_password = None
@@ -19,9 +21,22 @@ kHome = pathlib.Path.home()
 # kPackageDir = pathlib.Path(os.path.dirname(os.path.realpath(__file__)))
 kPackageDir = kHome / '.config' / 'mongodb-cmdline-tool'
 
+# How often the ticket cache is garbage collected in the background.
+kGcIntervalSecs = 24 * 60 * 60
+
+# How often finalize checks for a new version of the tool, unless set with self_update_interval_hours in the config.
+kSelfUpdateIntervalHours = 24
+kSelfUpdateLogPath = kPackageDir / 'self-update.log'
+
+# How long `m status` reuses the Jira statuses it fetched.
+kIssueCacheSecs = 5 * 60
+
 def get_jira():
     global jira_cli
     if not jira_cli:
+        # jira pulls in requests, oauthlib and friends; only import it for tasks that talk to Jira.
+        import jira
+
         try:
             jira_cli = jira.JIRA(
                 options={'server': 'https://jira.mongodb.org'},
@@ -47,6 +62,8 @@ def init(c):
     if jira_username:
         return
 
+    import yaml
+
     # Use the Evergreen username for Jira as well.
     with open(pathlib.Path.home() / '.evergreen.yml') as evg_file:
         evg_config = yaml.load(evg_file)
@@ -64,34 +81,109 @@ def _strip_proj(ticket_number):
 
 def _get_ticket_numbers(c):
     """Get the ticket numbers from the commit and the branch."""
-    branch = c.run('git rev-parse --abbrev-ref HEAD', hide=True).stdout
+    branch = git_metadata.current_branch(c)
     ticket_number = _strip_proj(branch)
-    commit_msg = c.run('git log --oneline -1 --pretty=%s', hide=True).stdout
+    commit_msg = git_metadata.head_subject(c)
     commit_ticket_number = _strip_proj(commit_msg)
     return commit_ticket_number, ticket_number
 
 
-def _load_cache(c):
-    try:
-        with open(str(kPackageDir / 'cache'), 'r') as cache_file:
-            cache = yaml.load(cache_file)
-            return cache or {}
-    except IOError:
-        # File doesn't exist.
-        return {}
+def _git_refresh(c, *branches):
+    """
+    Fast-forward local branches to their latest version on origin, using a single fetch.
+
+    Branches that aren't checked out in any worktree are updated by moving the ref, so no working tree or index (and
+    therefore no build) is touched.
+
+    :return: the branches that have diverged from origin and were left as they are.
+    """
+    refspecs = ' '.join(f'+refs/heads/{branch}:refs/remotes/origin/{branch}' for branch in branches)
+    c.run(f'git fetch origin {refspecs}')
+
+    checked_out = git_metadata.checked_out_branches(c)
+    diverged = []
+    for branch in branches:
+        local = git_metadata.resolve(c, f'refs/heads/{branch}')
+        remote = git_metadata.resolve(c, f'refs/remotes/origin/{branch}')
+
+        if not local:
+            c.run(f'git branch --track {branch} origin/{branch}', hide=True)
+        elif local == remote:
+            continue
+        elif c.run(f'git merge-base --is-ancestor {local} {remote}', warn=True, hide=True).ok:
+            if branch in checked_out:
+                c.run(f'git -C {checked_out[branch]} merge --ff-only origin/{branch}', hide=True)
+            else:
+                # Compare-and-swap, in case something else moved the branch in the meantime.
+                c.run(f'git update-ref refs/heads/{branch} {remote} {local}', hide=True)
+        elif c.run(f'git merge-base --is-ancestor {remote} {local}', warn=True, hide=True).ok:
+            print(f'[INFO] {branch} has local commits that are not on origin/{branch} yet, not updating it')
+        else:
+            print(f'[WARNING] {branch} has diverged from origin/{branch}, not updating it. To update it, run: '
+                  f'git checkout {branch} && git rebase origin/{branch}')
+            diverged.append(branch)
+    return diverged
+
+
+def _enter_ticket_worktree(c, branch, confirm=None):
+    """
+    Run the rest of the command for the current ticket, in its worktree unless a ticket branch is checked out in the
+    current directory.
+
+    :param branch: the base branch given on the command line, if any.
+    :param confirm: what the command is about to do, to ask before doing it to a ticket that isn't checked out in the
+        current directory. (Default: don't ask)
+    :return: the base branch to use, which defaults to the one the ticket was created from.
+    """
+    from mongodb_cmdline_tool import worktree
+
+    _, routed = worktree.enter_current_ticket(c)
+    if routed and confirm:
+        answer = input(f'{confirm} {git_metadata.current_branch(c)} in {os.getcwd()}? [y/N] ')
+        if answer.strip().lower() not in ('y', 'yes'):
+            print('[ERROR] Aborted')
+            sys.exit(1)
+    _, branch_num = _get_ticket_numbers(c)
+    return branch or store.get_ticket(branch_num).get('base', 'master')
+
+
+def _queue_jira_transition(issue, from_status, to_status, comment=None):
+    """
+    Update Jira in the background, so the command doesn't wait for it.
+    """
+    jira_queue.enqueue_transition(issue, from_status, to_status, comment)
+    print_bold(f'Queued Jira update: transition {issue} to "{to_status}"')
 
+    failed = jira_queue.count_failed()
+    if failed:
+        print(f'[WARNING] {failed} earlier Jira update(s) failed, run "m jira-queue" for details')
 
-def _store_cache(c, cache_dict):
-    with open(str(kPackageDir / 'cache'), 'w') as cache_file:
-        yaml.dump(cache_dict, cache_file)
 
+def _list_branches(c, merged_into=None):
+    """
+    Get the names of local branches in a single pass over the refs.
 
-def _git_refresh(c, branch):
-    old_branch = c.run('git rev-parse --abbrev-ref HEAD', hide=True).stdout
-    c.run(f'git checkout {branch}', hide=True)
-    c.run(f'git fetch origin {branch}')
-    c.run(f'git rebase origin/{branch}', hide=True)
-    c.run(f'git checkout {old_branch}', hide=True)
+    :param merged_into: only list branches that are merged into this one.
+    :return: dict of each branch to the subject of the commit it points to.
+    """
+    cmd = 'git for-each-ref --format="%(refname:short) %(subject)"'
+    if merged_into:
+        cmd += f' --merged={merged_into}'
+    lines = c.run(f'{cmd} refs/heads', hide=True).stdout.splitlines()
+    return dict(line.partition(' ')[::2] for line in lines)
+
+
+def _maybe_gc_in_background(c):
+    """
+    Garbage collect the ticket cache about once a day, without making the current command wait for it.
+    """
+    if time.time() - float(store.get_meta('last_gc', 0)) < kGcIntervalSecs:
+        return
+
+    store.set_meta('last_gc', str(time.time()))
+    subprocess.Popen([sys.executable, '-m', 'mongodb_cmdline_tool', 'gc'],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     env=dict(os.environ, M_NO_DAEMON='1'), start_new_session=True)
 
 
 def _post_update_steps(c):
@@ -101,70 +193,112 @@ def _post_update_steps(c):
     pass
 
 
-@task(aliases='n', positional=['ticket_number'], optional=['branch', 'project'])
-def new(c, ticket_number, branch='master', project='server'):
+@task(aliases='n', positional=['ticket_number'], optional=['branch', 'project', 'worktree'])
+def new(c, ticket_number, branch='master', project='server', worktree=False):
     """
-    Step 1: Create or switch to the branch for a ticket.
+    Step 1: Create or switch to the branch for a ticket, in the worktree for its base branch.
 
     :param ticket_number: Digits of the Jira ticket.
     :param branch: Base branch for this ticket. Default: master.
     :param project: Jira project. Default: server.
+    :param worktree: give the ticket a worktree and build directory of its own. Default: False.
     """
+    from mongodb_cmdline_tool import worktree as m_worktree
+
     init(c)
     ticket_number = _strip_proj(ticket_number)
 
     project = project.lower()
-
-    res = c.run(f'git rev-parse --verify {project}{ticket_number}', warn=True, hide=True)
-    if res.return_code == 0:
-        c.run(f'git checkout {project}{ticket_number}', hide='both')
+    ticket_branch = f'{project}{ticket_number}'
+    cwd = os.getcwd()
+
+    if git_metadata.branch_exists(c, ticket_branch):
+        path = git_metadata.checked_out_branches(c).get(ticket_branch) or \
+               store.get_ticket(ticket_number).get('worktree')
+        m_worktree.enter(path)
+        c.run(f'git checkout {ticket_branch}', hide='both')
+        if path:
+            store.update_ticket(ticket_number, project=project, worktree=str(path))
+        else:
+            store.update_ticket(ticket_number, project=project)
     else:
-        print_bold(f'Updating {branch} to latest and creating new branch: server{ticket_number}')
-        c.run(f'git checkout {branch}')
-        _git_refresh(c, branch)
-        c.run(f'git checkout -B {project}{ticket_number}', hide='both')
+        print_bold(f'Updating {branch} to latest and creating new branch: {ticket_branch}')
 
-        jirac = get_jira()
-        if jirac:
-            issue = jirac.issue(f'{project.upper()}-{ticket_number}')
-            if issue.fields.status.id == '1':  # '1' = Open
-                print_bold(
-                    f'Transitioning {project.upper()}-{ticket_number} in Jira to "In Progress"')
-                jirac.transition_issue(issue, '4')  # '4' = Start Progress
-            else:
-                print_bold(
-                    f'{project.upper()}-{ticket_number} in Jira is not in "Open" status, not updating Jira')
+        _git_refresh(c, branch)
+        path = m_worktree.path_for(branch, ticket_branch if worktree else None)
+        m_worktree.ensure(c, path, branch)
+        m_worktree.enter(path)
+        c.run(f'git checkout -B {ticket_branch} {branch}', hide='both')
 
-    cache = _load_cache(c)
-    if ticket_number not in cache:
-        cache[ticket_number] = {}
+        _queue_jira_transition(f'{project.upper()}-{ticket_number}', from_status='Open', to_status='In Progress')
+        store.update_ticket(ticket_number, project=project, base=branch, worktree=str(path))
 
-    cache[ticket_number]['project'] = project
-    _store_cache(c, cache)
+    store.set_meta('current_ticket', ticket_number)
+    if os.getcwd() != cwd:
+        print_bold(f'{ticket_branch} is checked out in {os.getcwd()}, run "cd {os.getcwd()}" to edit it there')
+    _maybe_gc_in_background(c)
 
 
-@task(aliases='s')
-def scons(c):
+@task(aliases='s', optional=['jobs', 'verbose'])
+def scons(c, jobs=None, verbose=False):
     """
     Step 2: [experimental] Check your code compiles, wrapper around "python buildscripts/scons.py".
+
+    :param jobs: number of parallel jobs. (Default: based on the available memory and load)
+    :param verbose: print every build step instead of a progress line, warnings and errors. (Default: False)
     """
     init(c)
-    num_cpus = os.cpu_count()
-    c.run(f'ninja -j{num_cpus}', pty=True)
 
+    from mongodb_cmdline_tool import build, worktree
+
+    worktree.enter_current_ticket(c)
+    exit_code = build.run_ninja(c, jobs=jobs, verbose=verbose)
+    if exit_code:
+        sys.exit(exit_code)
+
+
+@task(optional=['jobs'])
+def watch(c, jobs=None):
+    """
+    Rebuild the objects affected by a change whenever you save a file under src/. Run it next to build.ninja.
+
+    :param jobs: number of parallel jobs. (Default: based on the available memory and load)
+    """
+    from mongodb_cmdline_tool import watch as m_watch
+
+    m_watch.watch(c, jobs=jobs)
 
-@task(aliases='l', optional=['eslint'])
-def lint(c, eslint=False):
+
+@task(aliases='l', optional=['eslint', 'all', 'branch'])
+def lint(c, eslint=False, all=False, branch=None):
     """
     Step 3: lint and format your code: Wrapper around clang_format and eslint.
 
+    Only files changed since the base branch are checked, and files that passed before are skipped.
+
     :param eslint: Run ESLint for JS files. Default: False.
+    :param all: lint and format the whole tree with the scripts in buildscripts/. Default: False.
+    :param branch: the base branch to compare with. Default: the base branch of the ticket.
     """
     init(c)
-    with c.cd(str(kHome / 'mongo')):
+
+    from mongodb_cmdline_tool import lint as m_lint, worktree
+
+    ticket_data, _ = worktree.enter_current_ticket(c, default=worktree.kMainRepo)
+    os.chdir(c.run('git rev-parse --show-toplevel', hide=True).stdout.strip())
+
+    tools, missing = m_lint.find_tools(eslint)
+    if missing and not all:
+        print(f'[INFO] {" and ".join(missing)} not found on the PATH or in {config_path} in the version the '
+              f'repository requires, linting the whole tree instead')
+    if all or missing:
         if eslint:
             c.run('python2 buildscripts/eslint.py fix')
         c.run('python2 buildscripts/clang_format.py format')
+        return
+
+    if not m_lint.run(c, branch or ticket_data.get('base', 'master'), tools):
+        sys.exit(1)
 
 
 @task(aliases='c')
@@ -176,15 +310,15 @@ def commit(c):
 
     commit_num, branch_num = _get_ticket_numbers(c)
 
-    cache = _load_cache(c)
+    project = store.get_ticket(branch_num).get('project', 'server')
 
-    project = cache.get(branch_num, {}).get('project', 'server')
+    from mongodb_cmdline_tool import status as m_status
 
-    c.run('git add -u')
-
-    if project == 'server':
-        c.run('git add src/')
-        c.run('git add jstests/')
+    # Same as `git add -u`, plus `git add src/ jstests/` for the server, but only for the paths git status reports,
+    # so the tree isn't scanned again.
+    new_file_dirs = ('src/', 'jstests/') if project == 'server' else ()
+    m_status.stage([entry.path for entry in m_status.status(untracked=bool(new_file_dirs))
+                    if entry.kind != '?' or entry.path.startswith(new_file_dirs)])
 
     if commit_num == branch_num:
         c.run('git commit --amend --no-edit')
@@ -200,151 +334,205 @@ def review(c, new_cr=False, browser=True):
     """
     Step 5: Put your code up for code review.
 
+    If neither the commit nor its parent changed since the last upload and there are no uncommitted changes, the code
+    review is opened again without uploading anything.
+
     :param new_cr: whether to create a new code review. Use it if you have multiple CRs for the same ticket. (Default: False)
     :param no_browser: Set it if you're running this script in a ssh terminal.
     """
-    init(c)
     commit_num, branch_num = _get_ticket_numbers(c)
     if commit_num != branch_num:
         print( '[ERROR] Please commit your local changes before submitting them for review.')
         sys.exit(1)
 
-    cache = _load_cache(c)
-    if commit_num not in cache:
-        cache[commit_num] = {}
+    ticket_data = store.get_ticket(commit_num)
+    issue_number = ticket_data.get('cr', None)
+    project = ticket_data.get('project', 'server')
 
-    issue_number = cache[commit_num].get('cr', None)
-    project = cache[commit_num].get('project', 'server')
+    # Options that change what's uploaded, as opposed to where or how.
+    upload_opts = {'rev': 'HEAD~1'}
+    if project == 'server':
+        upload_opts.update(similarity=90, check_clang_format=True, check_eslint=True)
 
-    commit_msg = c.run('git log --oneline -1 --pretty=%s', hide=True).stdout.strip()
+    from mongodb_cmdline_tool import status as m_status
 
-    cmd = f'python2 {kPackageDir / "upload.py"} --rev HEAD~1 --nojira -y '
+    # The diff is taken against the working tree, so uncommitted changes are uploaded too. Those aren't part of the
+    # fingerprint, so an upload with them is never skipped, nor remembered.
+    fingerprint = None
+    if not m_status.status(untracked=False):
+        import hashlib
+        fingerprint = hashlib.sha1(':'.join([*git_metadata.head_trees(c), repr(sorted(upload_opts.items()))])
+                                   .encode()).hexdigest()
 
-    if project == 'server':
-        cmd += '--git_similarity 90 --check-clang-format --check-eslint'
+    import webbrowser
 
-    if issue_number and not new_cr:
-        cmd += f' -i {issue_number}'
-    else:
-        # New issue, add title.
-        cmd += f' -t "{commit_msg}"'
-
-    if not browser:
-        cmd += ' --no_oauth2_webbrowser'
+    if issue_number and not new_cr and fingerprint and ticket_data.get('cr_fingerprint') == fingerprint:
+        url = f'https://mongodbcr.appspot.com/{issue_number}'
+        print_bold(f'No changes since the last upload, opening code review page: {url}')
+        webbrowser.open(url)
+        return
 
-    print('Authenticating with OAuth2... If your browser did not open, press enter')
-    res = c.run(cmd, hide='stdout')
+    init(c)
 
-    match = re.search('Issue created. URL: (.*)', res.stdout)
-    if match:
-        url = match.group(1)
-        issue_number = url.split('/')[-1]
+    from mongodb_cmdline_tool import upload
 
-        jirac = get_jira()
-        if jirac:
-            ticket = get_jira().issue(f'{project.upper()}-{commit_num}')
-
-            # Transition Ticket
-            if ticket.fields.status.id == '3':  # '3' = In Progress.
-                print_bold(f'Transitioning {project.upper()}-{branch_num} in Jira to "Start Code Review"')
-                jirac.transition_issue(ticket, '761')  # '4' = Start Code Review
-
-                # Add comment.
-                get_jira().add_comment(
-                    ticket,
-                    f'CR: {url}',
-                    visibility={'type': 'role', 'value': 'Developers'}
-                )
-            else:
-                print_bold(
-                    f'SERVER-{branch_num} in Jira is not in "In Progress" status, not updating Jira')
-        else:
-            print_bold(f'Please manually add a link of your codereview to: '
-                       f'https://jira.mongodb.org/browse/{project.upper()}-{commit_num}')
+    if issue_number and not new_cr:
+        upload_opts['issue'] = issue_number
+    else:
+        # New issue, add title.
+        upload_opts['title'] = git_metadata.head_subject(c)
 
-    if not issue_number:
-        print('[ERROR] Something went wrong, no CR issue number was found')
+    print_bold('Uploading to code review...')
+    try:
+        result = upload.upload(open_browser=browser, **upload_opts)
+    except upload.UploadError as e:
+        print(f'[ERROR] {e}')
         sys.exit(1)
 
-    cache[commit_num]['cr'] = issue_number
+    if result.created:
+        _queue_jira_transition(f'{project.upper()}-{commit_num}', from_status='In Progress',
+                               to_status='In Code Review', comment=f'CR: {result.url}')
 
-    _store_cache(c, cache)
+    store.update_ticket(commit_num, cr=result.issue, cr_fingerprint=fingerprint)
 
-    url = f'https://mongodbcr.appspot.com/{issue_number}'
-    print_bold(f'Opening code review page: {url}')
+    url = f'https://mongodbcr.appspot.com/{result.issue}'
+    print_bold(f'Uploaded patchset {result.patchset}, opening code review page: {url}')
     webbrowser.open(url)
 
 
 @task(aliases='p', optional=['branch', 'finalize'])
-def patch(c, branch='master', finalize=False):
+def patch(c, branch=None, finalize=False):
     """
     Step 6: Run patch build in Evergreen.
 
 
     :param finalize: whether to finalize the patch build and have it run immediately. (Default: False)
-    :param branch: the base branch for the patch build. (Default: False)
+    :param branch: the base branch for the patch build. (Default: the base branch of the ticket)
     """
     init(c)
-    temp_branch = 'patch-build-branch'
-    feature_branch = c.run('git rev-parse --abbrev-ref HEAD', hide=True).stdout
-    commit_msg = c.run('git log --oneline -1 --pretty=%s', hide=True).stdout.strip()
+    branch = _enter_ticket_worktree(c, branch)
+    feature_branch = git_metadata.current_branch(c)
+    commit_msg = git_metadata.head_subject(c)
 
     commit_num, branch_num = _get_ticket_numbers(c)
     if commit_num != branch_num:
         print('[ERROR] Please commit your local changes before putting up a patch build.')
         sys.exit(1)
 
+    from mongodb_cmdline_tool import rebase
+
+    if _git_refresh(c, branch):
+        print(f'[ERROR] Not putting up a patch build on {branch}, which has diverged from origin/{branch}')
+        sys.exit(1)
+    base = f'refs/remotes/origin/{branch}'
     try:
-        _git_refresh(c, branch)
+        tree = rebase.merged_tree(base)
+    except rebase.Conflict as e:
+        print(f'[WARNING] {feature_branch} did not rebase cleanly, {e}. Please manually run '
+              f'"git rebase {branch}" and retry the patch build again')
+        sys.exit(1)
+
+    if tree:
+        _patch_from_tree(c, base, tree, commit_msg, finalize)
+    else:
+        _patch_in_working_tree(c, branch, feature_branch, commit_msg, finalize)
+
+    import webbrowser
+    webbrowser.open('https://evergreen.mongodb.com/patches/mine')
+
+    # TODO: store the link for future use.
+
+
+def _patch_from_tree(c, base, tree, commit_msg, finalize):
+    """
+    Put up a patch build of a tree as a diff against a base commit, without checking anything out.
+    """
+    base_sha = git_metadata.resolve(c, base)
+    with tempfile.NamedTemporaryFile(suffix='.diff') as diff_file:
+        c.run(f'git diff --binary {base_sha} {tree} > {diff_file.name}', hide=True)
+        cmd = f'evergreen patch-file -y -d "{commit_msg}" --diff-file {diff_file.name} --base {base_sha}'
+        if finalize:
+            cmd += ' -f'
+        c.run(cmd)
+
+
+def _patch_in_working_tree(c, branch, feature_branch, commit_msg, finalize):
+    """
+    Put up a patch build by rebasing on a temporary branch, for versions of git that can't merge in memory.
+    """
+    from mongodb_cmdline_tool import mtimes
+
+    temp_branch = 'patch-build-branch'
+    with mtimes.preserved(c, branch):
+        try:
+            c.run(f'git checkout -B {temp_branch}')
+            res = c.run(f'git rebase {branch}', warn=True)
+            if res.return_code != 0:
+                print(f'[WARNING] {feature_branch} did not rebase cleanly. Please manually run '
+                      f'"git rebase {branch}" and retry the patch build again')
+                c.run('git rebase --abort')
+                sys.exit(1)
 
-        c.run(f'git checkout -B {temp_branch}')
-        res = c.run(f'git rebase {branch}', warn=True)
-        if res.return_code != 0:
-            print(f'[WARNING] {feature_branch} did not rebase cleanly. Please manually run '
-                  f'"git rebase {branch}" and retry the patch build again')
-            c.run('git rebase --abort')
-            sys.exit(1)
-        else:
             cmd = f'evergreen patch -y -d "{commit_msg}"'
             if finalize:
                 cmd += ' -f'
             c.run(cmd)
-
-            webbrowser.open('https://evergreen.mongodb.com/patches/mine')
-
-            # TODO: store the link for future use.
-    finally:
-        c.run(f'git checkout {feature_branch}')
+        finally:
+            c.run(f'git checkout {feature_branch}')
 
 
 @task(aliases='f', optional=['push', 'branch'])
-def finalize(c, push=False, branch='master'):
+def finalize(c, push=False, branch=None):
     """
     Step 7: Finalize your changes. Merge them with the base branch and optionally push upstream.
 
     :param push: git push your changes (Default: False)
-    :param branch: the base branch for your changes. (Default: master)
+    :param branch: the base branch for your changes. (Default: the base branch of the ticket)
     """
     init(c)
+    branch = _enter_ticket_worktree(c, branch, confirm='Finalize and push' if push else None)
 
     commit_num, branch_num = _get_ticket_numbers(c)
     if commit_num != branch_num:
         print('[ERROR] Please commit your local changes before finalizing.')
         sys.exit(1)
 
-    feature_branch = c.run('git rev-parse --abbrev-ref HEAD', hide=True).stdout
-
-    _git_refresh(c, branch)
+    feature_branch = git_metadata.current_branch(c)
 
-    res = c.run(f'git rebase {branch}', warn=True)
-    if res.return_code != 0:
-        print(f'[ERROR] Did not rebase cleanly onto {branch}, please manually run: git rebase {branch}')
-        c.run(f'git checkout {feature_branch}')
+    if _git_refresh(c, branch):
+        print(f'[ERROR] Not finalizing onto {branch}, which has diverged from origin/{branch}')
         sys.exit(1)
-    c.run(f'git checkout {branch}')
-    c.run(f'git merge {feature_branch}')
 
-    push_cmd = 'git push'
+    from mongodb_cmdline_tool import mtimes, rebase
+
+    with mtimes.preserved(c, branch):
+        try:
+            rebased = rebase.replay(branch)
+        except rebase.Conflict as e:
+            print(f'[ERROR] Did not rebase cleanly onto {branch}, {e}. Please manually run: git rebase {branch}')
+            sys.exit(1)
+
+        if rebased:
+            # Moves the branch to the rebased commits, only writing the files that changed on the base branch.
+            c.run(f'git reset --keep {rebased}')
+        else:
+            res = c.run(f'git rebase {branch}', warn=True)
+            if res.return_code != 0:
+                print(f'[ERROR] Did not rebase cleanly onto {branch}, please manually run: git rebase {branch}')
+                c.run(f'git checkout {feature_branch}')
+                sys.exit(1)
+
+        # The base branch can't be checked out here if another worktree has it, so merge it over there.
+        base_dir = git_metadata.checked_out_branches(c).get(branch)
+        if base_dir:
+            c.run(f'git -C {base_dir} merge --ff-only {feature_branch}')
+        else:
+            # The rebased branch is a fast-forward of the base branch, so moving the base branch over and checking
+            # it out leaves the files as they are.
+            c.run(f'git update-ref refs/heads/{branch} refs/heads/{feature_branch}')
+            c.run(f'git checkout {branch}')
+
+    push_cmd = f'git -C {base_dir} push' if base_dir else 'git push'
     if not push:
         push_cmd += ' -n'
 
@@ -354,16 +542,21 @@ def finalize(c, push=False, branch='master'):
         c.run(f'git checkout {feature_branch}')
         sys.exit(1)
 
-    cache = _load_cache(c)
-    project = cache.get(branch_num, {}).get('project', 'server')
+    ticket_data = store.get_ticket(branch_num)
+    project = ticket_data.get('project', 'server')
 
     if push:
-        if branch_num in cache:
-            del cache[branch_num]
-            _store_cache(c, cache)
+        store.delete_ticket(branch_num)
 
+        if base_dir:
+            c.run('git checkout --detach', hide='both')
         c.run(f'git branch -d {feature_branch}')
 
+        from mongodb_cmdline_tool import worktree
+
+        if ticket_data.get('worktree') == str(worktree.path_for(branch, feature_branch)):
+            worktree.remove(c, ticket_data['worktree'])
+
         # TODO: Update Jira and close CR.
         # jirac = get_jira()
         # if jirac:
@@ -385,22 +578,257 @@ def finalize(c, push=False, branch='master'):
         'if you haven\'t already. The comment should have "Developer" visibility')
     print_bold(f'https://jira.mongodb.com/browse/{project}-{branch_num}')
 
-    self_update(c)
+    _maybe_gc_in_background(c)
+    _maybe_self_update(c)
+
+
+@task(optional=['branch', 'ttl_days', 'dry_run'])
+def gc(c, branch='master', ttl_days=7, dry_run=False):
+    """
+    Remove cached tickets whose branch was deleted or merged into its base branch, and compiler cache entries that
+    weren't used recently. Also runs daily in the background.
+
+    :param branch: the base branch of tickets that don't have one cached. (Default: master)
+    :param ttl_days: only remove tickets that haven't been used for this many days. (Default: 7)
+    :param dry_run: only print the tickets that would be removed. (Default: False)
+    """
+    store.set_meta('last_gc', str(time.time()))
+
+    branches = _list_branches(c)
+    merged = {}
+    cutoff = time.time() - ttl_days * 24 * 60 * 60
+
+    def is_merged(project, ticket, base):
+        if base not in branches:
+            return False
+        if base not in merged:
+            merged[base] = _list_branches(c, merged_into=base)
+        # A new ticket branch without commits of its own is merged into the base branch too, but still points to a
+        # commit of another ticket.
+        subject = merged[base].get(f'{project}{ticket}')
+        return subject is not None and re.search(rf'\b{project}-{ticket}\b', subject, re.IGNORECASE) is not None
+
+    tickets = store.list_tickets()
+    stale = {}
+    for ticket, (data, updated_at) in tickets.items():
+        project = data.get('project', 'server')
+        if updated_at < cutoff and (f'{project}{ticket}' not in branches or
+                                    is_merged(project, ticket, data.get('base', branch))):
+            stale[ticket] = updated_at
+
+    if dry_run:
+        print_bold(f'Would remove {len(stale)} of {len(tickets)} cached tickets: {", ".join(sorted(stale))}')
+        return
+
+    deleted, reclaimed = store.delete_tickets(stale)
+    reclaimed_on_disk = store.compact() if deleted else 0
+    print_bold(f'Removed {len(deleted)} of {len(tickets)} cached tickets, reclaiming {reclaimed} bytes of ticket data '
+               f'and {reclaimed_on_disk} bytes on disk')
+
+    from mongodb_cmdline_tool import ccache
+
+    if ccache.available() and ccache.evict_unused():
+        print_bold('Removed compiler cache entries that were not used recently')
 
 
-@task(aliases='u')
-def self_update(c):
+@task(name='build-stats', optional=['limit'])
+def build_stats(c, limit=10):
+    """
+    Show where the build time goes, from the history of "m scons" builds in the current directory.
+
+    :param limit: number of entries in each section. (Default: 10)
+    """
+    from mongodb_cmdline_tool import build, build_history
+
+    def secs(ms):
+        return f'{ms / 1000:.1f}s'
+
+    if not os.path.isfile(build.kManifest):
+        print(f'[ERROR] Run "m build-stats" in the directory with {build.kManifest}')
+        sys.exit(1)
+    log_path = build_history.find_log(build.kManifest)
+    build_history.ingest(log_path)
+    run_id = build_history.latest_run(log_path)
+    if not run_id:
+        print_bold('No builds recorded yet, run "m scons" first')
+        return
+    limit = int(limit)
+
+    print_bold('Steps that took the most time altogether (last, average, times built, total):')
+    for output, last, average, count, total in build_history.slowest(log_path, limit):
+        print(f'{secs(last):>9} {secs(average):>9} {count:>6} {secs(total):>10}  {output}')
+
+    print_bold('Steps that got slower in the last build (now, before):')
+    for output, duration, median in build_history.regressions(log_path, run_id, limit):
+        print(f'{secs(duration):>9} {secs(median):>9}  {output}')
+
+    path = build_history.critical_path(run_id)
+    total = path[-1][2] - path[0][1]
+    print_bold(f'Likely critical path of the last build ({secs(total)}, longest steps first):')
+    for output, start, end in sorted(path, key=lambda step: step[1] - step[2])[:limit]:
+        print(f'{secs(end - start):>9} at {secs(start):>9}  {output}')
+
+    print_bold('Builds after switching branches (steps, CPU time, duration):')
+    for previous, branch, steps, cpu_ms, duration_ms in build_history.branch_switches(log_path, limit):
+        print(f'{steps:>7} {secs(cpu_ms):>10} {secs(duration_ms):>9}  {previous} -> {branch}')
+
+
+@task(name='jira-queue', optional=['retry', 'clear', 'flush'])
+def show_jira_queue(c, retry=False, clear=False, flush=False):
+    """
+    Show Jira updates that are waiting to be sent in the background or have failed.
+
+    :param retry: retry the failed updates. (Default: False)
+    :param clear: drop the failed updates. (Default: False)
+    :param flush: send the pending updates now instead of in the background. (Default: False)
+    """
+    if retry:
+        jira_queue.retry_failed()
+    if clear:
+        print_bold(f'Dropped {jira_queue.clear_failed()} failed Jira update(s)')
+    if flush:
+        jira_queue.flush()
+
+    updates = jira_queue.list_updates()
+    if not updates:
+        print_bold('No queued Jira updates')
+        return
+
+    now = time.time()
+    for update_id, issue, args, status, attempts, next_attempt_at, last_error in updates:
+        line = f'{update_id:>5}  {status:<8} {jira_queue.describe(issue, args)}'
+        if status == jira_queue.kPending:
+            line += f', next attempt in {max(0, int(next_attempt_at - now))}s'
+        if attempts:
+            line += f', {attempts} failed attempt(s), last error: {last_error}'
+        print(line)
+
+
+@task(aliases=['st'], optional=['refresh'])
+def status(c, refresh=False):
+    """
+    Show every ticket you have a branch for, with its Jira status and code review.
+
+    :param refresh: fetch the Jira statuses even if they were fetched in the last few minutes. (Default: False)
+    """
+    current_branch = git_metadata.current_branch(c)
+    res = c.run('git for-each-ref --sort=-committerdate --format="%(refname:short)%09%(committerdate:relative)" '
+                'refs/heads', hide=True)
+
+    tickets = store.list_tickets()
+    rows = []
+    for line in res.stdout.splitlines():
+        branch, _, last_commit = line.partition('\t')
+        match = re.fullmatch(r'([a-z]+)([0-9]+)', branch)
+        if not match:
+            continue
+        project, ticket_number = match.groups()
+        data = tickets.get(ticket_number, ({}, None))[0]
+        rows.append((branch, f'{project.upper()}-{ticket_number}', data.get('cr') or '', last_commit))
+
+    if not rows:
+        print_bold('No ticket branches found')
+        return
+
+    keys = [key for _, key, _, _ in rows]
+    issues = {} if refresh else store.get_issues(keys, max_age=kIssueCacheSecs)
+    missing = [key for key in keys if key not in issues]
+    if missing:
+        init(c)
+        jirac = get_jira()
+        if jirac:
+            import jira
+
+            try:
+                # Don't validate the query, so a branch for a ticket that doesn't exist doesn't fail the search.
+                found = jirac.search_issues(f'key in ({", ".join(missing)})', fields='status,summary',
+                                            maxResults=len(missing), validate_query=False)
+                fetched = {issue.key: {'status': issue.fields.status.name, 'summary': issue.fields.summary}
+                           for issue in found}
+                store.save_issues(fetched)
+                issues.update(fetched)
+            except jira.exceptions.JIRAError as e:
+                print(f'[WARNING] Failed to fetch the Jira statuses: {e.text}')
+
+    print(f'  {"TICKET":<14} {"STATUS":<16} {"CR":<10} {"LAST COMMIT":<16} SUMMARY')
+    for branch, key, cr, last_commit in rows:
+        issue = issues.get(key, {})
+        marker = '*' if branch == current_branch else ' '
+        print(f'{marker} {key:<14} {issue.get("status", "?"):<16} {cr:<10} {last_commit:<16} '
+              f'{issue.get("summary", "")[:60]}')
+
+
+@task(aliases='u', optional=['background'])
+def self_update(c, background=False):
     """
     Update this tool.
+
+    :param background: report the outcome on the next run of m instead of printing it. (Default: False)
+    """
+    if not background:
+        message = _self_update(c)
+        if message:
+            print_bold(message)
+        return
+
+    try:
+        message = _self_update(c)
+    except UnexpectedExit as e:
+        message = f'[WARNING] Failed to update the MongoDB Server Commandline Tool in the background, run "m u" ' \
+                  f'to retry. The log is at {kSelfUpdateLogPath}\n{e.result.stderr.strip()}'
+    if message:
+        with open(self_update_result_path, 'w') as result_file:
+            result_file.write(message)
+
+
+def _maybe_self_update(c):
+    """
+    Update this tool in the background, at most once per interval, so commands don't wait for it.
+    """
+    interval_secs = float(get_config('self_update_interval_hours', kSelfUpdateIntervalHours)) * 60 * 60
+    if time.time() - float(store.get_meta('last_self_update', 0)) < interval_secs:
+        return
+
+    store.set_meta('last_self_update', str(time.time()))
+    kPackageDir.mkdir(parents=True, exist_ok=True)
+    with open(kSelfUpdateLogPath, 'a') as log_file:
+        subprocess.Popen([sys.executable, '-m', 'mongodb_cmdline_tool', 'self-update', '--background'],
+                         stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file,
+                         env=dict(os.environ, M_NO_DAEMON='1'), start_new_session=True)
+
+
+def _self_update(c):
+    """
+    Fetch the latest version of this tool and reinstall it if it changed.
+
+    :return: a message describing the update, or None if the tool was up to date.
     """
     print_bold('Updating MongoDB Server Commandline Tool...')
     with c.cd(str(kPackageDir)):
         c.run('git fetch', warn=False, hide='both')
-        c.run('git rebase', warn=False, hide='both')
 
-        # Ignore failures if we can't install or upgrade with pip3.
-        c.run('pip3 install --upgrade .', warn=True)
+        branch = git_metadata.current_branch(c, path=kPackageDir)
+        old_head = head = git_metadata.resolve(c, 'HEAD', path=kPackageDir)
+        if head != git_metadata.resolve(c, f'refs/remotes/origin/{branch}', path=kPackageDir):
+            c.run('git rebase', warn=False, hide='both')
+            head = git_metadata.resolve(c, 'HEAD', path=kPackageDir)
+
+        installed = store.get_meta('installed_head')
+        if not installed:
+            # An install we don't know about is assumed to match the checkout as it was before the update.
+            installed = old_head
+            store.set_meta('installed_head', installed)
+        if head == installed:
+            print_bold('MongoDB Server Commandline Tool is up to date')
+            return None
+
+        # Don't fail the command if we can't install or upgrade with pip3, the next update retries it.
+        res = c.run('pip3 install --upgrade .', warn=True)
+        if not res.ok:
+            return '[WARNING] Failed to install the latest MongoDB Server Commandline Tool, run "m u" to retry'
+        store.set_meta('installed_head', head)
         _post_update_steps(c)
+    return f'Updated the MongoDB Server Commandline Tool to {head[:10]}'
 
 
 @task(aliases='j', optional=['ticket'])
@@ -412,13 +840,45 @@ def open_jira(c, ticket=None):
     """
     commit_num, branch_num = _get_ticket_numbers(c)
 
-    cache = _load_cache(c)
-
-    project = cache.get(branch_num, {}).get('project', 'server')
+    project = store.get_ticket(branch_num).get('project', 'server')
 
     print_bold(f'opening Jira for ticket {project.upper()}-{branch_num}')
 
     if not ticket:
         ticket = branch_num
 
-    webbrowser.open(f'https://jira.mongodb.org/browse/{project.upper()}-{ticket}')
\ No newline at end of file
+    import webbrowser
+    webbrowser.open(f'https://jira.mongodb.org/browse/{project.upper()}-{ticket}')
+
+@task(optional=['stop'])
+def daemon(c, stop=False):
+    """
+    Start a background daemon that keeps Jira and your configs loaded, so other commands start instantly.
+
+    Commands automatically run in-process when the daemon isn't running. Set M_NO_DAEMON=1 to bypass it.
+
+    :param stop: Stop the running daemon instead. (Default: False)
+    """
+    import signal
+
+    from mongodb_cmdline_tool import daemon as m_daemon
+
+    pid = m_daemon.read_pid()
+    if stop:
+        if not m_daemon.is_running() or not pid:
+            print('[INFO] The m daemon is not running')
+            return
+        os.kill(pid, signal.SIGTERM)
+        print_bold(f'Stopped the m daemon (pid {pid})')
+        return
+
+    if m_daemon.is_running():
+        print_bold(f'The m daemon is already running (pid {pid})')
+        return
+
+    kPackageDir.mkdir(parents=True, exist_ok=True)
+    with open(m_daemon.kLogPath, 'a') as log_file:
+        proc = subprocess.Popen([sys.executable, '-m', 'mongodb_cmdline_tool.daemon'],
+                                stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file,
+                                start_new_session=True)
+    print_bold(f'Started the m daemon (pid {proc.pid}), logging to {m_daemon.kLogPath}')
@@ -0,0 +1,598 @@
+"""
+Upload the commit of a ticket to the code review server, in the same process as the rest of the tool.
+
+This is the part of upload.py (Rietveld's upload script, which only runs on Python 2) that `m review` uses: git only,
+OAuth 2.0 only, no Jira updates, since the tool queues those itself. The steps are the same as in its RealMain:
+diff the commit against its parent, check the files in the diff with clang-format and ESLint, create the issue or
+a new patchset with the diff, then upload the base version of every file, concurrently, so the review shows full
+files side by side.
+
+HTTP requests go through the session shared with the rest of the tool. The OAuth 2.0 access token is remembered
+between runs and only fetched again when the server turns it down.
+"""
+import collections
+import hashlib
+import http.server
+import mimetypes
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import urllib.parse
+import webbrowser
+from concurrent.futures import ThreadPoolExecutor
+
+from mongodb_cmdline_tool import store
+from mongodb_cmdline_tool.utils import http_session
+
+kServer = 'https://mongodbcr.appspot.com'
+
+# The server doesn't take patches or files larger than this; larger patches are uploaded one file at a time.
+kMaxUploadSize = 900 * 1024
+kMaxTitleLength = 100
+
+kUploadThreads = 8
+kTimeoutSecs = 70
+kMaxTries = 4
+
+kOAuthPort = 8001
+kOAuthPath = '/get-access-token'
+kAccessTokenMetaKey = 'cr_access_token'
+
+kMultipartBoundary = '-M-A-G-I-C---B-O-U-N-D-A-R-Y-'
+
+# Shown by the browser after it sent the access token to the local server.
+kOAuthDonePage = b"""<html>
+  <head>
+    <title>Authentication Status</title>
+    <script>window.onload = function() { window.close(); }</script>
+  </head>
+  <body><p>The authentication flow has completed.</p></body>
+</html>
+"""
+
+# Renamed files whose deletions are diffed again by path; with more, all deletions are diffed again.
+kMaxRenamedPathspecs = 1000
+
+# git reports this hash for the missing side of an added or deleted file.
+kNullHash = '0' * 40
+
+Result = collections.namedtuple('Result', ['issue', 'patchset', 'url', 'created'])
+
+# Base version of a file in the diff: its content (None when it isn't uploaded, empty when it's too large), whether
+# the file is binary, its svn-style status ('A', 'A +' for renames and copies, 'D' or 'M') and whether it's larger
+# than kMaxUploadSize.
+BaseFile = collections.namedtuple('BaseFile', ['content', 'is_binary', 'status', 'too_large'])
+
+# Size of the reads that skip over objects that are too large to upload.
+kSkipChunkSize = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+def _git(*args, binary=False):
+    """
+    :return: the output of git, as bytes if binary is set, else as text with newlines normalized to \\n and bytes that
+        aren't UTF-8 kept as surrogates, so encoding the text again gives back the original bytes.
+    """
+    env = dict(os.environ, LC_MESSAGES='C')
+    # --no-ext-diff is broken in some versions of git.
+    env.pop('GIT_EXTERNAL_DIFF', None)
+    text_args = {} if binary else {'encoding': 'utf-8', 'errors': 'surrogateescape'}
+    res = subprocess.run(['git', *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, **text_args)
+    if res.returncode != 0:
+        stderr = res.stderr if not binary else res.stderr.decode(errors='replace')
+        raise UploadError(f'git {args[0]} failed: {stderr.strip()}')
+    return res.stdout
+
+
+def _encode(text):
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def _diff_files(*args):
+    """
+    Run `git diff --raw -z -p` and split its output into files.
+
+    :return: list of (status, path, patch) in the order git diff prints them, where status is the letter of the change
+        and path is the path before the change, or None if the output can't be split, e.g. with unmerged files.
+    """
+    output = _git('diff', '--raw', '-z', '-p', *args)
+    # The raw part comes first, ":<modes> <hashes> <status>\0<path>\0" with a second path for renames and copies,
+    # then an empty field and the patch.
+    fields = output.split('\0')
+    entries = []
+    i = 0
+    while i < len(fields) and fields[i].startswith(':'):
+        status = fields[i].split()[-1][0]
+        entries.append((status, fields[i + 1]))
+        i += 3 if status in 'RC' else 2
+    if not entries:
+        return []
+    patch = '\0'.join(fields[i + 1:])
+
+    # A type change is printed as a deletion and an addition.
+    if not patch.startswith('diff --git '):
+        return None
+    chunks = re.split(r'^(?=diff --git )', patch, flags=re.MULTILINE)[1:]
+    files = []
+    for status, path in entries:
+        count = 2 if status == 'T' else 1
+        if status not in 'ADMRCT' or len(chunks) < count:
+            return None
+        files.append((status, path, ''.join(chunks[:count])))
+        chunks = chunks[count:]
+    return files if not chunks else None
+
+
+def generate_diff(rev, similarity=50):
+    """
+    :param rev: the revision to diff against, or 'rev1:rev2' for the changes between two revisions.
+    :param similarity: the minimum similarity percentage for detecting renames and copies. (Default: 50)
+    :return: the git diff of the changes.
+    """
+    revs = rev.split(':', 1)
+    cmd = ['--no-color', '--no-ext-diff', '--full-index', '--ignore-submodules', '--src-prefix=a/', '--dst-prefix=b/']
+    deletions_cmd = [*cmd, '--no-renames', '--diff-filter=D']
+
+    # With rename detection, the diff of a renamed file doesn't show what was removed from the old one, which the
+    # review should show. So the diff is the deleted files as a diff without rename detection prints them, then the
+    # rest as a diff with it prints them. Both come from a single diff with rename detection, except the files that
+    # were renamed: their deletions are diffed again, from the empty tree so that the working tree isn't looked at.
+    files = _diff_files(*cmd, '-l100000', f'-C{similarity}%', '--find-copies-harder', *revs)
+    if files is None:
+        diff = _git('diff', *deletions_cmd, *revs)
+        diff += _git('diff', *cmd, '--diff-filter=AMCRT', '-l100000', f'-C{similarity}%', '--find-copies-harder',
+                     *revs)
+    else:
+        deletions = [(path, patch) for status, path, patch in files if status == 'D']
+        renamed = [path for status, path, _ in files if status == 'R']
+        if len(renamed) > kMaxRenamedPathspecs:
+            deletions = [(None, _git('diff', *deletions_cmd, *revs))]
+        elif renamed:
+            empty_tree = _git('hash-object', '-t', 'tree', os.devnull).strip()
+            renamed_deletions = _diff_files(*deletions_cmd, revs[0], empty_tree, '--',
+                                            *(f':(literal){path}' for path in renamed))
+            if renamed_deletions is None:
+                raise UploadError('Cannot diff the deletions of renamed files')
+            # Both are in the order of the paths, which is how git diff orders its output too.
+            deletions = sorted(deletions + [(path, patch) for _, path, patch in renamed_deletions],
+                               key=lambda deletion: _encode(deletion[0]))
+        diff = ''.join(patch for _, patch in deletions)
+        diff += ''.join(patch for status, _, patch in files if status != 'D')
+    if not diff:
+        raise UploadError(f'There are no changes since {rev}')
+    return diff
+
+
+def post_process_diff(diff):
+    """
+    Add an svn-style "Index:" line before the diff of each file, which is how the server splits the diff into files.
+
+    :return: the diff, a dict of each file to the (before, after) blob hashes of its base version, with None for a
+        missing side, and a dict of each renamed or copied file to the file it came from.
+    """
+    lines = []
+    hashes = {}
+    renames = {}
+    filename = None
+    for line in diff.splitlines():
+        match = re.match(r'diff --git a/(.*) b/(.*)$', line)
+        if match:
+            # The name after the change, so renames show up under their new name.
+            filename = match.group(2)
+            lines.append(f'Index: {filename}\n')
+            if match.group(1) != match.group(2):
+                renames[match.group(2)] = match.group(1)
+        else:
+            # e.g. "index 82c0d44..b2cee3f 100755", where the first hash is the base file.
+            match = re.match(r'index (\w+)\.\.(\w+)', line)
+            if match:
+                hashes[filename] = tuple(None if sha == kNullHash else sha for sha in match.groups())
+        lines.append(f'{line}\n')
+    if filename is None:
+        raise UploadError('No valid patches found in the output of git diff')
+    return ''.join(lines), hashes, renames
+
+
+def _is_image(filename):
+    mimetype = mimetypes.guess_type(filename)[0]
+    return bool(mimetype) and mimetype.startswith('image/') and not mimetype.startswith('image/svg')
+
+
+def read_objects(names, max_size):
+    """
+    Read objects from a single `git cat-file --batch`, which is given all the names at once while their contents are
+    read back.
+
+    :param names: object names, e.g. blob hashes or HEAD:<path>.
+    :param max_size: objects larger than this are skipped over without being kept in memory.
+    :return: dict of each name to the content of the object, or None if it's larger than max_size.
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+
+    proc = subprocess.Popen(['git', 'cat-file', '--batch'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def write_names():
+        try:
+            proc.stdin.write(''.join(f'{name}\n' for name in names).encode('utf-8', 'surrogateescape'))
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass  # git exited, which reading its output reports.
+
+    # A thread feeds the names, so git never waits for its output to be read while the names are written.
+    writer = threading.Thread(target=write_names)
+    writer.start()
+    objects = {}
+    try:
+        for name in names:
+            # "<sha> <type> <size>", or "<name> missing".
+            header = proc.stdout.readline()
+            if not header or header.endswith((b' missing\n', b' ambiguous\n')):
+                raise UploadError(f'Cannot read {name} from git: {header.decode(errors="replace").strip()}')
+            size = int(header.split()[2])
+            if size > max_size:
+                # The content and the newline after it.
+                remaining = size + 1
+                while remaining:
+                    remaining -= len(proc.stdout.read(min(remaining, kSkipChunkSize)))
+                objects[name] = None
+            else:
+                objects[name] = proc.stdout.read(size)
+                proc.stdout.read(1)
+    finally:
+        if len(objects) < len(names):
+            proc.kill()
+        writer.join()
+        proc.stdout.close()
+        proc.wait()
+    return objects
+
+
+def base_files(diff, hashes, renames):
+    """
+    :return: dict of each file in the diff to its BaseFile.
+    """
+    # Each file's status and the object its base version is read from, if any.
+    statuses = {}
+    for line in diff.splitlines(True):
+        if not line.startswith('Index:'):
+            continue
+        filename = line.split(':', 1)[1].strip()
+        hash_before, hash_after = hashes.get(filename, (None, None))
+        if filename in renames:
+            # A rename that doesn't change the content has no hashes.
+            statuses[filename] = ('A +', hash_before or (None if filename in hashes else f'HEAD:{filename}'))
+        elif not hash_before:
+            statuses[filename] = ('A', None)
+        else:
+            statuses[filename] = ('D' if not hash_after else 'M', hash_before)
+
+    objects = read_objects([name for _, name in statuses.values() if name], kMaxUploadSize)
+    files = {}
+    for filename, (status, name) in statuses.items():
+        content = objects[name] if name else (b'' if status == 'A' else None)
+        too_large = bool(name) and content is None
+        if too_large:
+            # Only the name tells whether it's binary, it isn't uploaded anyway.
+            files[filename] = BaseFile(b'', _is_image(filename), status, True)
+        else:
+            files[filename] = BaseFile(content, _is_image(filename) or b'\0' in (content or b''), status, False)
+    return files
+
+
+def split_patch(diff):
+    """
+    :return: list of (filename, diff of the file).
+    """
+    patches = []
+    filename = None
+    lines = []
+    for line in diff.splitlines(True):
+        if line.startswith('Index:'):
+            if filename and lines:
+                patches.append((filename, ''.join(lines)))
+            filename = line.split(':', 1)[1].strip()
+            lines = []
+        lines.append(line)
+    if filename and lines:
+        patches.append((filename, ''.join(lines)))
+    return patches
+
+
+def encode_multipart(fields, files=()):
+    """
+    :param fields: list of (name, value) of the form fields.
+    :param files: list of (name, filename, content) of the files.
+    :return: the content type and the body of a multipart/form-data request.
+    """
+    parts = []
+    for key, value in fields:
+        parts.append(f'--{kMultipartBoundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'.encode())
+        parts.append(_encode(value) if isinstance(value, str) else value)
+        parts.append(b'\r\n')
+    for key, filename, value in files:
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        parts.append(f'--{kMultipartBoundary}\r\nContent-Disposition: form-data; name="{key}"; '
+                     f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'.encode())
+        parts.append(_encode(value) if isinstance(value, str) else value)
+        parts.append(b'\r\n')
+    parts.append(f'--{kMultipartBoundary}--\r\n'.encode())
+    return f'multipart/form-data; boundary={kMultipartBoundary}', b''.join(parts)
+
+
+class _OAuthRedirectHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Receives the access token the server redirects the browser to localhost with.
+    """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        self.end_headers()
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        self.server.access_token = (params.get('access_token') or [None])[0]
+        self.server.error = (params.get('error') or [None])[0]
+        self.wfile.write(kOAuthDonePage)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _fetch_access_token(server, port, open_browser):
+    """
+    Have the user sign in to the review server in the browser, or paste an access token if there's no browser.
+    """
+    if open_browser:
+        page = f'{server}{kOAuthPath}?port={port}'
+        if webbrowser.open(page, new=1, autoraise=True):
+            print(f'Your browser has been opened to visit:\n\n    {page}\n\nIf your browser is on a different '
+                  f'machine, exit and re-run with --no-browser')
+            try:
+                httpd = http.server.HTTPServer(('127.0.0.1', port), _OAuthRedirectHandler)
+            except OSError as e:
+                print(f'[WARNING] Cannot start a local web server on port {port}: {e.strerror}')
+            else:
+                httpd.access_token = httpd.error = None
+                # The redirect from the server is the only request.
+                httpd.handle_request()
+                httpd.server_close()
+                if not httpd.access_token:
+                    raise UploadError(httpd.error or 'OAuth 2.0 error occurred')
+                return httpd.access_token
+
+    print(f'Go to the following link in your browser:\n\n    {server}{kOAuthPath}\n\nand copy the access token.')
+    return input('Enter access token: ').strip()
+
+
+class RpcServer(object):
+    """
+    Sends requests to the review server, signing in with OAuth 2.0 when it asks for it.
+    """
+
+    def __init__(self, server=kServer, open_browser=True, oauth_port=kOAuthPort):
+        self.server = server
+        self.open_browser = open_browser
+        self.oauth_port = oauth_port
+        self.access_token = store.get_meta(kAccessTokenMetaKey)
+        self._auth_lock = threading.Lock()
+
+    def _authenticate(self, rejected_token):
+        with self._auth_lock:
+            # Another upload thread may have signed in again already.
+            if self.access_token == rejected_token:
+                self.access_token = _fetch_access_token(self.server, self.oauth_port, self.open_browser)
+
+    def send(self, path, body=b'', content_type='application/octet-stream'):
+        """
+        :return: the body of the response.
+        """
+        if not self.access_token:
+            self._authenticate(None)
+
+        for tries in range(1, kMaxTries + 1):
+            token = self.access_token
+            res = http_session().post(f'{self.server}{path}', data=body, allow_redirects=False, timeout=kTimeoutSecs,
+                                      headers={'Accept': 'text/plain', 'Content-Type': content_type,
+                                               'Authorization': f'OAuth {token}'})
+            if res.status_code == 200:
+                return res.text
+            if tries == kMaxTries:
+                break
+            if res.status_code in (401, 302):
+                self._authenticate(token)
+            elif res.status_code == 301:
+                location = urllib.parse.urlparse(res.headers['location'])
+                self.server = f'{location.scheme}://{location.netloc}'
+            elif res.status_code < 500:
+                # Server errors are retried, the server is flaky.
+                break
+        raise UploadError(f'{path} got a {res.status_code} response from {self.server}: {res.text.strip()}')
+
+
+def _repo_guid():
+    """
+    :return: the first root commit of HEAD, which identifies the repository to the server.
+    """
+    common_dir = os.path.abspath(_git('rev-parse', '--git-common-dir').strip())
+    meta_key = f'repo_guid:{common_dir}'
+    guid = store.get_meta(meta_key)
+    if not guid:
+        # Root commits never change, unlike the rest of the history that would have to be walked to find them.
+        guid = _git('rev-list', '--max-parents=0', 'HEAD').split('\n')[0]
+        store.set_meta(meta_key, guid)
+    return guid
+
+
+def _cc():
+    """
+    :return: the codereview-<repository> list and the CC in codereview.rc at the top of the repository, if any.
+    """
+    remotes = _git('remote', '-v').splitlines()
+    for remote in ('upstream', 'origin'):
+        name = next((match.group(1) for match in (re.search(rf'^{remote}.*/([^/]+?)(\.git)? \(push\)$', line)
+                                                  for line in remotes) if match), None)
+        if name:
+            break
+    else:
+        return None
+
+    cc = [f'codereview-{name}@10gen.com']
+    rc_path = os.path.join(_git('rev-parse', '--show-toplevel').strip(), 'codereview.rc')
+    if os.path.isfile(rc_path):
+        with open(rc_path) as rc_file:
+            for line in rc_file:
+                key, _, value = line.partition('=')
+                if key == 'CC' and value.strip():
+                    cc.append(value.strip())
+    return ','.join(cc)
+
+
+def _lint_patch(diff, script):
+    """
+    Check the files in the diff with one of the lint scripts of the repository.
+    """
+    top = _git('rev-parse', '--show-toplevel').strip()
+    script_path = os.path.join(top, 'buildscripts', script)
+    if not os.path.isfile(script_path):
+        raise UploadError(f'Cannot find {script_path}')
+
+    with tempfile.NamedTemporaryFile(suffix='.diff') as patch_file:
+        patch_file.write(_encode(diff))
+        patch_file.flush()
+        if subprocess.run(['python2', script_path, 'lint-patch', patch_file.name]).returncode != 0:
+            raise UploadError(f'The patch did not pass {script}')
+
+
+def _upload_patches(server, issue, patchset, diff):
+    """
+    Upload the diff of each file on its own, for diffs too large to upload at once.
+
+    :return: list of (patch id, filename).
+    """
+    def upload_patch(filename, patch):
+        content_type, body = encode_multipart([('filename', filename), ('content_upload', '1')],
+                                              [('data', 'data.diff', patch)])
+        lines = server.send(f'/{issue}/upload_patch/{patchset}', body, content_type).splitlines()
+        if not lines or lines[0] != 'OK':
+            raise UploadError(f'Failed to upload the patch for {filename}: {" ".join(lines)}')
+        return lines[1], filename
+
+    patches = []
+    for filename, patch in split_patch(diff):
+        if len(_encode(patch)) > kMaxUploadSize:
+            print(f'[WARNING] Not uploading the patch for {filename} because it is too large')
+        else:
+            patches.append((filename, patch))
+    with ThreadPoolExecutor(kUploadThreads) as executor:
+        return list(executor.map(lambda patch: upload_patch(*patch), patches))
+
+
+def _upload_base_files(server, issue, patchset, patches, files):
+    """
+    Upload the base version of each file in the patchset.
+
+    :param patches: list of (patch id, filename) the server assigned to the files.
+    """
+    def upload_base_file(file_id, filename, base_file):
+        content = base_file.content
+        if base_file.too_large:
+            print(f'[WARNING] Not uploading the base file for {filename} because it is too large')
+        fields = [('filename', filename), ('status', base_file.status), ('checksum', hashlib.md5(content).hexdigest()),
+                  ('is_binary', str(base_file.is_binary)), ('is_current', 'False')]
+        if base_file.too_large:
+            fields.append(('file_too_large', '1'))
+        content_type, body = encode_multipart(fields, [('data', filename, content)])
+        response = server.send(f'/{issue}/upload_content/{patchset}/{file_id}', body, content_type)
+        if not response.startswith('OK'):
+            raise UploadError(f'Failed to upload the base file for {filename}: {response}')
+
+    uploads = []
+    for patch_id, filename in patches:
+        # Files without a base version, e.g. added ones, have an id like nobase_<id>.
+        if 'nobase' in patch_id or files[filename].content is None:
+            continue
+        uploads.append((int(patch_id), filename, files[filename]))
+    with ThreadPoolExecutor(kUploadThreads) as executor:
+        # list() re-raises the first failure.
+        list(executor.map(lambda upload: upload_base_file(*upload), uploads))
+
+
+def upload(rev='HEAD~1', issue=None, title=None, similarity=50, check_clang_format=False, check_eslint=False,
+           open_browser=True, server=kServer):
+    """
+    Upload the changes since a revision as a new code review, or as a new patchset of an existing one.
+
+    :param rev: the revision to diff against, or 'rev1:rev2' for the changes between two revisions.
+        (Default: HEAD~1)
+    :param issue: the code review to add a patchset to. (Default: create a new code review)
+    :param title: the subject of a new code review, or the title of the new patchset.
+    :param similarity: the minimum similarity percentage for detecting renames and copies. (Default: 50)
+    :param check_clang_format: check the changed files with buildscripts/clang_format.py first. (Default: False)
+    :param check_eslint: check the changed files with buildscripts/eslint.py first. (Default: False)
+    :param open_browser: open a browser to sign in; otherwise the user pastes an access token. (Default: True)
+    :param server: URL of the review server.
+    :return: Result with the code review and patchset the changes were uploaded to.
+    :raises UploadError: if anything went wrong, with a message for the user.
+    """
+    diff, hashes, renames = post_process_diff(generate_diff(rev, similarity))
+    if check_clang_format:
+        _lint_patch(diff, 'clang_format.py')
+    if check_eslint:
+        _lint_patch(diff, 'eslint.py')
+    files = base_files(diff, hashes, renames)
+
+    title = title or ''
+    if not title and not issue:
+        raise UploadError('A non-empty title is required for a new code review')
+    # The server doesn't take an empty patchset title.
+    title = title or ' '
+    if len(title) > kMaxTitleLength:
+        title = title[:kMaxTitleLength - 1] + '…'
+
+    fields = [('repo_guid', _repo_guid())]
+    if issue:
+        fields.append(('issue', str(issue)))
+    cc = _cc()
+    if cc:
+        fields.append(('cc', cc))
+    fields.append(('subject', title))
+    # Lets the server reuse base files it already has from earlier patchsets. Files too large to upload were never
+    # read, so there's nothing to reuse.
+    fields.append(('base_hashes', '|'.join(f'{hashlib.md5(base_file.content).hexdigest()}:{filename}'
+                                           for filename, base_file in files.items()
+                                           if base_file.content is not None and not base_file.too_large)))
+    fields.append(('content_upload', '1'))
+    separate_patches = len(_encode(diff)) > kMaxUploadSize
+    if separate_patches:
+        fields.append(('separate_patches', '1'))
+
+    rpc_server = RpcServer(server, open_browser)
+    content_type, body = encode_multipart(fields, [] if separate_patches else [('data', 'data.diff', diff)])
+    response = rpc_server.send('/upload', body, content_type)
+
+    # The message, the patchset, then "<patch id> <filename>" for each file.
+    lines = response.splitlines()
+    msg = lines[0] if lines else response
+    if not msg.startswith(('Issue created.', 'Issue updated.')):
+        raise UploadError(f'The review server did not take the upload: {response.strip()}')
+    issue = msg[msg.rfind('/') + 1:]
+    patchset = lines[1].strip() if len(lines) >= 2 else ''
+    patches = [tuple(line.split(' ', 1)) for line in lines[2:]]
+
+    if separate_patches:
+        patches = _upload_patches(rpc_server, issue, patchset, diff)
+    _upload_base_files(rpc_server, issue, patchset, patches, files)
+    rpc_server.send(f'/{issue}/upload_complete/{patchset}')
+
+    # Only the main thread may use the store.
+    if rpc_server.access_token != store.get_meta(kAccessTokenMetaKey):
+        store.set_meta(kAccessTokenMetaKey, rpc_server.access_token)
+
+    url = msg.split('URL: ', 1)[1].strip() if 'URL: ' in msg else f'{server}/{issue}'
+    return Result(issue, patchset, url, msg.startswith('Issue created.'))
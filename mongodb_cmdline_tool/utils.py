@@ -1,10 +1,13 @@
+import functools
 import os
 import pathlib
 import sys
 
-import yaml
+state_dir = pathlib.Path.home() / '.config' / 'mongodb-cmdline-tool'
+config_path = state_dir / 'config'
 
-config_path = pathlib.Path.home() / '.config' / 'mongodb-cmdline-tool' / 'config'
+# Outcome of the last background self-update, printed and removed by the next command.
+self_update_result_path = state_dir / 'self-update-result'
 
 
 def print_bold(msg):
@@ -22,22 +25,59 @@ def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
 
-def get_jira_pwd():
+def get_config(key, default=None):
     if not os.path.isfile(config_path):
-        return None
+        return default
+
+    import yaml
 
     with open(config_path) as config_file:
-        config = yaml.load(config_file)
-        return config['jira_pwd']
+        config = yaml.safe_load(config_file) or {}
+        return config.get(key, default)
+
+
+@functools.lru_cache()
+def http_session():
+    """
+    :return: the requests session that HTTP requests of the tool share, so connections to a server are reused.
+    """
+    # requests is slow to import, only do it for commands that talk HTTP.
+    import requests
+
+    return requests.Session()
+
+
+def get_jira_pwd():
+    return get_config('jira_pwd')
+
+
+def report_self_update():
+    """
+    Print the outcome of the last background self-update, if there is one that wasn't reported yet.
+    """
+    try:
+        with open(self_update_result_path) as result_file:
+            message = result_file.read()
+        os.remove(self_update_result_path)
+    except FileNotFoundError:
+        return
+    print_bold(message)
 
 
 def save_jira_pwd(c, pwd):
+    import yaml
+
     print(f'[INFO] Because of an issue with keyring, the Jira password is stored in a config file at the moment'
           f' at {config_path}. (For detail on keyring issue, see https://github.com/jaraco/keyring/issues/219)')
 
     with c.cd(str(pathlib.Path.home())):
         c.run('mkdir -p .config')
 
+    config = {}
+    if os.path.isfile(config_path):
+        with open(config_path) as config_file:
+            config = yaml.safe_load(config_file) or {}
+    config['jira_pwd'] = pwd
+
     with open(config_path, 'w') as config_file:
-        config = {'jira_pwd': pwd}
         config_file.write(yaml.dump(config))
@@ -0,0 +1,210 @@
+"""
+Rebuild what's affected by a change as soon as a file under src/ is saved.
+
+Changes are picked up with inotify where it's available and by polling modification times elsewhere. Bursts
+of saves, e.g. from a search-and-replace, are collected into a single rebuild. A changed file is mapped to the
+objects that were compiled from it with ninja's dependency log, so only those are rebuilt; files ninja doesn't
+have dependencies for yet are looked up in the manifest.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import subprocess
+import sys
+import time
+
+from mongodb_cmdline_tool import build
+from mongodb_cmdline_tool.utils import print_bold
+
+kWatchDir = 'src'
+
+# A rebuild starts once no file changed for kDebounceSecs, or kMaxDebounceSecs after the first change.
+kDebounceSecs = 0.5
+kMaxDebounceSecs = 5
+
+kPollSecs = 2
+
+# Files editors write next to the file that's being edited.
+kIgnoredSuffixes = ('~', '.swp', '.swx', '.tmp')
+kIgnoredPrefixes = ('.#', '#')
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+IN_Q_OVERFLOW = 0x4000
+kInotifyMask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+kInotifyEvent = struct.Struct('iIII')
+
+
+def _ignored(name):
+    return name.startswith(kIgnoredPrefixes) or name.endswith(kIgnoredSuffixes)
+
+
+class _InotifyWatcher(object):
+
+    def __init__(self, root):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        for directory, _, _ in os.walk(root):
+            self._add(directory)
+
+    def _add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), kInotifyMask)
+        if wd < 0:
+            # Usually ENOSPC: there are more directories than fs.inotify.max_user_watches allows.
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+        self.dirs[wd] = directory
+
+    def wait(self, timeout):
+        """
+        :return: the paths that changed, waiting up to timeout seconds (forever if None) for the first change.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = kInotifyEvent.unpack_from(data, pos)
+            pos += kInotifyEvent.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                print('[WARNING] Missed some changes, save the file again to rebuild it')
+                continue
+            if wd not in self.dirs or _ignored(name):
+                continue
+            path = os.path.join(self.dirs[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for directory, _, _ in os.walk(path):
+                        self._add(directory)
+                continue
+            changed.add(path)
+        return changed
+
+
+class _PollingWatcher(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.mtimes = self._scan()
+
+    def _scan(self):
+        mtimes = {}
+        stack = [self.root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif not _ignored(entry.name):
+                        try:
+                            mtimes[entry.path] = entry.stat(follow_symlinks=False).st_mtime_ns
+                        except FileNotFoundError:
+                            pass
+        return mtimes
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(kPollSecs if deadline is None else max(0, min(kPollSecs, deadline - time.monotonic())))
+            mtimes = self._scan()
+            changed = {path for path in mtimes.keys() | self.mtimes.keys()
+                       if mtimes.get(path) != self.mtimes.get(path)}
+            self.mtimes = mtimes
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+def make_watcher(root):
+    if sys.platform.startswith('linux'):
+        try:
+            return _InotifyWatcher(root)
+        except OSError as e:
+            print(f'[INFO] Cannot use inotify ({e}), checking for changes every {kPollSecs}s instead')
+    return _PollingWatcher(root)
+
+
+def wait_for_changes(watcher):
+    """
+    Wait for a change, then for the burst of changes it's part of to end.
+    """
+    changed = set()
+    while not changed:
+        changed = watcher.wait(None)  # Empty if all the events were for ignored files.
+    deadline = time.monotonic() + kMaxDebounceSecs
+    while time.monotonic() < deadline:
+        more = watcher.wait(kDebounceSecs)
+        if not more:
+            break
+        changed |= more
+    return changed
+
+
+def affected_targets(paths):
+    """
+    :param paths: changed files, relative to the directory of build.ninja.
+    :return: the outputs that have any of the files as input, according to ninja's dependency log, and for files
+        that aren't in the log, according to the manifest.
+    """
+    wanted = {os.path.normpath(path) for path in paths}
+    wanted |= {os.path.abspath(path) for path in wanted}
+
+    # Streamed, the dependency log of a full build is too large to keep around.
+    targets = set()
+    found = set()
+    proc = subprocess.Popen(['ninja', '-f', build.kDerivedManifest, '-t', 'deps'], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, universal_newlines=True, errors='replace')
+    target = None
+    for line in proc.stdout:
+        if not line.startswith(' '):
+            target = line.partition(': #deps')[0] if ': #deps' in line else None
+        elif target:
+            dep = os.path.normpath(line.strip())
+            if dep in wanted:
+                targets.add(target)
+                found.add(dep)
+    proc.wait()
+
+    missing = [path for path in paths if os.path.normpath(path) not in found and os.path.exists(path)]
+    if missing:
+        res = subprocess.run(['ninja', '-f', build.kDerivedManifest, '-t', 'query', *missing],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        in_outputs = False
+        for line in res.stdout.splitlines():
+            if not line.startswith('    '):
+                in_outputs = line.strip() == 'outputs:'  # A file, or one of its sections.
+            elif in_outputs:
+                targets.add(line.strip())
+    return sorted(targets)
+
+
+def watch(c, jobs=None):
+    if not os.path.isdir(kWatchDir) or not os.path.isfile(build.kManifest):
+        print(f'[ERROR] Run "m watch" in the directory with {build.kManifest} and {kWatchDir}/')
+        sys.exit(1)
+    build.prepare_manifest()
+
+    watcher = make_watcher(kWatchDir)
+    print_bold(f'Watching {kWatchDir}/ for changes, press Ctrl-C to stop')
+    while True:
+        changed = wait_for_changes(watcher)
+        targets = affected_targets(changed)
+        names = ', '.join(sorted(os.path.basename(path) for path in changed)[:5])
+        if not targets:
+            print_bold(f'Changed {names}, nothing to rebuild')
+            continue
+        print_bold(f'Changed {names}, rebuilding {len(targets)} target(s)')
+        build.run_ninja(c, targets, jobs=jobs, background=True)
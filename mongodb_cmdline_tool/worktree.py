@@ -0,0 +1,142 @@
+"""
+One git worktree per base branch, so working on a backport doesn't throw away the build of master.
+
+Tickets based on master are worked on in ~/mongo. Tickets based on another branch, e.g. v4.0, are worked on in a
+worktree of ~/mongo for that branch, ~/mongo-worktrees/v4.0 by default (set worktrees_dir in the config file to put
+them elsewhere), with its own build directory and build.ninja. Switching between tickets with the same base stays in
+the same worktree and only touches the files that differ between the tickets. `m new --worktree` gives a ticket a
+worktree of its own.
+
+New worktrees start out with a detached HEAD rather than the base branch, since a branch can only be checked out in
+one worktree at a time.
+
+`m new` remembers the ticket it switched to. Commands that work on the current ticket run on the ticket branch
+checked out in the current directory, or, when started from anywhere else, in the worktree of that ticket.
+"""
+import os
+import pathlib
+import re
+
+from invoke.exceptions import UnexpectedExit
+
+from mongodb_cmdline_tool import build, git_metadata, store
+from mongodb_cmdline_tool.utils import get_config, print_bold
+
+kMainRepo = pathlib.Path.home() / 'mongo'
+kDefaultWorktreesDir = pathlib.Path.home() / 'mongo-worktrees'
+
+# Tickets based on this branch are worked on in kMainRepo.
+kMainBase = 'master'
+
+# The branch `m new` creates for a ticket, e.g. server12345.
+kTicketBranchRe = re.compile(r'^[a-z]+([0-9]+)$')
+
+
+def worktrees_dir():
+    return pathlib.Path(get_config('worktrees_dir', str(kDefaultWorktreesDir))).expanduser()
+
+
+def path_for(base, ticket_branch=None):
+    """
+    :param ticket_branch: the branch of a ticket that gets a worktree of its own.
+    :return: the directory of the worktree for a base branch or a ticket.
+    """
+    if ticket_branch:
+        return worktrees_dir() / ticket_branch
+    if base == kMainBase:
+        return kMainRepo
+    return worktrees_dir() / base.replace('/', '-')
+
+
+def ensure(c, path, base):
+    """
+    Create a worktree with a detached HEAD at the base branch and generate its build.ninja, unless it exists.
+    """
+    if (path / '.git').exists() or path == kMainRepo:
+        return
+
+    print_bold(f'Creating a worktree for {base} in {path}')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with c.cd(str(kMainRepo)):
+        c.run(f'git worktree add --detach {path} {base}', hide='both')
+
+    # The scons module isn't part of the repository; all the worktrees use the one in the main checkout.
+    module_dir = kMainRepo / build.kNinjaModuleDir
+    if not module_dir.is_dir():
+        print(f'[INFO] No ninja module in {kMainRepo}, run "m setup-dev-env.macos-extra" and then '
+              f'"m new" again to generate build.ninja in {path}')
+        return
+    (path / build.kNinjaModuleDir).parent.mkdir(parents=True, exist_ok=True)
+    (path / build.kNinjaModuleDir).symlink_to(module_dir)
+
+    print_bold(f'Generating build.ninja in {path}')
+    with c.cd(str(path)):
+        build.generate_manifest(c)
+
+
+def remove(c, path):
+    """
+    Remove the worktree of a ticket that has been finalized, along with its build directory.
+    """
+    if pathlib.Path(path).resolve() in (pathlib.Path.cwd().resolve(), *pathlib.Path.cwd().resolve().parents):
+        os.chdir(kMainRepo)
+    with c.cd(str(kMainRepo)):
+        res = c.run(f'git worktree remove {path}', warn=True, hide='both')
+    if res.ok:
+        print_bold(f'Removed the worktree in {path}')
+    else:
+        print(f'[WARNING] Did not remove the worktree in {path}: {res.stderr.strip()}. To remove it anyway, run: '
+              f'git worktree remove --force {path}')
+
+
+def enter(path):
+    """
+    Run the rest of the command in a worktree. Both invoke and git_metadata use the current directory.
+
+    :return: whether the current directory changed.
+    """
+    if not path or not os.path.isdir(path):
+        return False
+
+    path = pathlib.Path(path).resolve()
+    cwd = pathlib.Path.cwd().resolve()
+    if cwd == path or path in cwd.parents:
+        return False
+    print(f'[INFO] Running in {path}')
+    os.chdir(path)
+    return True
+
+
+def _ticket_in_cwd(c):
+    """
+    :return: the ticket number of the ticket branch checked out in the current directory, or None if there's none.
+    """
+    try:
+        branch = git_metadata.current_branch(c)
+    except UnexpectedExit:
+        return None  # Not in a git repository.
+    match = kTicketBranchRe.match(branch)
+    return match.group(1) if match else None
+
+
+def enter_current_ticket(c, default=None):
+    """
+    Run the rest of the command for the current ticket: the ticket branch checked out in the current directory, or if
+    there's none, the ticket `m new` last switched to, in its worktree.
+
+    :param default: the directory to run in if the ticket `m new` last switched to has no worktree. (Default: stay
+        in the current directory)
+    :return: (the cached data of the ticket, or an empty dict if there's none; whether the ticket is the one `m new`
+        last switched to rather than the one in the current directory).
+    """
+    ticket = _ticket_in_cwd(c)
+    if ticket:
+        return store.get_ticket(ticket), False
+
+    ticket = store.get_meta('current_ticket')
+    data = store.get_ticket(ticket) if ticket else {}
+    enter(data.get('worktree') or default)
+    if ticket:
+        print(f'[INFO] No ticket branch is checked out here, using {data.get("project", "server")}{ticket}, the ticket '
+              f'"m new" last switched to')
+    return data, True
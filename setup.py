@@ -23,7 +23,8 @@ setuptools.setup(
         'jira >= 1.0',
         'keyring >= 12',
         'invoke >= 1.0',
-        'pyyaml >= 3.0'
+        'pyyaml >= 3.0',
+        'requests >= 2.0'
     ],
     entry_points={
         'console_scripts': ['m = mongodb_cmdline_tool.__main__:main'],
@@ -50,6 +50,7 @@ import socket
 import subprocess
 import sys
 import tempfile
+import threading
 import urllib
 import urllib2
 import urlparse
@@ -97,6 +98,10 @@ DEFAULT_REVIEW_SERVER = "mongodbcr.appspot.com"
 # Max size of patch or base file.
 MAX_UPLOAD_SIZE = 900 * 1024
 
+# Max number of renamed files whose deletes are diffed again by path. With
+# more, all the deletes are diffed again.
+MAX_RENAMED_PATHSPECS = 1000
+
 
 # Constants for version control names.  Used by GuessVCSName.
 VCS_GIT = "Git"
@@ -1317,6 +1322,9 @@ class VersionControlSystem(object):
       options: Command line options.
     """
     self.options = options
+    # Files whose base version is larger than MAX_UPLOAD_SIZE and was skipped
+    # without being read.
+    self.oversized_files = set()
 
   def GetGUID(self):
     """Return string to distinguish the repository from others, for example to
@@ -1402,7 +1410,8 @@ class VersionControlSystem(object):
         type = "base"
       else:
         type = "current"
-      if len(content) > MAX_UPLOAD_SIZE:
+      if len(content) > MAX_UPLOAD_SIZE or (is_base and
+                                            filename in self.oversized_files):
         result = ("Not uploading the %s file for %s because it's too large." %
             (type, filename))
         file_too_large = True
@@ -1838,7 +1847,50 @@ class GitVCS(VersionControlSystem):
     AddSubversionPropertyChange(filename)
     return "".join(svndiff)
 
+  def _DiffFiles(self, cmd, env):
+    """Runs a "git diff" command with --raw -z -p and splits its output by file.
+
+    Returns:
+      A list of (status, path, patch) in the order git diff prints them, where
+      status is the letter of the change and path is the path before it, or
+      None if the output can't be split, e.g. with unmerged files.
+    """
+    # Before the other arguments, which may end with "-- <path>...".
+    output = RunShell(cmd[:2] + ["--raw", "-z", "-p"] + cmd[2:], env=env,
+                      silent_ok=True)
+    # The raw part comes first, ":<modes> <hashes> <status>\0<path>\0" with a
+    # second path for renames and copies, then an empty field and the patch.
+    fields = output.split("\0")
+    entries = []
+    i = 0
+    while i < len(fields) and fields[i].startswith(":"):
+      status = fields[i].split()[-1][0]
+      entries.append((status, fields[i + 1]))
+      i += 3 if status in "RC" else 2
+    if not entries:
+      return []
+    patch = "\0".join(fields[i + 1:])
+    if not patch.startswith("diff --git "):
+      return None
+    chunks = re.split(r"\n(?=diff --git )", patch)
+    chunks = [chunk + "\n" for chunk in chunks[:-1]] + chunks[-1:]
+
+    files = []
+    for status, path in entries:
+      # A type change is printed as a delete and an add.
+      count = 2 if status == "T" else 1
+      if status not in "ADMRCT" or len(chunks) < count:
+        return None
+      files.append((status, path, "".join(chunks[:count])))
+      chunks = chunks[count:]
+    if chunks:
+      return None
+    return files
+
   def GenerateDiff(self, extra_args):
+    # Paths and diff options from the command line may overlap the paths of
+    # renamed files, so those diffs are run in full.
+    single_pass = not extra_args
     extra_args = extra_args[:]
     if self.options.revision:
       if ":" in self.options.revision:
@@ -1855,14 +1907,15 @@ class GitVCS(VersionControlSystem):
     # -M/-C will not print the diff for the deleted file when a file is renamed.
     # This is confusing because the original file will not be shown on the
     # review when a file is renamed. So, get a diff with ONLY deletes, then
-    # append a diff (with rename detection), without deletes.
+    # append a diff (with rename detection), without deletes. Both come from a
+    # single diff with rename detection, except for renamed files, whose
+    # deletes are diffed again on their own, against the empty tree if there's
+    # a revision so that the working tree isn't scanned again.
     cmd = [
         "git", "diff", "--no-color", "--no-ext-diff", "--full-index",
         "--ignore-submodules", "--src-prefix=a/", "--dst-prefix=b/",
     ]
-    diff = RunShell(
-        cmd + ["--no-renames", "--diff-filter=D"] + extra_args,
-        env=env, silent_ok=True)
+    deletes_cmd = cmd + ["--no-renames", "--diff-filter=D"]
     assert 0 <= self.options.git_similarity <= 100
     if self.options.git_find_copies:
       similarity_options = ["-l100000", "-C%d%%" % self.options.git_similarity]
@@ -1870,9 +1923,36 @@ class GitVCS(VersionControlSystem):
         similarity_options.append("--find-copies-harder")
     else:
       similarity_options = ["-M%d%%" % self.options.git_similarity ]
-    diff += RunShell(
-        cmd + ["--diff-filter=AMCRT"] + similarity_options + extra_args,
-        env=env, silent_ok=True)
+    files = None
+    if single_pass:
+      files = self._DiffFiles(cmd + similarity_options + extra_args, env)
+    if files is None:
+      diff = RunShell(deletes_cmd + extra_args, env=env, silent_ok=True)
+      diff += RunShell(
+          cmd + ["--diff-filter=AMCRT"] + similarity_options + extra_args,
+          env=env, silent_ok=True)
+    else:
+      deletes = [(path, patch) for status, path, patch in files
+                 if status == "D"]
+      renamed = [path for status, path, _ in files if status == "R"]
+      if len(renamed) > MAX_RENAMED_PATHSPECS:
+        deletes = [(None, RunShell(deletes_cmd + extra_args, env=env,
+                                   silent_ok=True))]
+      elif renamed:
+        revs = extra_args[:1]
+        if revs:
+          revs.append(RunShell(["git", "hash-object", "-t", "tree", os.devnull],
+                               env=env).strip())
+        renamed_deletes = self._DiffFiles(
+            deletes_cmd + revs + ["--"] +
+            [":(literal)" + path for path in renamed], env)
+        if renamed_deletes is None:
+          ErrorExit("Can't diff the deletes of renamed files")
+        # Both are in path order, which is the order git diff prints too.
+        deletes = sorted(deletes + [(path, patch)
+                                    for _, path, patch in renamed_deletes])
+      diff = "".join(patch for _, patch in deletes)
+      diff += "".join(patch for status, _, patch in files if status != "D")
 
     # The CL could be only file deletion or not. So accept silent diff for both
     # commands then check for an empty diff manually.
@@ -1881,17 +1961,106 @@ class GitVCS(VersionControlSystem):
     return diff
 
   def GetUnknownFiles(self):
-    status = RunShell(["git", "ls-files", "--exclude-standard", "--others"],
-                      silent_ok=True)
-    return status.splitlines()
+    # "git status" checks the tracked files too, so it's only faster than
+    # "git ls-files --others" when fsmonitor tells it which ones changed.
+    fsmonitor, _ = RunShellWithReturnCode(
+        ["git", "config", "--get", "core.fsmonitor"])
+    if fsmonitor.strip() in ("", "false"):
+      status = RunShell(["git", "ls-files", "--exclude-standard", "--others"],
+                        silent_ok=True)
+      return status.splitlines()
+    status = RunShell(["git", "status", "--porcelain=v2", "-z",
+                       "--untracked-files=all"], silent_ok=True)
+    return [entry[2:] for entry in status.split("\0")
+            if entry.startswith("? ")]
+
+  def ReadObjects(self, names):
+    """Reads objects from a single "git cat-file --batch".
+
+    All the names are written to git at once by a thread while the contents
+    are read back. Objects larger than MAX_UPLOAD_SIZE are skipped over
+    without being kept in memory.
+
+    Args:
+      names: Object names, e.g. blob hashes or HEAD:<path>.
+
+    Returns:
+      A dict of each name to the content of the object, or None if it is too
+      large to upload.
+    """
+    names = sorted(set(names))
+    if not names:
+      return {}
+    LOGGER.info("Reading %d objects with git cat-file --batch", len(names))
+    # Buffered, Python 2 pipes are unbuffered by default.
+    p = subprocess.Popen(["git", "cat-file", "--batch"], bufsize=-1,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         shell=use_shell)
+
+    def WriteNames():
+      try:
+        p.stdin.write("".join(name + "\n" for name in names))
+        p.stdin.close()
+      except IOError:
+        pass  # git exited, which reading its output reports.
+
+    # Feed the names from a thread so git never blocks on a full output pipe.
+    writer = threading.Thread(target=WriteNames)
+    writer.start()
+    objects = {}
+    try:
+      for name in names:
+        # "<sha> <type> <size>", or "<name> missing".
+        header = p.stdout.readline()
+        if (not header or header.endswith(" missing\n") or
+            header.endswith(" ambiguous\n")):
+          ErrorExit("Got error status from 'git cat-file' for %s: %s" %
+                    (name, header.strip()))
+        size = int(header.split()[2])
+        if size > MAX_UPLOAD_SIZE:
+          # Skip the content and the newline after it.
+          remaining = size + 1
+          while remaining:
+            remaining -= len(p.stdout.read(min(remaining, 64 * 1024)))
+          objects[name] = None
+        else:
+          objects[name] = p.stdout.read(size)
+          p.stdout.read(1)
+    finally:
+      if len(objects) < len(names):
+        p.kill()
+      writer.join()
+      p.stdout.close()
+      p.wait()
+    return objects
+
+  def GetBaseFiles(self, diff):
+    """Reads all the base files with one git process, then builds the tuples
+    of GetBaseFile from them."""
+    names = []
+    for line in diff.splitlines(True):
+      if line.startswith("Index:"):
+        filename = line.split(":", 1)[1].strip()
+        name = self._BaseObjectName(filename)
+        if name:
+          names.append(name)
+    self.base_objects = self.ReadObjects(names)
+    return super(GitVCS, self).GetBaseFiles(diff)
+
+  def _BaseObjectName(self, filename):
+    """Returns the name of the object the base version of a file is in."""
+    hash_before, hash_after = self.hashes.get(filename, (None,None))
+    if filename in self.renames and filename not in self.hashes:
+      # If a rename doesn't change the content, we never get a hash.
+      return "HEAD:" + filename
+    return hash_before
 
   def GetFileContent(self, file_hash):
-    """Returns the content of a file identified by its git hash."""
-    data, retcode = RunShellWithReturnCode(["git", "show", file_hash],
-                                            universal_newlines=False)
-    if retcode:
-      ErrorExit("Got error status from 'git show %s'" % file_hash)
-    return data
+    """Returns the content of a file identified by its git hash, or None if it
+    is too large to upload."""
+    if file_hash in getattr(self, "base_objects", {}):
+      return self.base_objects[file_hash]
+    return self.ReadObjects([file_hash])[file_hash]
 
   def GetBaseFile(self, filename):
     hash_before, hash_after = self.hashes.get(filename, (None,None))
@@ -1903,8 +2072,10 @@ class GitVCS(VersionControlSystem):
       status = "A +"  # Match svn attribute name for renames.
       if filename not in self.hashes:
         # If a rename doesn't change the content, we never get a hash.
-        base_content = RunShell(
-            ["git", "show", "HEAD:" + filename], silent_ok=True)
+        base_content = self.GetFileContent("HEAD:" + filename)
+        if base_content is None:
+          self.oversized_files.add(filename)
+          base_content = ""
     elif not hash_before:
       status = "A"
       base_content = ""
@@ -1917,6 +2088,10 @@ class GitVCS(VersionControlSystem):
     # Grab the base content if we don't have it already.
     if base_content is None and hash_before:
       base_content = self.GetFileContent(hash_before)
+      if base_content is None:
+        # Uploaded as too large, without reading it.
+        self.oversized_files.add(filename)
+        base_content = ""
 
     is_binary = self.IsImage(filename)
     if base_content:
@@ -2971,7 +3146,7 @@ def RealMain(argv, data=None):
   # already exists in an earlier patchset.
   base_hashes = ""
   for file, info in files.iteritems():
-    if not info[0] is None:
+    if not info[0] is None and file not in vcs.oversized_files:
       checksum = md5(info[0]).hexdigest()
       if base_hashes:
         base_hashes += "|"